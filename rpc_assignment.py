@@ -7,19 +7,38 @@ Name: [Your Name]
 ID: [Your Student ID]
 """
 
+import asyncio
+import bisect
+import multiprocessing
+import os
 import socket
+import select
+import selectors
+import signal
+import sys
 import json
 import time
 import threading
 import random
 import struct
 import hashlib
+import heapq
+import http.server
+import itertools
+import math
 import queue
+from array import array
 from enum import Enum
-from collections import defaultdict, deque
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from dataclasses import dataclass
-from typing import List, Dict, Optional, Tuple
+from dataclasses import dataclass, replace
+from typing import Callable, Iterable, List, Dict, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # Optional: CalculationEngine falls back to pure Python
+    np = None
 
 
 # ============================================================
@@ -45,7 +64,9 @@ SERVICE_INSTANCES = [
 # ============================================================
 
 # ===================== PROTOCOL DEFINITION =====================
-# DO NOT MODIFY THIS SECTION
+# Shared by every client and server: a change here must keep JSON frames
+# (type byte without FLAG_BINARY) readable by peers that predate the binary
+# codec, and must update both codecs together.
 
 class MessageType(Enum):
     """RPC message types"""
@@ -53,6 +74,9 @@ class MessageType(Enum):
     RESPONSE = 2
     HEALTH_CHECK = 3
     HEALTH_RESPONSE = 4
+    BATCH_REQUEST = 5
+    BATCH_RESPONSE = 6
+    STREAM_CHUNK = 7
 
 class StatusCode(Enum):
     """Response status codes"""
@@ -73,6 +97,17 @@ class Request:
     deadline: float  # Unix timestamp
     metadata: Dict[str, str]
 
+    def to_dict(self) -> dict:
+        """Convert to a wire dictionary"""
+        return {
+            'request_id': self.request_id,
+            'method': self.method,
+            'operation': self.operation,
+            'values': self.values if isinstance(self.values, list) else list(self.values),
+            'deadline': self.deadline,
+            'metadata': self.metadata,
+        }
+
 @dataclass
 class Response:
     """RPC Response structure"""
@@ -82,43 +117,944 @@ class Response:
     error_message: Optional[str]
     latency_ms: float
     server_id: str
+    retry_after_ms: Optional[float] = None  # Set when the server sheds load
+    # Server load when this response was built:
+    # [current_load, queue_depth, p50_ms, p99_ms] of recent processing time
+    load: Optional[List[float]] = None
+
+    def to_dict(self) -> dict:
+        """Convert to a wire dictionary"""
+        data = {
+            'request_id': self.request_id,
+            'status': self.status.value,
+            'result': self.result,
+            'error_message': self.error_message,
+            'latency_ms': self.latency_ms,
+            'server_id': self.server_id,
+        }
+        if self.retry_after_ms is not None:
+            data['retry_after_ms'] = self.retry_after_ms
+        if self.load is not None:
+            data['load'] = self.load
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Response':
+        """Build a Response from a wire dictionary"""
+        return cls(
+            request_id=data['request_id'],
+            status=StatusCode(data['status']),
+            result=data.get('result'),
+            error_message=data.get('error_message'),
+            latency_ms=data.get('latency_ms', 0.0),
+            server_id=data.get('server_id', ''),
+            retry_after_ms=data.get('retry_after_ms'),
+            load=data.get('load'),
+        )
+
+class Codec(Enum):
+    """Payload encodings a frame can use"""
+    JSON = "json"
+    BINARY = "binary"
+
+class BinaryCodec:
+    """Compact struct-based payloads for REQUEST, RESPONSE and batch frames
+
+    Fixed fields are packed little-endian with struct, strings are
+    length-prefixed UTF-8, and Request.values travels as one contiguous
+    float64 array. Anything without a fixed slot (metadata, optional
+    fields) rides along in a small trailing JSON blob.
+    """
+
+    SUPPORTED = (MessageType.REQUEST, MessageType.RESPONSE,
+                 MessageType.BATCH_REQUEST, MessageType.BATCH_RESPONSE,
+                 MessageType.STREAM_CHUNK)
+
+    # deadline, value count, extras length, then request_id/method/operation
+    REQUEST_HEAD = struct.Struct('<dII')
+    # status, flags, result, latency_ms, extras length
+    RESPONSE_HEAD = struct.Struct('<BBddI')
+    # item count, extras length, then request_id and length-prefixed items
+    BATCH_HEAD = struct.Struct('<II')
+    STR_LEN = struct.Struct('<H')
+    ITEM_LEN = struct.Struct('<I')
+
+    # current_load, queue_depth, p50_ms, p99_ms; present when flags has HAS_LOAD
+    LOAD = struct.Struct('<IIff')
+
+    HAS_RESULT = 0x01
+    HAS_ERROR = 0x02
+    HAS_LOAD = 0x04
+
+    REQUEST_FIELDS = ('request_id', 'method', 'operation', 'values', 'deadline')
+    RESPONSE_FIELDS = ('request_id', 'status', 'result', 'error_message',
+                       'latency_ms', 'server_id', 'load')
+    BATCH_FIELDS = ('request_id', 'requests', 'responses')
+
+    @staticmethod
+    def encode(msg_type: MessageType, data: dict) -> bytes:
+        """Encode a REQUEST, RESPONSE, batch or stream chunk dictionary"""
+        if msg_type in (MessageType.REQUEST, MessageType.STREAM_CHUNK):
+            return BinaryCodec._encode_request(data)
+        if msg_type == MessageType.RESPONSE:
+            return BinaryCodec._encode_response(data)
+        if msg_type == MessageType.BATCH_REQUEST:
+            return BinaryCodec._encode_batch(data, 'requests', BinaryCodec._encode_request)
+        return BinaryCodec._encode_batch(data, 'responses', BinaryCodec._encode_response)
+
+    @staticmethod
+    def decode(msg_type: MessageType, payload) -> dict:
+        """Decode a REQUEST, RESPONSE, batch or stream chunk payload
+
+        On little-endian hosts Request.values is returned as a float64
+        memoryview over payload itself, so it shares payload's lifetime.
+        """
+        if msg_type in (MessageType.REQUEST, MessageType.STREAM_CHUNK):
+            return BinaryCodec._decode_request(payload)
+        if msg_type == MessageType.RESPONSE:
+            return BinaryCodec._decode_response(payload)
+        if msg_type == MessageType.BATCH_REQUEST:
+            return BinaryCodec._decode_batch(payload, 'requests', BinaryCodec._decode_request)
+        return BinaryCodec._decode_batch(payload, 'responses', BinaryCodec._decode_response)
+
+    @staticmethod
+    def _encode_request(data: dict) -> bytes:
+        values = array('d', data['values'])
+        if sys.byteorder == 'big':
+            values.byteswap()
+        extras = BinaryCodec._pack_extras(data, BinaryCodec.REQUEST_FIELDS)
+        return b''.join((
+            BinaryCodec.REQUEST_HEAD.pack(data['deadline'], len(values), len(extras)),
+            BinaryCodec._pack_str(data['request_id']),
+            BinaryCodec._pack_str(data['method']),
+            BinaryCodec._pack_str(data['operation']),
+            extras,
+            values.tobytes(),
+        ))
+
+    @staticmethod
+    def _decode_request(payload) -> dict:
+        deadline, count, extras_len = BinaryCodec.REQUEST_HEAD.unpack_from(payload, 0)
+        offset = BinaryCodec.REQUEST_HEAD.size
+        request_id, offset = BinaryCodec._unpack_str(payload, offset)
+        method, offset = BinaryCodec._unpack_str(payload, offset)
+        operation, offset = BinaryCodec._unpack_str(payload, offset)
+        data = BinaryCodec._unpack_extras(payload, offset, extras_len)
+        offset += extras_len
+
+        raw = memoryview(payload)[offset:offset + count * 8]
+        if sys.byteorder == 'little':
+            values = raw.cast('d')  # Zero-copy view of the wire bytes
+        else:
+            values = array('d')
+            values.frombytes(raw)
+            values.byteswap()
+
+        data.update(request_id=request_id, method=method, operation=operation,
+                    values=values, deadline=deadline)
+        data.setdefault('metadata', {})
+        return data
+
+    @staticmethod
+    def _encode_response(data: dict) -> bytes:
+        result = data.get('result')
+        error = data.get('error_message')
+        load = data.get('load')
+        flags = ((BinaryCodec.HAS_RESULT if result is not None else 0) |
+                 (BinaryCodec.HAS_ERROR if error is not None else 0) |
+                 (BinaryCodec.HAS_LOAD if load is not None else 0))
+        extras = BinaryCodec._pack_extras(data, BinaryCodec.RESPONSE_FIELDS)
+        return b''.join((
+            BinaryCodec.RESPONSE_HEAD.pack(data['status'], flags,
+                                           result if result is not None else 0.0,
+                                           data.get('latency_ms', 0.0), len(extras)),
+            BinaryCodec.LOAD.pack(*load) if load is not None else b'',
+            BinaryCodec._pack_str(data['request_id']),
+            BinaryCodec._pack_str(data.get('server_id', '')),
+            BinaryCodec._pack_str(error or ''),
+            extras,
+        ))
+
+    @staticmethod
+    def _decode_response(payload) -> dict:
+        status, flags, result, latency_ms, extras_len = \
+            BinaryCodec.RESPONSE_HEAD.unpack_from(payload, 0)
+        offset = BinaryCodec.RESPONSE_HEAD.size
+        load = None
+        if flags & BinaryCodec.HAS_LOAD:
+            load = list(BinaryCodec.LOAD.unpack_from(payload, offset))
+            offset += BinaryCodec.LOAD.size
+        request_id, offset = BinaryCodec._unpack_str(payload, offset)
+        server_id, offset = BinaryCodec._unpack_str(payload, offset)
+        error, offset = BinaryCodec._unpack_str(payload, offset)
+        data = BinaryCodec._unpack_extras(payload, offset, extras_len)
+        if load is not None:
+            data['load'] = load
+        data.update(
+            request_id=request_id,
+            status=status,
+            result=result if flags & BinaryCodec.HAS_RESULT else None,
+            error_message=error if flags & BinaryCodec.HAS_ERROR else None,
+            latency_ms=latency_ms,
+            server_id=server_id,
+        )
+        return data
+
+    @staticmethod
+    def _encode_batch(data: dict, key: str, encode_item) -> bytes:
+        items = [encode_item(item) for item in data[key]]
+        extras = BinaryCodec._pack_extras(data, BinaryCodec.BATCH_FIELDS)
+        parts = [BinaryCodec.BATCH_HEAD.pack(len(items), len(extras)),
+                 BinaryCodec._pack_str(data['request_id']),
+                 extras]
+        for item in items:
+            parts.append(BinaryCodec.ITEM_LEN.pack(len(item)))
+            parts.append(item)
+        return b''.join(parts)
+
+    @staticmethod
+    def _decode_batch(payload, key: str, decode_item) -> dict:
+        count, extras_len = BinaryCodec.BATCH_HEAD.unpack_from(payload, 0)
+        offset = BinaryCodec.BATCH_HEAD.size
+        request_id, offset = BinaryCodec._unpack_str(payload, offset)
+        data = BinaryCodec._unpack_extras(payload, offset, extras_len)
+        offset += extras_len
+
+        view = memoryview(payload)
+        items = []
+        for _ in range(count):
+            (length,) = BinaryCodec.ITEM_LEN.unpack_from(payload, offset)
+            offset += BinaryCodec.ITEM_LEN.size
+            items.append(decode_item(view[offset:offset + length]))
+            offset += length
+        data.update(request_id=request_id)
+        data[key] = items
+        return data
+
+    @staticmethod
+    def _pack_str(value: str) -> bytes:
+        raw = value.encode('utf-8')
+        return BinaryCodec.STR_LEN.pack(len(raw)) + raw
+
+    @staticmethod
+    def _unpack_str(payload, offset: int) -> Tuple[str, int]:
+        (length,) = BinaryCodec.STR_LEN.unpack_from(payload, offset)
+        offset += BinaryCodec.STR_LEN.size
+        return str(payload[offset:offset + length], 'utf-8'), offset + length
+
+    @staticmethod
+    def _pack_extras(data: dict, fixed_fields: Tuple[str, ...]) -> bytes:
+        extras = {k: v for k, v in data.items()
+                  if k not in fixed_fields and v not in (None, {})}
+        return json.dumps(extras).encode('utf-8') if extras else b''
+
+    @staticmethod
+    def _unpack_extras(payload, offset: int, length: int) -> dict:
+        if not length:
+            return {}
+        return json.loads(str(payload[offset:offset + length], 'utf-8'))
 
 class Protocol:
-    """Wire protocol for RPC communication - PROVIDED"""
+    """Wire protocol for RPC communication - PROVIDED
+
+    Frame: 4-byte length, 1-byte message type, payload. The high bit of
+    the type byte marks a BinaryCodec payload; otherwise it is JSON.
+    """
+
+    FLAG_BINARY = 0x80
+    HEADER = struct.Struct('!IB')
+    MAX_FRAME_SIZE = 1 << 30  # Reject absurd lengths from corrupt headers
+    CODECS = [Codec.JSON.value, Codec.BINARY.value]
     
     @staticmethod
-    def encode_message(msg_type: MessageType, data: dict) -> bytes:
-        """Encode message for transmission"""
-        json_data = json.dumps(data).encode('utf-8')
-        length = len(json_data) + 1
-        header = struct.pack('!IB', length, msg_type.value)
-        return header + json_data
+    def encode_message(msg_type: MessageType, data: dict,
+                       codec: Codec = Codec.JSON) -> bytes:
+        """Encode message for transmission
+
+        Message types without a binary layout are always sent as JSON.
+        """
+        if codec == Codec.BINARY and msg_type in BinaryCodec.SUPPORTED:
+            payload = BinaryCodec.encode(msg_type, data)
+            type_byte = msg_type.value | Protocol.FLAG_BINARY
+        else:
+            payload = json.dumps(data).encode('utf-8')
+            type_byte = msg_type.value
+        return Protocol.HEADER.pack(len(payload) + 1, type_byte) + payload
     
     @staticmethod
     def decode_message(sock: socket.socket) -> Tuple[Optional[MessageType], Optional[dict]]:
         """Decode received message"""
+        msg_type, data, _ = Protocol.decode_frame(sock)
+        return msg_type, data
+
+    @staticmethod
+    def decode_frame(sock: socket.socket) -> Tuple[Optional[MessageType], Optional[dict],
+                                                   Optional[Codec]]:
+        """Decode received message, also reporting which codec it used
+
+        Reads exactly one frame. Long-lived connections should use a
+        FrameReader instead, which reuses its buffer across frames.
+        """
         try:
-            header = sock.recv(5)
-            if not header or len(header) < 5:
-                return None, None
-            length, msg_type = struct.unpack('!IB', header)
-            data = b''
-            while len(data) < length - 1:
-                chunk = sock.recv(min(4096, length - 1 - len(data)))
-                if not chunk:
-                    return None, None
-                data += chunk
-            return MessageType(msg_type), json.loads(data.decode('utf-8'))
+            header = Protocol._recv_exact(sock, Protocol.HEADER.size)
+            if header is None:
+                return None, None, None
+            length, type_byte = Protocol.HEADER.unpack(header)
+            if length < 1 or length > Protocol.MAX_FRAME_SIZE:
+                raise ValueError(f"Invalid frame length: {length}")
+            payload = Protocol._recv_exact(sock, length - 1)
+            if payload is None:
+                return None, None, None
+            return Protocol.decode_payload(type_byte, payload)
         except Exception as e:
             print(f"Protocol decode error: {e}")
-            return None, None
+            return None, None, None
+
+    @staticmethod
+    def _recv_exact(sock: socket.socket, size: int) -> Optional[bytearray]:
+        """Receive exactly size bytes with recv_into; None if the peer closes"""
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        received = 0
+        while received < size:
+            n = sock.recv_into(view[received:])
+            if n == 0:
+                return None
+            received += n
+        return buffer
+
+    @staticmethod
+    def decode_payload(type_byte: int, payload) -> Tuple[MessageType, dict, Codec]:
+        """Decode a frame payload given its raw type byte"""
+        msg_type = MessageType(type_byte & ~Protocol.FLAG_BINARY)
+        if type_byte & Protocol.FLAG_BINARY:
+            return msg_type, BinaryCodec.decode(msg_type, payload), Codec.BINARY
+        return msg_type, json.loads(str(payload, 'utf-8')), Codec.JSON
+
+class FrameReader:
+    """Reads frames from a socket into one reusable buffer
+
+    Bytes land in a single bytearray via recv_into, so a frame costs no
+    per-chunk allocations and partial header reads are handled naturally.
+    next_frame() returns a memoryview of the payload inside the buffer;
+    that view (and anything decoded from it without copying, such as
+    binary Request.values) is only valid until the next call.
+    """
+
+    def __init__(self, sock: socket.socket, initial_size: int = 8192,
+                 max_retained: int = 1 << 20):
+        self.sock = sock
+        self.initial_size = initial_size
+        self.max_retained = max_retained
+        self.buffer = bytearray(initial_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # First unconsumed byte
+        self.end = 0    # End of received data
+
+    def read_frame(self) -> Optional[Tuple[int, memoryview]]:
+        """Block until a whole frame is buffered; None once the peer closes"""
+        while True:
+            frame = self.next_frame()
+            if frame is not None:
+                return frame
+            if self.fill() == 0:
+                return None
+
+    def fill(self) -> int:
+        """Receive once into the free tail of the buffer; 0 means EOF"""
+        if self.end == len(self.buffer):
+            self._make_room(self.end - self.start + 1)
+        received = self.sock.recv_into(self.view[self.end:])
+        self.end += received
+        return received
+
+    def next_frame(self) -> Optional[Tuple[int, memoryview]]:
+        """Return (type_byte, payload view) for a buffered frame, if complete"""
+        available = self.end - self.start
+        if available < Protocol.HEADER.size:
+            self._make_room(Protocol.HEADER.size)
+            return None
+
+        length, type_byte = Protocol.HEADER.unpack_from(self.buffer, self.start)
+        if length < 1 or length > Protocol.MAX_FRAME_SIZE:
+            raise ValueError(f"Invalid frame length: {length}")
+        total = 4 + length
+        if available < total:
+            self._make_room(total)
+            return None
+
+        payload = self.view[self.start + Protocol.HEADER.size:self.start + total]
+        self.start += total
+        return type_byte, payload
+
+    def _make_room(self, frame_size: int):
+        """Make sure a frame_size-byte frame fits once fully received
+
+        A partial frame slides to the front of the buffer, which only grows
+        for frames larger than itself. An oversized buffer is dropped once
+        drained, so memory stays flat over a connection's life.
+        """
+        pending = self.end - self.start
+        if pending == 0:
+            self.start = self.end = 0
+            if len(self.buffer) > self.max_retained:
+                self.buffer = bytearray(self.initial_size)
+                self.view = memoryview(self.buffer)
+        if len(self.buffer) - self.start >= frame_size:
+            return
+
+        if frame_size <= len(self.buffer):
+            self.view[:pending] = self.view[self.start:self.end]
+        else:
+            # Allocate rather than resize: earlier payload views may still exist
+            grown = bytearray(max(frame_size, 2 * len(self.buffer)))
+            grown[:pending] = self.view[self.start:self.end]
+            self.buffer = grown
+            self.view = memoryview(self.buffer)
+        self.start, self.end = 0, pending
+
+# ===================== CALCULATION ENGINE =====================
+
+class CalculationEngine:
+    """Reductions behind ServiceInstance._calculate
+
+    Small inputs run on Python builtins; larger ones are handed to NumPy
+    when it is installed. Binary requests arrive as float64 buffers that
+    NumPy wraps without copying, so they switch over at buffer_threshold.
+    JSON lists must be converted element by element first, which costs
+    more than the builtins' own C loops (see bench-calc), so by default
+    lists stay on the Python path; set list_threshold to override.
+
+    Both paths share the same semantics:
+    - sum of no values is 0.0 and multiply is 1.0; avg, min and max of no
+      values raise ValueError
+    - a NaN anywhere in values makes the result NaN
+    - a sum, avg or multiply that overflows to infinity from finite
+      inputs raises OverflowError
+    """
+
+    OPERATIONS = ('sum', 'avg', 'min', 'max', 'multiply')
+
+    def __init__(self, buffer_threshold: int = 256, list_threshold: Optional[int] = None,
+                 use_numpy: bool = True):
+        self.buffer_threshold = buffer_threshold
+        self.list_threshold = list_threshold
+        self.use_numpy = use_numpy and np is not None
+
+    def calculate(self, operation: str, values) -> float:
+        """Apply operation to values"""
+        if operation not in self.OPERATIONS:
+            raise ValueError(f"Unknown operation: {operation}")
+        if len(values) == 0:
+            if operation == 'sum':
+                return 0.0
+            if operation == 'multiply':
+                return 1.0
+            raise ValueError(f"{operation} of empty values")
+
+        if self._should_vectorize(values):
+            result = self._calculate_numpy(operation, values)
+        else:
+            result = self._calculate_python(operation, values)
+
+        if math.isinf(result) and operation in ('sum', 'avg', 'multiply'):
+            if not self._any_inf(values):
+                raise OverflowError(f"{operation} overflowed float64")
+        return result
+
+    def _should_vectorize(self, values) -> bool:
+        if not self.use_numpy:
+            return False
+        if isinstance(values, list):
+            return self.list_threshold is not None and len(values) >= self.list_threshold
+        return len(values) >= self.buffer_threshold
+
+    @staticmethod
+    def _as_array(values):
+        """View values as a float64 ndarray, without copying buffers"""
+        if isinstance(values, (memoryview, array)):
+            return np.frombuffer(values, dtype=np.float64)
+        return np.asarray(values, dtype=np.float64)
+
+    def _calculate_numpy(self, operation: str, values) -> float:
+        data = self._as_array(values)
+        with np.errstate(over='ignore', invalid='ignore'):
+            if operation == 'sum':
+                return float(data.sum())
+            elif operation == 'avg':
+                return float(data.mean())
+            elif operation == 'min':
+                return float(data.min())  # NaN propagates
+            elif operation == 'max':
+                return float(data.max())
+            return float(data.prod())
+
+    @staticmethod
+    def _calculate_python(operation: str, values) -> float:
+        if operation == 'sum':
+            return float(sum(values))
+        elif operation == 'avg':
+            return float(sum(values)) / len(values)
+        elif operation == 'multiply':
+            return float(math.prod(values))
+        # min/max would silently skip NaN depending on its position; a sum
+        # is NaN whenever a NaN is present, so only then scan for one
+        if math.isnan(sum(values)) and any(map(math.isnan, values)):
+            return math.nan
+        return float(min(values) if operation == 'min' else max(values))
+
+    def _any_inf(self, values) -> bool:
+        if self._should_vectorize(values):
+            return bool(np.isinf(self._as_array(values)).any())
+        return any(map(math.isinf, values))
+
+class StreamAccumulator:
+    """Running reduction over values that arrive in chunks
+
+    Each chunk is reduced by a CalculationEngine and folded into the
+    running result, so only one chunk is ever held. Results follow the
+    engine's rules for NaN, empty input and overflow, as if calculate()
+    had seen all the values at once.
+    """
+
+    def __init__(self, engine: CalculationEngine, operation: str):
+        if operation not in engine.OPERATIONS:
+            raise ValueError(f"Unknown operation: {operation}")
+        self.engine = engine
+        self.operation = operation
+        self.count = 0
+        self.total = 1.0 if operation == 'multiply' else 0.0  # sum, avg, multiply
+        self.extreme = None  # min, max
+        self.saw_inf = False
+        self.next_seq = 0
+
+    def add(self, values):
+        """Fold one chunk of values into the running result"""
+        if len(values) == 0:
+            return
+        if self.operation in ('min', 'max'):
+            part = self.engine.calculate(self.operation, values)
+            self.count += len(values)
+            if self.extreme is None or math.isnan(part):
+                self.extreme = part
+            elif not math.isnan(self.extreme):
+                self.extreme = min(self.extreme, part) if self.operation == 'min' \
+                    else max(self.extreme, part)
+            return
+
+        if self.operation == 'multiply':
+            part = self.engine.calculate('multiply', values)
+            self.total *= part
+        else:
+            part = self.engine.calculate('sum', values)
+            self.total += part
+        self.count += len(values)
+        self.saw_inf = self.saw_inf or math.isinf(part)
+        if math.isinf(self.total) and not self.saw_inf:
+            raise OverflowError(f"{self.operation} overflowed float64")
+
+    def result(self) -> float:
+        """Final result over every value added so far"""
+        if self.operation in ('min', 'max'):
+            if self.extreme is None:
+                raise ValueError(f"{self.operation} of empty values")
+            return self.extreme
+        if self.operation == 'avg':
+            if not self.count:
+                raise ValueError("avg of empty values")
+            return self.total / self.count
+        return self.total
+
+    def partial(self) -> Optional[float]:
+        """Running result, or None while it is still undefined"""
+        if self.count == 0 and self.operation in ('avg', 'min', 'max'):
+            return None
+        return self.result()
+
+# ===================== RESULT CACHE =====================
+
+class ResultCache:
+    """Thread-safe LRU cache of calculation results
+
+    Keys are the operation plus the raw float64 bytes of values, so a
+    lookup costs one pass of Python's bytes hash and a hit is an exact
+    match: a hash collision can never return another input's result.
+    The cache is bounded both by entry count and by the bytes its keys
+    and entries take; inputs longer than max_values are never cached,
+    since hashing them costs more than the reductions themselves.
+    Entries optionally expire ttl seconds after they were stored.
+    """
+
+    ENTRY_OVERHEAD = 120  # approximate bytes per entry besides its key
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 16 << 20,
+                 ttl: Optional[float] = None, max_values: int = 4096):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_values = max_values
+        self.entries: OrderedDict = OrderedDict()  # key -> (value, expires_at)
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def key(self, operation: str, values) -> Optional[bytes]:
+        """Cache key for operation over values, or None if not cacheable"""
+        if len(values) > self.max_values:
+            return None
+        try:
+            if isinstance(values, (memoryview, array)):
+                raw = bytes(values)
+            else:
+                raw = array('d', values).tobytes()
+        except (TypeError, ValueError):
+            return None
+        return operation.encode('utf-8') + b'\0' + raw
+
+    def get(self, key: bytes):
+        """Return the cached value for key, or None on a miss"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or time.time() < expires_at:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._remove(key)
+            self.misses += 1
+            return None
+
+    def put(self, key: bytes, value):
+        """Store value under key, evicting least recently used entries"""
+        size = len(key) + self.ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        expires_at = time.time() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, expires_at)
+            self.size_bytes += size
+            while len(self.entries) > self.max_entries or self.size_bytes > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key: bytes):
+        del self.entries[key]
+        self.size_bytes -= len(key) + self.ENTRY_OVERHEAD
+
+    def stats(self) -> Dict[str, int]:
+        """Counters for health and stats reports"""
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.size_bytes,
+            }
+
+# ===================== METRICS =====================
+
+class Histogram:
+    """Log-bucketed histogram in the style of HdrHistogram
+
+    Values are counted in integer multiples of unit. The first 32 units
+    get a bucket each; above that every power of two is split into 16
+    buckets, each at most 1/16 of its lower bound wide, while the whole
+    range up to 2**37 units fits in 544 preallocated counters.
+    Percentiles report the midpoint of the bucket they fall in, so they
+    are off from the recorded value by at most half a bucket: about 3%.
+    Every record takes the histogram's lock for the three increments,
+    which is uncontended when each thread or instance records into its
+    own histogram; histograms with the same unit merge by adding
+    counters, so per-thread, per-instance or per-process histograms can
+    be combined before reading percentiles off the sum.
+    """
+
+    SUB_BUCKETS = 16
+    MAX_SHIFT = 32
+
+    def __init__(self, unit: float = 1e-6):
+        self.unit = unit
+        self.counts = array('q', bytes(8 * (self.MAX_SHIFT + 2) * self.SUB_BUCKETS))
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def _bounds(self, index: int) -> Tuple[float, float]:
+        """Lowest and highest value, in units, counted in bucket index"""
+        if index < 2 * self.SUB_BUCKETS:
+            return index, index
+        shift = index // self.SUB_BUCKETS - 1
+        mantissa = index - shift * self.SUB_BUCKETS
+        return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+    def record(self, value: float):
+        """Count one value, given in the same scale as unit, under the lock"""
+        units = int(value / self.unit)
+        if units < 32:
+            index = units if units > 0 else 0
+        else:
+            # 16 buckets per power of two: the top five bits pick the bucket
+            shift = units.bit_length() - 5
+            index = (shift << 4) + (units >> shift) if shift <= self.MAX_SHIFT else -1
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def merge(self, other: 'Histogram'):
+        """Add other's counts into this histogram"""
+        if other.unit != self.unit:
+            raise ValueError("cannot merge histograms with different units")
+        with other.lock:
+            counts, count, total = array('q', other.counts), other.count, other.sum
+        with self.lock:
+            for index, n in enumerate(counts):
+                if n:
+                    self.counts[index] += n
+            self.count += count
+            self.sum += total
+
+    def snapshot(self) -> 'Histogram':
+        """A copy that later recordings do not touch"""
+        copy = Histogram(self.unit)
+        copy.merge(self)
+        return copy
+
+    def percentile(self, p: float) -> float:
+        """Value below which p percent of recorded values fall, 0 if empty"""
+        with self.lock:
+            rank = max(1, math.ceil(self.count * p / 100.0))
+            if not self.count:
+                return 0.0
+            seen = 0
+            for index, n in enumerate(self.counts):
+                seen += n
+                if seen >= rank:
+                    low, high = self._bounds(index)
+                    return (low + high) / 2.0 * self.unit
+        return 0.0
+
+    def summary(self, scale: float = 1.0) -> dict:
+        """Count, mean and the percentiles reported in stats, multiplied by scale"""
+        return {
+            'count': self.count,
+            'mean': self.sum / self.count * scale if self.count else 0.0,
+            'p50': self.percentile(50) * scale,
+            'p99': self.percentile(99) * scale,
+            'p999': self.percentile(99.9) * scale,
+        }
+
+class MetricsRegistry:
+    """Named histograms and gauges rendered in Prometheus text format
+
+    Histograms are created on first use and exported as summaries: the
+    quantiles are computed here, from the full-resolution buckets,
+    rather than approximated by a scraper from coarse ones. Gauges and
+    counters that already live elsewhere (loads, rejection counts) come
+    from collector callbacks run at scrape time, so nothing extra is
+    kept up to date on the hot path.
+    """
+
+    QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Histogram] = {}
+        self.help: Dict[str, str] = {}
+        # Each returns (name, kind, help, labels, value) samples
+        self.collectors: List[Callable[[], Iterable[Tuple[str, str, str, dict, float]]]] = []
+
+    def histogram(self, name: str, help: str, unit: float = 1e-6, **labels) -> Histogram:
+        """The histogram for name and labels, created on first use"""
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram(unit)
+                    self.help[name] = help
+        return histogram
+
+    def merged(self, name: str) -> Optional[Histogram]:
+        """All of name's histograms added together, whatever their labels"""
+        with self.lock:
+            parts = [h for (n, _), h in self.histograms.items() if n == name]
+        if not parts:
+            return None
+        total = Histogram(parts[0].unit)
+        for part in parts:
+            total.merge(part)
+        return total
+
+    def add_collector(self, collector: Callable[[], Iterable[Tuple[str, str, str, dict, float]]]):
+        self.collectors.append(collector)
+
+    @staticmethod
+    def _labels(labels, extra: str = '') -> str:
+        parts = [f'{name}="{value}"' for name, value in labels]
+        if extra:
+            parts.append(extra)
+        return '{' + ','.join(parts) + '}' if parts else ''
+
+    def render(self) -> str:
+        """Every metric in the Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+        described = set()
+        for (name, labels), histogram in histograms:
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {self.help[name]}")
+                lines.append(f"# TYPE {name} summary")
+            for q in self.QUANTILES:
+                quantile = self._labels(labels, 'quantile="%s"' % q)
+                lines.append(f"{name}{quantile} {histogram.percentile(q * 100):.6g}")
+            lines.append(f"{name}_sum{self._labels(labels)} {histogram.sum:.6g}")
+            lines.append(f"{name}_count{self._labels(labels)} {histogram.count}")
+        for collector in self.collectors:
+            for name, kind, help, labels, value in collector():
+                if name not in described:
+                    described.add(name)
+                    lines.append(f"# HELP {name} {help}")
+                    lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name}{self._labels(sorted(labels.items()))} {value:.6g}")
+        return '\n'.join(lines) + '\n'
+
+class MetricsServer:
+    """Serves a MetricsRegistry over HTTP on a side port for scrapers
+
+    Any GET is answered with the registry's text; it runs on its own
+    daemon thread so a slow scraper never touches the RPC port.
+    """
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self, registry: MetricsRegistry, port: int):
+        self.registry = registry
+        self.port = port
+        self.server = None
+
+    def start(self) -> 'MetricsServer':
+        registry = self.registry
+        content_type = self.CONTENT_TYPE
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Scrapes every few seconds would drown the console
+
+        self.server = http.server.ThreadingHTTPServer(('', self.port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True,
+                         name=f"metrics-{self.port}").start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
 
 # ===================== SERVICE IMPLEMENTATION =====================
 
+class ClientConnection:
+    """Server-side state for one accepted socket
+
+    Only the I/O loop reads from the socket; workers answer the requests
+    it queued concurrently, each reply whole under send_lock. A peer that
+    stops sending (EOF) keeps the socket open until every request it
+    sent has been answered.
+    """
+
+    def __init__(self, sock: socket.socket, addr):
+        self.sock = sock
+        self.addr = addr
+        self.reader = FrameReader(sock)
+        self.send_lock = threading.Lock()
+        self.closed = False
+        # Open streaming aggregations by request_id; they die with the socket
+        self.streams: Dict[str, StreamAccumulator] = {}
+        # Requests queued for workers and not answered yet
+        self.state_lock = threading.Lock()
+        self.in_flight = 0
+        self.input_ended = False
+
+    def start_request(self):
+        """Count a request handed to a worker"""
+        with self.state_lock:
+            self.in_flight += 1
+
+    def finish_request(self):
+        """Count a request answered; close if the peer is gone and it was the last"""
+        with self.state_lock:
+            self.in_flight -= 1
+            done = self.input_ended and self.in_flight == 0
+        if done:
+            self.close()
+
+    def end_input(self):
+        """The peer sent EOF; close now or once its last request is answered"""
+        with self.state_lock:
+            self.input_ended = True
+            done = self.in_flight == 0
+        if done:
+            self.close()
+
+    def send(self, frame: bytes, timeout: float):
+        """Write a whole frame to the non-blocking socket"""
+        view = memoryview(frame)
+        with self.send_lock:
+            while view:
+                try:
+                    sent = self.sock.send(view)
+                    view = view[sent:]
+                except BlockingIOError:
+                    _, writable, _ = select.select([], [self.sock], [], timeout)
+                    if not writable:
+                        raise TimeoutError(f"Send to {self.addr} timed out")
+
+    def close(self):
+        """Close the socket once"""
+        if not self.closed:
+            self.closed = True
+            self.sock.close()
+
 class ServiceInstance:
-    """Microservice instance - STUDENT MUST IMPLEMENT MARKED SECTIONS"""
+    """Microservice instance - STUDENT MUST IMPLEMENT MARKED SECTIONS
+
+    One I/O thread multiplexes every connection with a selector and hands
+    complete requests to a fixed pool of worker threads through a bounded
+    queue. Requests beyond max_load or the queue bound are refused at once
+    with UNAVAILABLE and a retry-after hint. A connection keeps being read
+    while its requests run, so requests pipelined on one socket are served
+    concurrently and answered in the order they finish, matched to their
+    callers by request_id.
+    """
+
+    # Frames that are admitted and run as work rather than answered inline
+    WORK_TYPES = (MessageType.REQUEST, MessageType.BATCH_REQUEST, MessageType.STREAM_CHUNK)
+    # Seconds between recomputing the percentiles in load reports
+    LOAD_SUMMARY_INTERVAL = 0.05
     
-    def __init__(self, instance_id: str, port: int):
+    def __init__(self, instance_id: str, port: int, num_workers: int = 8,
+                 queue_size: int = 256, backlog: int = 1024, cache_entries: int = 0,
+                 cache_bytes: int = 16 << 20, metrics_port: Optional[int] = None):
         self.instance_id = instance_id
         self.port = port
         self.socket = None
@@ -129,83 +1065,512 @@ class ServiceInstance:
         self.max_load = 100
         self.healthy = True
         self.processing_times = deque(maxlen=100)
+        self.load_summary = (0.0, 0.0)  # p50, p99 of processing_times (ms)
+        self.load_summary_at = 0.0
         
         # Fault injection (for testing)
         self.inject_latency = 0
         self.error_rate = 0.0
+
+        self.engine = CalculationEngine()
+        # Optional cache of results for repeated (operation, values) pairs
+        self.cache = ResultCache(cache_entries, cache_bytes) if cache_entries > 0 else None
+        # Batch items with at least this many values may run in parallel
+        self.parallel_batch_threshold = 100000
+        self.batch_executor = None
+
+        # Concurrency control
+        self.num_workers = num_workers
+        self.backlog = backlog
+        self.send_timeout = 10.0  # seconds
+        self.work_queue = queue.Queue(maxsize=queue_size)
+        self.load_lock = threading.Lock()
+        self.rejected_requests = 0
+        self.expired_requests = 0  # Dropped unanswered: deadline passed first
+
+        # Latency histograms, scraped from metrics_port when one is given
+        self.metrics = MetricsRegistry()
+        self.metrics.add_collector(self._collect_metrics)
+        self.processing_histogram = self.metrics.histogram(
+            'rpc_server_processing_seconds', 'Time from receiving a request to its response',
+            instance=instance_id)
+        self.queue_wait_histogram = self.metrics.histogram(
+            'rpc_server_queue_wait_seconds', 'Time admitted work waited before it started',
+            instance=instance_id)
+        self.metrics_port = metrics_port
+        self.metrics_server = None
+
+        # I/O loop state; shutdown() writes to _wakeup_w to interrupt select()
+        self.selector = None
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_w.setblocking(False)  # A full pipe already means a wakeup is due
+        self.workers: List[threading.Thread] = []
+
+        # Multi-process serving: share the port and report group-wide load
+        self.reuse_port = False
+        self.cluster = None
+        self.cluster_slot = None
     
     def start(self):
         """Start service instance"""
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.socket.bind(('', self.port))
-        self.socket.listen(10)
+        self.socket.listen(self.backlog)
+        self.socket.setblocking(False)
         self.running = True
+
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.socket, selectors.EVENT_READ)
+        self._wakeup_r.setblocking(False)
+        self.selector.register(self._wakeup_r, selectors.EVENT_READ)
+
+        for i in range(self.num_workers):
+            worker = threading.Thread(target=self._worker_loop, daemon=True,
+                                      name=f"{self.instance_id}-worker-{i}")
+            worker.start()
+            self.workers.append(worker)
+        self._start_metrics()
         
         print(f"Service {self.instance_id} listening on port {self.port}")
         
-        while self.running:
+        try:
+            while self.running:
+                for key, _ in self.selector.select(timeout=1.0):
+                    if key.fileobj is self.socket:
+                        self._accept_connections()
+                    elif key.fileobj is self._wakeup_r:
+                        self._wakeup_r.recv(4096)
+                    else:
+                        self._read_connection(key.data)
+        except OSError:
+            pass  # Listening socket closed by shutdown()
+        finally:
+            self._stop_workers()
+            for key in list(self.selector.get_map().values()):
+                if isinstance(key.data, ClientConnection):
+                    key.data.close()
+            self.selector.close()
+
+    def _accept_connections(self):
+        """Accept every pending connection and start watching it"""
+        while True:
             try:
                 client_sock, addr = self.socket.accept()
-                if self.current_load < self.max_load:
-                    threading.Thread(target=self.handle_request, 
-                                   args=(client_sock,), daemon=True).start()
-                else:
-                    self._send_error(client_sock, StatusCode.UNAVAILABLE, 
-                                   "Service overloaded")
-                    client_sock.close()
-            except:
-                break
+            except (BlockingIOError, InterruptedError):
+                return
+            client_sock.setblocking(False)
+            client_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = ClientConnection(client_sock, addr)
+            self.selector.register(client_sock, selectors.EVENT_READ, conn)
+
+    def _read_connection(self, conn: ClientConnection):
+        """Pull available bytes off a connection and dispatch whole frames"""
+        try:
+            received = conn.reader.fill()
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            received = 0
+        if received == 0:
+            self.selector.unregister(conn.sock)
+            conn.end_input()
+            return
+        self._dispatch_frames(conn)
+
+    def _dispatch_frames(self, conn: ClientConnection):
+        """Handle every buffered frame, queueing requests for the workers
+
+        Health checks and refusals are answered inline. Binary payloads
+        decode to views of the read buffer, which the next read reuses,
+        so a binary frame is copied out first; JSON decodes to new objects.
+        """
+        try:
+            while True:
+                frame = conn.reader.next_frame()
+                if frame is None:
+                    return
+                type_byte, payload = frame
+                if type_byte & Protocol.FLAG_BINARY:
+                    payload = bytes(payload)
+                msg_type, data, codec = Protocol.decode_payload(type_byte, payload)
+
+                if msg_type in self.WORK_TYPES:
+                    retry_after_ms = self._admit()
+                    if retry_after_ms is None:
+                        conn.start_request()
+                        self.work_queue.put_nowait((conn, msg_type, data, codec, time.time()))
+                        continue
+                    reply_type, reply = self._overload_reply(msg_type, data, retry_after_ms)
+                    conn.send(Protocol.encode_message(reply_type, reply, codec),
+                              self.send_timeout)
+
+                elif msg_type == MessageType.HEALTH_CHECK:
+                    health = self._health_status()
+                    if 'request_id' in data:
+                        health['request_id'] = data['request_id']
+                    conn.send(Protocol.encode_message(
+                        MessageType.HEALTH_RESPONSE, health), self.send_timeout)
+        except Exception as e:
+            print(f"Error handling connection {conn.addr}: {e}")
+            if conn.sock in self.selector.get_map():
+                self.selector.unregister(conn.sock)
+            conn.close()
+
+    def _admit(self) -> Optional[float]:
+        """Atomically reserve capacity for a request
+
+        Returns None when admitted, otherwise a retry-after hint in ms
+        based on how long the current backlog should take to drain.
+        """
+        with self.load_lock:
+            if self.current_load < self.max_load and not self.work_queue.full():
+                self.current_load += 1
+                return None
+            self.rejected_requests += 1
+            backlog = self.current_load
+        times = list(self.processing_times)
+        avg_ms = (sum(times) / len(times) * 1000) if times else 1.0
+        return max(1.0, backlog * avg_ms / self.num_workers)
+
+    def _worker_loop(self):
+        """Run queued requests, each replying on the connection it came from"""
+        while True:
+            item = self.work_queue.get()
+            if item is None:
+                return
+            conn, msg_type, data, codec, queued_at = item
+            self.queue_wait_histogram.record(time.time() - queued_at)
+            try:
+                self.handle_request(conn, msg_type, data, codec)
+            except Exception as e:
+                # Answer rather than lose the worker and leave the caller waiting
+                print(f"Error handling request from {conn.addr}: {e}")
+                try:
+                    reply_type, reply = self._error_reply(
+                        msg_type, data, StatusCode.INTERNAL_ERROR, str(e))
+                    conn.send(Protocol.encode_message(reply_type, reply, codec),
+                              self.send_timeout)
+                except Exception:
+                    conn.close()  # Not even an error reply gets through
+            finally:
+                with self.load_lock:
+                    self.current_load -= 1
+                conn.finish_request()
+
+    def _stop_workers(self):
+        """Tell every worker to exit once the queue drains"""
+        for _ in self.workers:
+            self.work_queue.put(None)
+        self.workers = []
+        if self.batch_executor is not None:
+            self.batch_executor.shutdown(wait=False)
     
-    def handle_request(self, client_sock: socket.socket):
-        """Handle incoming RPC request"""
-        self.current_load += 1
+    def handle_request(self, conn: ClientConnection, msg_type: MessageType,
+                       data: dict, codec: Codec):
+        """Handle incoming RPC request and reply in the client's codec"""
+        if msg_type == MessageType.BATCH_REQUEST:
+            reply_type, reply = MessageType.BATCH_RESPONSE, self._process_batch(data)
+        elif msg_type == MessageType.STREAM_CHUNK:
+            reply_type = MessageType.RESPONSE
+            reply = self._process_stream_chunk(conn.streams, data).to_dict()
+        else:
+            reply_type, reply = MessageType.RESPONSE, self._process_request(data).to_dict()
+        try:
+            conn.send(Protocol.encode_message(reply_type, reply, codec), self.send_timeout)
+        except OSError as e:
+            print(f"Error sending response to {conn.addr}: {e}")
+            conn.close()
+
+    def _overload_reply(self, msg_type: MessageType, data: dict,
+                        retry_after_ms: float) -> Tuple[MessageType, dict]:
+        """Build the UNAVAILABLE reply for a request or batch refused at admission"""
+        return self._error_reply(msg_type, data, StatusCode.UNAVAILABLE,
+                                 "Service overloaded", retry_after_ms)
+
+    def _error_reply(self, msg_type: MessageType, data: dict, status: StatusCode,
+                     error: str, retry_after_ms: Optional[float] = None
+                     ) -> Tuple[MessageType, dict]:
+        """Build a reply giving every request in a frame the same error status
+
+        data may be anything a client sent, so nothing in it is trusted.
+        """
+        def failure(item) -> dict:
+            request_id = item.get('request_id', 'unknown') if isinstance(item, dict) else 'unknown'
+            response = self._make_response(str(request_id), status, error=error)
+            response.retry_after_ms = retry_after_ms
+            return response.to_dict()
+
+        if msg_type == MessageType.BATCH_REQUEST:
+            if not isinstance(data, dict):
+                data = {}
+            items = data.get('requests', [])
+            return MessageType.BATCH_RESPONSE, {
+                'request_id': str(data.get('request_id', 'unknown')),
+                'server_id': self.instance_id,
+                'responses': [failure(item) for item in items] if isinstance(items, list) else [],
+            }
+        return MessageType.RESPONSE, failure(data)
+
+    def _process_batch(self, data: dict) -> dict:
+        """Run every sub-request of a batch and collect per-item responses
+
+        Injected latency applies once per batch, like one slow round trip.
+        Items large enough for NumPy, which releases the GIL, run in
+        parallel on batch_executor; the rest run inline.
+        """
         start_time = time.time()
-        
+        if self.inject_latency > 0:
+            time.sleep(self.inject_latency / 1000.0)
+        return self._run_batch(data, start_time)
+
+    def _run_batch(self, data: dict, start_time: float) -> dict:
+        """Run a batch whose latency, if any, was already injected"""
+        items = data.get('requests', [])
+        responses: List[Optional[Response]] = [None] * len(items)
+        parallel = []
+        for index, item in enumerate(items):
+            request, rejection = self._parse_request(item, start_time)
+            if rejection is not None:
+                responses[index] = rejection
+            elif (self.engine.use_numpy and
+                    len(request.values) >= self.parallel_batch_threshold):
+                parallel.append((index, request))
+            else:
+                responses[index] = self._execute_request(request, start_time)
+
+        if len(parallel) > 1:
+            futures = [(index, self._get_batch_executor().submit(
+                            self._execute_request, request, start_time))
+                       for index, request in parallel]
+            for index, future in futures:
+                responses[index] = future.result()
+        else:
+            for index, request in parallel:
+                responses[index] = self._execute_request(request, start_time)
+
+        return {
+            'request_id': data.get('request_id', 'unknown'),
+            'server_id': self.instance_id,
+            'responses': [response.to_dict() for response in responses],
+        }
+
+    def _get_batch_executor(self) -> ThreadPoolExecutor:
+        """Thread pool for parallel batch items, created on first use"""
+        with self.load_lock:
+            if self.batch_executor is None:
+                self.batch_executor = ThreadPoolExecutor(
+                    max_workers=os.cpu_count() or 1,
+                    thread_name_prefix=f"{self.instance_id}-batch")
+            return self.batch_executor
+
+    def _process_request(self, data: dict) -> Response:
+        """Execute a single RPC request and build its response"""
+        start_time = time.time()
+        request, rejection = self._parse_request(data, start_time)
+        if rejection is not None:
+            return rejection
+
+        # Fault injection (for testing)
+        if self.inject_latency > 0:
+            time.sleep(self.inject_latency / 1000.0)
+        return self._execute_request(request, start_time)
+
+    def _process_stream_chunk(self, streams: Dict[str, StreamAccumulator],
+                              data: dict) -> Response:
+        """Fold one chunk of a streaming aggregation into its accumulator"""
+        start_time = time.time()
+        request, rejection = self._parse_request(data, start_time)
+        if rejection is not None:
+            streams.pop(rejection.request_id, None)
+            return rejection
+
+        if self.inject_latency > 0:
+            time.sleep(self.inject_latency / 1000.0)
+        return self._apply_stream_chunk(streams, request, start_time)
+
+    def _apply_stream_chunk(self, streams: Dict[str, StreamAccumulator],
+                            request: Request, start_time: float) -> Response:
+        """Add a parsed chunk to its stream and acknowledge it
+
+        metadata carries the chunk's seq and whether it is final. Other
+        chunks are answered with the running result; the final one with
+        the result and closes the stream. An injected fault leaves the
+        stream untouched, so the client may resend the same chunk.
+        """
+        if random.random() < self.error_rate:
+            return self._make_response(request.request_id, StatusCode.UNAVAILABLE,
+                                       error="Injected fault", start_time=start_time)
+        seq = request.metadata.get('seq', 0)
         try:
-            msg_type, data = Protocol.decode_message(client_sock)
-            
-            if msg_type == MessageType.REQUEST:
-                # TODO: STUDENT MUST IMPLEMENT
-                # 1. Parse request from data dictionary: request = Request(**data)
-                # 2. Check if deadline has passed: if time.time() > request.deadline
-                # 3. Apply fault injection if configured (for testing):
-                #    - if self.inject_latency > 0: time.sleep(self.inject_latency / 1000.0)
-                #    - if random.random() < self.error_rate: raise error
-                # 4. Perform the calculation using self._calculate()
-                # 5. Create Response object with appropriate status and result
-                # 6. Send response using Protocol.encode_message()
-                
-                # Your code here...
-                pass
-                
-            elif msg_type == MessageType.HEALTH_CHECK:
-                # TODO: STUDENT MUST IMPLEMENT
-                # Return health status including:
-                # - healthy: self.healthy
-                # - current_load: self.current_load
-                # - average_latency: calculate from self.processing_times
-                
-                # Your code here...
-                pass
-                
+            stream = streams.get(request.request_id)
+            if stream is None:
+                if seq != 0:
+                    raise ValueError(f"Unknown stream {request.request_id}")
+                stream = StreamAccumulator(self.engine, request.operation)
+                streams[request.request_id] = stream
+            if seq != stream.next_seq:
+                raise ValueError(f"Stream chunk {seq} out of order, "
+                                 f"expected {stream.next_seq}")
+            stream.add(request.values)
+            stream.next_seq += 1
+            if not request.metadata.get('final'):
+                return self._make_response(request.request_id, StatusCode.OK,
+                                           result=stream.partial(), start_time=start_time)
+            result = stream.result()
         except Exception as e:
-            print(f"Error handling request: {e}")
-            self._send_error(client_sock, StatusCode.INTERNAL_ERROR, str(e))
-        finally:
-            self.current_load -= 1
-            processing_time = time.time() - start_time
-            self.processing_times.append(processing_time)
-            client_sock.close()
-    
+            streams.pop(request.request_id, None)
+            return self._make_response(request.request_id, StatusCode.INTERNAL_ERROR,
+                                       error=str(e), start_time=start_time)
+        del streams[request.request_id]
+        return self._make_response(request.request_id, StatusCode.OK, result=result,
+                                   start_time=start_time)
+
+    def _parse_request(self, data: dict,
+                       start_time: float) -> Tuple[Optional[Request], Optional[Response]]:
+        """Parse a request, or return the response refusing it"""
+        request_id = data.get('request_id', 'unknown')
+        try:
+            request = Request(**data)
+            request.deadline = float(request.deadline)
+            if isinstance(request.values, (str, bytes, dict)) or not hasattr(request.values, '__len__'):
+                raise TypeError(f"values must be a sequence of numbers, "
+                                f"not {type(request.values).__name__}")
+        except (TypeError, ValueError) as e:
+            return None, self._make_response(request_id, StatusCode.INTERNAL_ERROR,
+                                             error=f"Malformed request: {e}",
+                                             start_time=start_time)
+        if time.time() > request.deadline:
+            return None, self._deadline_exceeded(request_id)
+        return request, None
+
+    def _deadline_exceeded(self, request_id: str) -> Response:
+        """Drop a request nobody waits for any more, without computing it
+
+        The response is not stamped with a start time, so dropped work
+        does not skew processing_times.
+        """
+        with self.load_lock:
+            self.expired_requests += 1
+        return self._make_response(request_id, StatusCode.DEADLINE_EXCEEDED,
+                                   error="Deadline exceeded before processing")
+
+    def _execute_request(self, request: Request, start_time: float) -> Response:
+        """Apply error injection and run the calculation
+
+        Work whose deadline passed while it waited (behind injected
+        latency or earlier batch items) is dropped instead.
+        """
+        if time.time() > request.deadline:
+            return self._deadline_exceeded(request.request_id)
+        if random.random() < self.error_rate:
+            return self._make_response(request.request_id, StatusCode.UNAVAILABLE,
+                                       error="Injected fault", start_time=start_time)
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(request.operation, request.values)
+            result = self.cache.get(key) if key is not None else None
+            if result is not None:
+                return self._make_response(request.request_id, StatusCode.OK,
+                                           result=result, start_time=start_time)
+        try:
+            result = self._calculate(request.operation, request.values)
+        except Exception as e:
+            return self._make_response(request.request_id, StatusCode.INTERNAL_ERROR,
+                                       error=str(e), start_time=start_time)
+        if key is not None:
+            self.cache.put(key, result)
+        return self._make_response(request.request_id, StatusCode.OK, result=result,
+                                   start_time=start_time)
+
+    def _make_response(self, request_id: str, status: StatusCode,
+                       result: Optional[float] = None, error: Optional[str] = None,
+                       start_time: Optional[float] = None) -> Response:
+        """Build a Response stamped with this instance's id and latency
+
+        Responses for work that was started (start_time given) also feed
+        processing_times and processing_histogram.
+        """
+        latency_ms = 0.0
+        if start_time:
+            elapsed = time.time() - start_time
+            self.processing_times.append(elapsed)
+            self.processing_histogram.record(elapsed)
+            latency_ms = elapsed * 1000
+        return Response(
+            request_id=request_id,
+            status=status,
+            result=result,
+            error_message=error,
+            latency_ms=latency_ms,
+            server_id=self.instance_id,
+            load=self._load_report()
+        )
+
+    def _load_report(self) -> List[float]:
+        """Compact load figures piggybacked on every Response
+
+        Load and queue depth are read live; the processing-time
+        percentiles are recomputed at most every LOAD_SUMMARY_INTERVAL.
+        """
+        now = time.time()
+        if now - self.load_summary_at >= self.LOAD_SUMMARY_INTERVAL:
+            times = sorted(self.processing_times)
+            if times:
+                self.load_summary = (times[len(times) // 2] * 1000,
+                                     times[min(len(times) - 1, int(len(times) * 0.99))] * 1000)
+            self.load_summary_at = now
+        p50_ms, p99_ms = self.load_summary
+        return [self.current_load, self.work_queue.qsize(), p50_ms, p99_ms]
+
+    def _health_status(self) -> dict:
+        """Build the HEALTH_RESPONSE payload"""
+        times = list(self.processing_times)
+        avg_latency_ms = (sum(times) / len(times) * 1000) if times else 0.0
+        health = {
+            'instance_id': self.instance_id,
+            'healthy': self.healthy,
+            'current_load': self.current_load,
+            'max_load': self.max_load,
+            'average_latency': avg_latency_ms,
+            'queue_depth': self.work_queue.qsize(),
+            'rejected_requests': self.rejected_requests,
+            'expired_requests': self.expired_requests,
+            'codecs': Protocol.CODECS
+        }
+        if self.cache is not None:
+            health['cache'] = self.cache.stats()
+        if self.cluster is not None:
+            # Report for the whole worker group, with this process up to date
+            self.cluster.publish(self.cluster_slot, self)
+            self.cluster.aggregate(health)
+        return health
+
+    def _collect_metrics(self) -> List[Tuple[str, str, str, dict, float]]:
+        """Load and refusal figures for the metrics endpoint"""
+        labels = {'instance': self.instance_id}
+        return [
+            ('rpc_server_current_load', 'gauge',
+             'Requests admitted and not yet answered', labels, self.current_load),
+            ('rpc_server_queue_depth', 'gauge',
+             'Admitted work waiting for a worker', labels, self.work_queue.qsize()),
+            ('rpc_server_rejected_requests_total', 'counter',
+             'Requests refused at admission', labels, self.rejected_requests),
+            ('rpc_server_expired_requests_total', 'counter',
+             'Requests dropped because their deadline passed', labels, self.expired_requests),
+        ]
+
+    def _start_metrics(self):
+        """Serve the metrics registry on metrics_port, if one was given"""
+        if self.metrics_port is not None:
+            self.metrics_server = MetricsServer(self.metrics, self.metrics_port).start()
+            print(f"Service {self.instance_id} metrics on port {self.metrics_port}")
+
     def _calculate(self, operation: str, values: List[float]) -> float:
         """Perform calculation based on operation"""
-        # TODO: STUDENT MUST IMPLEMENT
-        # Support operations: sum, avg, min, max, multiply
-        # Raise ValueError for unknown operations
-        
-        # Your code here...
-        pass
+        return self.engine.calculate(operation, values)
     
     def _send_error(self, sock: socket.socket, status: StatusCode, message: str):
         """Send error response - PROVIDED"""
@@ -217,13 +1582,381 @@ class ServiceInstance:
             'latency_ms': 0,
             'server_id': self.instance_id
         }
-        sock.send(Protocol.encode_message(MessageType.RESPONSE, response))
+        sock.sendall(Protocol.encode_message(MessageType.RESPONSE, response))
     
     def shutdown(self):
         """Shutdown service"""
         self.running = False
-        if self.socket:
+        try:
+            self._wakeup_w.send(b'\0')  # Break the I/O loop out of select()
+        except OSError:
+            pass
+        if self.socket:
             self.socket.close()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+
+class AsyncServiceInstance(ServiceInstance):
+    """asyncio variant of ServiceInstance
+
+    Each connection is a coroutine rather than a thread, so one process
+    can hold tens of thousands of idle persistent connections. Framing,
+    admission, health checks, fault injection and _calculate are shared
+    with ServiceInstance; injected latency becomes a non-blocking sleep.
+    """
+
+    # Calculations over more values than this run in a thread so one
+    # large request cannot stall every other connection on the loop
+    OFFLOAD_THRESHOLD = 50000
+
+    def __init__(self, instance_id: str, port: int, backlog: int = 1024,
+                 cache_entries: int = 0, cache_bytes: int = 16 << 20,
+                 metrics_port: Optional[int] = None):
+        super().__init__(instance_id, port, num_workers=1, backlog=backlog,
+                         cache_entries=cache_entries, cache_bytes=cache_bytes,
+                         metrics_port=metrics_port)
+        self.loop = None
+        self.server = None
+
+    def start(self):
+        """Start service instance"""
+        asyncio.run(self._serve())
+
+    async def _serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(
+            self._handle_connection, port=self.port,
+            backlog=self.backlog, reuse_address=True, reuse_port=self.reuse_port)
+        self.running = True
+        self._start_metrics()
+
+        print(f"Service {self.instance_id} (asyncio) listening on port {self.port}")
+
+        try:
+            await self.server.serve_forever()
+        except asyncio.CancelledError:
+            pass  # shutdown() closed the server
+
+    async def _handle_connection(self, reader: asyncio.StreamReader,
+                                 writer: asyncio.StreamWriter):
+        """Serve frames from one connection until the peer closes it
+
+        Each request runs as its own task, so pipelined requests on the
+        same connection do not wait behind one another.
+        """
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        tasks = set()
+        streams: Dict[str, StreamAccumulator] = {}
+        finished_sending = False
+
+        try:
+            while True:
+                header = await reader.readexactly(Protocol.HEADER.size)
+                length, type_byte = Protocol.HEADER.unpack(header)
+                if length < 1 or length > Protocol.MAX_FRAME_SIZE:
+                    raise ValueError(f"Invalid frame length: {length}")
+                payload = await reader.readexactly(length - 1)
+                msg_type, data, codec = Protocol.decode_payload(type_byte, payload)
+
+                if msg_type in self.WORK_TYPES:
+                    retry_after_ms = self._admit()
+                    if retry_after_ms is not None:
+                        reply_type, reply = self._overload_reply(msg_type, data,
+                                                                 retry_after_ms)
+                        writer.write(Protocol.encode_message(reply_type, reply, codec))
+                    else:
+                        task = asyncio.create_task(self._serve_request(
+                            writer, msg_type, data, codec, streams, time.time()))
+                        tasks.add(task)
+                        task.add_done_callback(tasks.discard)
+
+                elif msg_type == MessageType.HEALTH_CHECK:
+                    health = self._health_status()
+                    if 'request_id' in data:
+                        health['request_id'] = data['request_id']
+                    writer.write(Protocol.encode_message(MessageType.HEALTH_RESPONSE, health))
+
+                await writer.drain()
+        except asyncio.IncompleteReadError:
+            # Peer is done sending, perhaps only half-closed: it may still
+            # be waiting for answers to what it pipelined
+            finished_sending = True
+        except ConnectionError:
+            pass  # Peer reset the connection
+        except asyncio.CancelledError:
+            pass  # Event loop shutting down
+        except Exception as e:
+            print(f"Error handling connection: {e}")
+        finally:
+            if finished_sending and tasks:
+                try:
+                    await asyncio.gather(*tasks, return_exceptions=True)
+                except asyncio.CancelledError:
+                    pass  # Shutting down while answering
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def _serve_request(self, writer: asyncio.StreamWriter, msg_type: MessageType,
+                             data: dict, codec: Codec, streams: Dict[str, StreamAccumulator],
+                             admitted_at: float):
+        """Run one admitted request, batch or stream chunk and write its response"""
+        # Time spent waiting for the event loop to get round to this task
+        self.queue_wait_histogram.record(time.time() - admitted_at)
+        try:
+            if msg_type == MessageType.BATCH_REQUEST:
+                reply_type, reply = (MessageType.BATCH_RESPONSE,
+                                     await self._process_batch_async(data))
+            elif msg_type == MessageType.STREAM_CHUNK:
+                reply_type = MessageType.RESPONSE
+                reply = (await self._process_stream_chunk_async(streams, data)).to_dict()
+            else:
+                reply_type = MessageType.RESPONSE
+                reply = (await self._process_request_async(data)).to_dict()
+            if not writer.is_closing():
+                writer.write(Protocol.encode_message(reply_type, reply, codec))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        except Exception as e:
+            print(f"Error handling request: {e}")
+            try:
+                reply_type, reply = self._error_reply(msg_type, data, StatusCode.INTERNAL_ERROR,
+                                                      str(e))
+                if not writer.is_closing():
+                    writer.write(Protocol.encode_message(reply_type, reply, codec))
+            except Exception:
+                writer.close()  # Not even an error reply gets through
+        finally:
+            self.current_load -= 1
+
+    async def _process_request_async(self, data: dict) -> Response:
+        """Coroutine counterpart of ServiceInstance._process_request"""
+        start_time = time.time()
+        request, rejection = self._parse_request(data, start_time)
+        if rejection is not None:
+            return rejection
+
+        # Fault injection (for testing)
+        if self.inject_latency > 0:
+            await asyncio.sleep(self.inject_latency / 1000.0)
+        if len(request.values) > self.OFFLOAD_THRESHOLD:
+            return await asyncio.to_thread(self._execute_request, request, start_time)
+        return self._execute_request(request, start_time)
+
+    async def _process_stream_chunk_async(self, streams: Dict[str, StreamAccumulator],
+                                          data: dict) -> Response:
+        """Coroutine counterpart of ServiceInstance._process_stream_chunk"""
+        start_time = time.time()
+        request, rejection = self._parse_request(data, start_time)
+        if rejection is not None:
+            streams.pop(rejection.request_id, None)
+            return rejection
+
+        if self.inject_latency > 0:
+            await asyncio.sleep(self.inject_latency / 1000.0)
+        if len(request.values) > self.OFFLOAD_THRESHOLD:
+            return await asyncio.to_thread(self._apply_stream_chunk, streams, request,
+                                           start_time)
+        return self._apply_stream_chunk(streams, request, start_time)
+
+    async def _process_batch_async(self, data: dict) -> dict:
+        """Coroutine counterpart of ServiceInstance._process_batch"""
+        start_time = time.time()
+        if self.inject_latency > 0:
+            await asyncio.sleep(self.inject_latency / 1000.0)
+        total_values = sum(len(item.get('values', ())) for item in data.get('requests', []))
+        if total_values > self.OFFLOAD_THRESHOLD:
+            return await asyncio.to_thread(self._run_batch, data, start_time)
+        return self._run_batch(data, start_time)
+
+    def _admit(self) -> Optional[float]:
+        """Reserve capacity for a request; the event loop makes this atomic"""
+        if self.current_load < self.max_load:
+            self.current_load += 1
+            return None
+        self.rejected_requests += 1
+        # Admitted requests run concurrently, so capacity frees up in
+        # roughly one average processing time
+        times = list(self.processing_times)
+        avg_ms = (sum(times) / len(times) * 1000) if times else 1.0
+        return max(1.0, avg_ms)
+
+    def shutdown(self):
+        """Shutdown service"""
+        self.running = False
+        if self.loop is not None and self.server is not None:
+            self.loop.call_soon_threadsafe(self.server.close)
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+
+# ===================== MULTI-PROCESS SERVING =====================
+
+class ClusterStats:
+    """Per-worker load figures in shared memory
+
+    Each worker process publishes its own slot a few times a second; any
+    worker answering a health check sums every live slot, so the whole
+    process group looks like one instance to the load balancer.
+    """
+
+    FIELDS = ('pid', 'heartbeat', 'current_load', 'max_load', 'queue_depth',
+              'rejected_requests', 'expired_requests', 'latency_sum_ms', 'latency_samples',
+              'cache_hits', 'cache_misses', 'cache_evictions', 'cache_entries',
+              'cache_bytes')
+    CACHE_FIELDS = ('hits', 'misses', 'evictions', 'entries', 'bytes')
+    PUBLISH_INTERVAL = 0.1  # seconds
+    STALE_AFTER = 2.0  # seconds without a heartbeat
+
+    def __init__(self, num_slots: int):
+        self.num_slots = num_slots
+        self.values = multiprocessing.RawArray('d', num_slots * len(self.FIELDS))
+
+    def _slot(self, slot: int) -> Dict[str, float]:
+        base = slot * len(self.FIELDS)
+        return {name: self.values[base + i] for i, name in enumerate(self.FIELDS)}
+
+    def publish(self, slot: int, instance: 'ServiceInstance'):
+        """Write one worker's current figures into its slot"""
+        times = list(instance.processing_times)
+        cache = instance.cache.stats() if instance.cache is not None else {}
+        figures = (os.getpid(), time.time(), instance.current_load, instance.max_load,
+                   instance.work_queue.qsize(), instance.rejected_requests,
+                   instance.expired_requests, sum(times) * 1000, len(times),
+                   *(cache.get(name, 0) for name in self.CACHE_FIELDS))
+        base = slot * len(self.FIELDS)
+        for i, value in enumerate(figures):
+            self.values[base + i] = value
+
+    def clear(self, slot: int):
+        """Forget a worker that exited"""
+        base = slot * len(self.FIELDS)
+        for i in range(len(self.FIELDS)):
+            self.values[base + i] = 0.0
+
+    def attach(self, slot: int, instance: 'ServiceInstance'):
+        """Publish instance's figures from a background thread"""
+        def publish_loop():
+            while True:
+                self.publish(slot, instance)
+                time.sleep(self.PUBLISH_INTERVAL)
+
+        instance.cluster = self
+        instance.cluster_slot = slot
+        self.publish(slot, instance)
+        threading.Thread(target=publish_loop, daemon=True).start()
+
+    def aggregate(self, health: dict) -> dict:
+        """Replace per-process figures in a health payload with group totals"""
+        now = time.time()
+        live = [self._slot(i) for i in range(self.num_slots)]
+        live = [s for s in live if s['pid'] and now - s['heartbeat'] < self.STALE_AFTER]
+        samples = sum(s['latency_samples'] for s in live)
+        health.update(
+            current_load=int(sum(s['current_load'] for s in live)),
+            max_load=int(sum(s['max_load'] for s in live)),
+            queue_depth=int(sum(s['queue_depth'] for s in live)),
+            rejected_requests=int(sum(s['rejected_requests'] for s in live)),
+            expired_requests=int(sum(s['expired_requests'] for s in live)),
+            average_latency=(sum(s['latency_sum_ms'] for s in live) / samples
+                             if samples else 0.0),
+            workers=len(live),
+        )
+        if 'cache' in health:
+            health['cache'] = {name: int(sum(s['cache_' + name] for s in live))
+                               for name in self.CACHE_FIELDS}
+        return health
+
+def _run_worker_process(slot: int, instance_id: str, port: int, use_async: bool,
+                        server_options: dict, cluster: ClusterStats):
+    """Entry point of one forked worker process"""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)  # Undo the supervisor's handler
+    if server_options.get('metrics_port') is not None:
+        # Workers share the RPC port but each needs its own metrics port
+        server_options = dict(server_options, metrics_port=server_options['metrics_port'] + slot)
+    if use_async:
+        instance = AsyncServiceInstance(instance_id, port, **server_options)
+    else:
+        instance = ServiceInstance(instance_id, port, **server_options)
+    instance.reuse_port = True
+    cluster.attach(slot, instance)
+    try:
+        instance.start()
+    except KeyboardInterrupt:
+        instance.shutdown()
+
+class ServiceSupervisor:
+    """Runs N worker processes that share one port through SO_REUSEPORT
+
+    The kernel spreads incoming connections across the workers, so CPU
+    heavy calculations use every core instead of one GIL. Workers that
+    die are restarted, with a short backoff if they keep crashing.
+    """
+
+    RESTART_BACKOFF_MAX = 10.0  # seconds
+
+    def __init__(self, instance_id: str, port: int, num_processes: int,
+                 use_async: bool = False, server_options: Optional[dict] = None):
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            raise RuntimeError("SO_REUSEPORT is not supported on this platform")
+        self.instance_id = instance_id
+        self.port = port
+        self.num_processes = num_processes
+        self.use_async = use_async
+        self.server_options = server_options or {}
+        self.cluster = ClusterStats(num_processes)
+        self.context = multiprocessing.get_context('fork')
+        self.processes: List[Optional[multiprocessing.Process]] = [None] * num_processes
+        self.restarts = [0] * num_processes
+        self.running = False
+
+    def start(self):
+        """Start every worker and restart any that exit until shutdown"""
+        self.running = True
+        if threading.current_thread() is threading.main_thread():
+            # Take the workers down with us on kill/pkill
+            signal.signal(signal.SIGTERM, lambda signum, frame: self.shutdown())
+        for slot in range(self.num_processes):
+            self._spawn(slot)
+        print(f"Supervisor for {self.instance_id} running {self.num_processes} "
+              f"workers on port {self.port}")
+
+        next_allowed = [0.0] * self.num_processes
+        while self.running:
+            time.sleep(0.5)
+            for slot, proc in enumerate(self.processes):
+                if proc.is_alive() or not self.running:
+                    continue
+                if proc.exitcode is not None and next_allowed[slot] == 0.0:
+                    print(f"Worker {slot} (pid {proc.pid}) exited with code {proc.exitcode}")
+                    self.cluster.clear(slot)
+                    self.restarts[slot] += 1
+                    backoff = min(self.RESTART_BACKOFF_MAX,
+                                  0.5 * 2 ** min(self.restarts[slot] - 1, 5))
+                    next_allowed[slot] = time.time() + backoff
+                if time.time() >= next_allowed[slot]:
+                    next_allowed[slot] = 0.0
+                    self._spawn(slot)
+
+    def _spawn(self, slot: int):
+        proc = self.context.Process(
+            target=_run_worker_process, daemon=True,
+            args=(slot, self.instance_id, self.port, self.use_async,
+                  self.server_options, self.cluster))
+        proc.start()
+        self.processes[slot] = proc
+
+    def shutdown(self):
+        """Stop every worker"""
+        self.running = False
+        for proc in self.processes:
+            if proc is not None and proc.is_alive():
+                proc.terminate()
+        for proc in self.processes:
+            if proc is not None:
+                proc.join(timeout=5)
 
 # ===================== LOAD BALANCING =====================
 
@@ -232,6 +1965,10 @@ class LoadBalancingStrategy(Enum):
     ROUND_ROBIN = "round_robin"
     LEAST_CONNECTIONS = "least_connections"
     RANDOM = "random"
+    P2C = "p2c"                # Power of two choices on active connections
+    PEAK_EWMA = "peak_ewma"    # Lowest decaying peak latency x outstanding requests
+    CONSISTENT_HASH = "consistent_hash"  # Hash ring with bounded loads
+    WEIGHTED_ROUND_ROBIN = "weighted_round_robin"  # Smooth (nginx-style) by weight
 
 @dataclass
 class InstanceInfo:
@@ -247,105 +1984,516 @@ class InstanceInfo:
     last_health_check: float = 0
     healthy: bool = True
     circuit_breaker_state: str = "closed"
+    pool_idle: int = 0
+    pool_in_use: int = 0
+    ewma_latency: float = 0.0  # Peak-sensitive decaying latency (ms)
+    ewma_updated: float = 0.0  # When ewma_latency was last updated
+    current_weight: float = 0.0  # Smooth weighted round-robin credit
+    # Load the instance last reported about itself, by health check or
+    # piggybacked on a Response
+    current_load: int = 0
+    max_load: int = 0
+    server_latency: float = 0.0  # Typical processing time (ms): average or p50
+    queue_depth: int = 0
+    server_p99: float = 0.0
+    load_reported: float = 0.0  # When the last report arrived
 
 class LoadBalancer:
-    """Load balancer - STUDENT MUST IMPLEMENT STRATEGIES"""
+    """Load balancer - STUDENT MUST IMPLEMENT STRATEGIES
+
+    Selection does not rebuild or lock anything on the hot path. The
+    instances eligible for selection (healthy, breaker not open) are kept
+    as an immutable snapshot that is replaced only when membership,
+    health or breaker state changes, so health changes must go through
+    set_instance_health() and set_circuit_state(). Least-connections
+    reads an index of instances bucketed by active connections.
+
+    Locks: self.lock serializes membership and availability changes,
+    conn_lock guards connection counts and the least-connections index,
+    and per-instance request figures take one of stat_locks, striped by
+    instance id.
+    """
     
-    def __init__(self, strategy: LoadBalancingStrategy = LoadBalancingStrategy.ROUND_ROBIN):
+    # Request.metadata key that CONSISTENT_HASH routes by, when present
+    ROUTING_KEY = 'routing_key'
+    # Values hashed when routing by request content
+    CONTENT_KEY_VALUES = 1024
+    # PEAK_EWMA compares every instance up to this many, else a random pair
+    PEAK_EWMA_SCAN = 16
+    LOCK_STRIPES = 16
+    # Automatic weights: AUTO_WEIGHT_SCALE x headroom / latency (ms), with
+    # latency floored so idle, near-instant instances stay comparable
+    AUTO_WEIGHT_SCALE = 100
+    AUTO_LATENCY_FLOOR_MS = 0.1
+    # Seconds a server-reported load figure is trusted for
+    LOAD_REPORT_TTL = 1.0
+    
+    def __init__(self, strategy: LoadBalancingStrategy = LoadBalancingStrategy.ROUND_ROBIN,
+                 virtual_nodes: int = 100, hash_load_factor: float = 1.25,
+                 auto_weights: bool = False):
         self.strategy = strategy
         self.instances: Dict[str, InstanceInfo] = {}
         self.instance_list: List[str] = []
         
+        # Instances eligible for selection: a tuple replaced on every change
+        # (read without locking, and holding the instances themselves so a
+        # selection never looks one up by id) and a set of their ids
+        self.available: Tuple[InstanceInfo, ...] = ()
+        self.available_ids = set()
+        
         # Round-robin state
-        self.rr_index = 0
+        self.rr_counter = itertools.count()
+        
+        # Smooth weighted round-robin: credits change on every pick. With
+        # auto_weights, weights follow the load instances report.
+        self.swrr_lock = threading.Lock()
+        self.auto_weights = auto_weights
+        
+        # Least-connections index: active_connections -> available instances
+        # with that count, oldest first, and the lowest non-empty count
+        self.lc_buckets: Dict[int, OrderedDict] = {}
+        self.lc_min = 0
+        self.total_active = 0
+        
+        # Peak-EWMA: seconds for a latency sample's weight to fall to 1/e
+        self.ewma_decay = 10.0
+        
+        # Consistent-hash ring: every instance's virtual node hashes, merged
+        # into a sorted (hashes, owners) ring on first use after a change.
+        # No instance takes more than hash_load_factor x the mean load.
+        self.virtual_nodes = virtual_nodes
+        self.hash_load_factor = hash_load_factor
+        self.ring_points: Dict[str, List[int]] = {}
+        self.ring: Optional[Tuple[List[int], List[str]]] = None
         
         # Statistics
-        self.request_count = 0
         self.distribution = defaultdict(int)
         
+        # Client connection pool (set by SmartClient) for occupancy stats
+        self.connection_pool = None
+        
         # Thread safety
         self.lock = threading.Lock()
+        self.conn_lock = threading.Lock()
+        self.stat_locks = [threading.Lock() for _ in range(self.LOCK_STRIPES)]
+    
+    @property
+    def request_count(self) -> int:
+        """Selections made so far"""
+        return sum(self.distribution.values())
+    
+    def attach_connection_pool(self, pool):
+        """Let stats report occupancy of the client's connection pool"""
+        self.connection_pool = pool
     
     def add_instance(self, instance: InstanceInfo):
         """Add service instance to pool"""
+        iid = instance.instance_id
+        # Only keys landing just before the new virtual nodes will move
+        points = [self._ring_hash(f"{iid}#{i}".encode('utf-8'))
+                  for i in range(self.virtual_nodes * max(1, instance.weight))]
         with self.lock:
-            self.instances[instance.instance_id] = instance
-            self.instance_list.append(instance.instance_id)
+            if iid in self.instances:
+                self._remove_locked(iid)
+            self.instances[iid] = instance
+            self.instance_list.append(iid)
+            self.distribution.setdefault(iid, 0)
+            self.ring_points[iid] = points
+            self.ring = None
+            with self.conn_lock:
+                self.total_active += instance.active_connections
+            self._refresh_availability(iid)
     
     def remove_instance(self, instance_id: str):
         """Remove service instance from pool"""
         with self.lock:
             if instance_id in self.instances:
-                del self.instances[instance_id]
-                self.instance_list.remove(instance_id)
-    
-    def select_instance(self, request: Request) -> Optional[InstanceInfo]:
-        """Select instance for request based on strategy"""
-        with self.lock:
-            # Filter healthy instances
-            healthy_instances = [
-                iid for iid in self.instance_list 
-                if self.instances[iid].healthy and 
-                   self.instances[iid].circuit_breaker_state != "open"
-            ]
+                self._remove_locked(instance_id)
+    
+    def _remove_locked(self, instance_id: str):
+        instance = self.instances[instance_id]
+        if instance_id in self.available_ids:
+            self._set_available(instance, False)
+        with self.conn_lock:
+            self.total_active -= instance.active_connections
+        del self.instances[instance_id]
+        self.instance_list.remove(instance_id)
+        # Keys owned by the removed instance fall to their successors
+        del self.ring_points[instance_id]
+        self.ring = None
+    
+    def set_instance_health(self, instance_id: str, healthy: bool):
+        """Record a health check result for an instance"""
+        with self.lock:
+            instance = self.instances.get(instance_id)
+            if instance is not None:
+                instance.healthy = healthy
+                self._refresh_availability(instance_id)
+    
+    def set_weight(self, instance_id: str, weight: int):
+        """Change an instance's weight at runtime
+
+        The hash ring picks up the new weight as well, moving only the
+        keys of the virtual nodes added or removed.
+        """
+        points = [self._ring_hash(f"{instance_id}#{i}".encode('utf-8'))
+                  for i in range(self.virtual_nodes * max(1, weight))]
+        with self.lock:
+            instance = self.instances.get(instance_id)
+            if instance is not None:
+                instance.weight = weight
+                self.ring_points[instance_id] = points
+                self.ring = None
+    
+    def update_instance_load(self, instance_id: str, current_load: int, max_load: int,
+                             average_latency: float):
+        """Record the load an instance reported about itself
+
+        In auto_weights mode this also rederives the instance's weight:
+        instances with more headroom and faster processing get more
+        traffic, and every instance keeps a weight of at least 1.
+        """
+        instance = self.instances.get(instance_id)
+        if instance is None:
+            return
+        instance.current_load = current_load
+        instance.max_load = max_load
+        instance.server_latency = average_latency
+        instance.load_reported = time.time()
+        self._derive_weight(instance)
+    
+    def _derive_weight(self, instance: InstanceInfo):
+        if self.auto_weights:
+            max_load = instance.max_load
+            headroom = (1.0 - min(1.0, instance.current_load / max_load)
+                        if max_load > 0 else 1.0)
+            latency = max(instance.server_latency, self.AUTO_LATENCY_FLOOR_MS)
+            instance.weight = max(1, round(self.AUTO_WEIGHT_SCALE * headroom / latency))
+    
+    def _apply_load_report(self, instance: InstanceInfo, report: List[float]):
+        """Take in the load figures piggybacked on a Response"""
+        current_load, queue_depth, p50_ms, p99_ms = report
+        instance.current_load = int(current_load)
+        instance.queue_depth = int(queue_depth)
+        instance.server_latency = p50_ms
+        instance.server_p99 = p99_ms
+        instance.load_reported = time.time()
+        self._derive_weight(instance)
+    
+    def _outstanding(self, instance: InstanceInfo, now: float) -> int:
+        """Requests in flight at an instance, from every client if known
+
+        A fresh server load report counts other clients' requests too;
+        without one, fall back to this client's own active connections.
+        """
+        if now - instance.load_reported < self.LOAD_REPORT_TTL:
+            return max(instance.active_connections, instance.current_load)
+        return instance.active_connections
+    
+    def record_health_check(self, instance_id: str, health: Optional[dict],
+                            rtt_ms: float = 0.0):
+        """Apply a health check: its payload, or None if it failed
+
+        Besides health and load, the probe's round trip seeds the latency
+        figures of instances that have not served a request yet.
+        """
+        instance = self.instances.get(instance_id)
+        if instance is None:
+            return
+        instance.last_health_check = time.time()
+        self.set_instance_health(instance_id,
+                                 health is not None and bool(health.get('healthy', True)))
+        if health is None:
+            return
+        self.update_instance_load(instance_id, health.get('current_load', 0),
+                                  health.get('max_load', 0),
+                                  health.get('average_latency', 0.0))
+        if instance.total_requests == 0:
+            with self._stat_lock(instance_id):
+                instance.avg_latency = rtt_ms
+                self._observe_latency(instance, rtt_ms, True)
+    
+    def set_circuit_state(self, instance_id: str, state: str):
+        """Record a circuit breaker transition for an instance"""
+        with self.lock:
+            instance = self.instances.get(instance_id)
+            if instance is not None:
+                instance.circuit_breaker_state = state
+                self._refresh_availability(instance_id)
+    
+    @staticmethod
+    def _is_available(instance: InstanceInfo) -> bool:
+        return instance.healthy and instance.circuit_breaker_state != "open"
+    
+    def _refresh_availability(self, instance_id: str):
+        """Bring the available snapshot in line with an instance's flags"""
+        instance = self.instances[instance_id]
+        available = self._is_available(instance)
+        if available != (instance_id in self.available_ids):
+            self._set_available(instance, available)
+    
+    def _set_available(self, instance: InstanceInfo, available: bool):
+        iid = instance.instance_id
+        with self.conn_lock:
+            if available:
+                self.available_ids.add(iid)
+                self.available = self.available + (instance,)
+                self._lc_insert(instance, instance.active_connections)
+            else:
+                self.available_ids.discard(iid)
+                self.available = tuple(a for a in self.available if a.instance_id != iid)
+                self._lc_remove(iid, instance.active_connections)
+    
+    def _lc_insert(self, instance: InstanceInfo, count: int):
+        bucket = self.lc_buckets.get(count)
+        if bucket is None:
+            # OrderedDict: its first key stays O(1) under churn, unlike a dict's
+            bucket = self.lc_buckets[count] = OrderedDict()
+        bucket[instance.instance_id] = instance
+        if count < self.lc_min or self.lc_min not in self.lc_buckets:
+            self.lc_min = count
+    
+    def _lc_remove(self, instance_id: str, count: int):
+        bucket = self.lc_buckets[count]
+        del bucket[instance_id]
+        if not bucket:
+            del self.lc_buckets[count]
+            if count == self.lc_min:
+                self.lc_min = min(self.lc_buckets) if self.lc_buckets else 0
+    
+    def select_instance(self, request: Request,
+                        exclude: Tuple[str, ...] = ()) -> Optional[InstanceInfo]:
+        """Select instance for request based on strategy
+
+        Instances whose ids are in exclude are not candidates at all, so
+        finding an alternative to one instance costs a single selection
+        and leaves no trace on the others' counters or weights.
+        """
+        available = self.available
+        if exclude:
+            available = tuple(i for i in available if i.instance_id not in exclude)
+        if not available:
+            return None
+        
+        selected = None
+        
+        if self.strategy == LoadBalancingStrategy.ROUND_ROBIN:
+            # Round-robin: Select next instance in order
+            selected = available[next(self.rr_counter) % len(available)]
             
-            if not healthy_instances:
-                return None
+        elif self.strategy == LoadBalancingStrategy.LEAST_CONNECTIONS:
+            # Oldest instance in the lowest connection-count bucket
+            with self.conn_lock:
+                if exclude:
+                    selected = min(available, key=lambda i: i.active_connections)
+                else:
+                    bucket = self.lc_buckets.get(self.lc_min)
+                    selected = next(iter(bucket.values())) if bucket else None
             
-            selected_id = None
+        elif self.strategy == LoadBalancingStrategy.RANDOM:
+            # Random selection from healthy instances
+            selected = random.choice(available)
             
-            if self.strategy == LoadBalancingStrategy.ROUND_ROBIN:
-                # TODO: STUDENT MUST IMPLEMENT
-                # Round-robin: Select next instance in order
-                # Use self.rr_index and update it (with wraparound)
-                
-                # Your code here...
-                pass
-                
-            elif self.strategy == LoadBalancingStrategy.LEAST_CONNECTIONS:
-                # TODO: STUDENT MUST IMPLEMENT
-                # Select instance with least active connections
-                # Use instance.active_connections to decide
-                
-                # Your code here...
-                pass
-                
-            elif self.strategy == LoadBalancingStrategy.RANDOM:
-                # TODO: STUDENT MUST IMPLEMENT
-                # Random selection from healthy instances
-                
-                # Your code here...
-                pass
+        elif self.strategy == LoadBalancingStrategy.P2C:
+            now = time.time()
+            selected = self._pick_two(available, lambda i: self._outstanding(i, now))
             
-            # Update statistics
-            if selected_id:
-                self.distribution[selected_id] += 1
-                self.request_count += 1
-                return self.instances[selected_id]
+        elif self.strategy == LoadBalancingStrategy.CONSISTENT_HASH:
+            selected = self._hash_ring_select(request, len(available), exclude)
             
+        elif self.strategy == LoadBalancingStrategy.WEIGHTED_ROUND_ROBIN:
+            selected = self._smooth_weighted_select(available)
+            
+        elif self.strategy == LoadBalancingStrategy.PEAK_EWMA:
+            now = time.time()
+            # Unsampled instances all cost 0; spread them by load
+            cost = lambda i: (self._peak_ewma_cost(i, now), i.active_connections)
+            if len(available) <= self.PEAK_EWMA_SCAN:
+                selected = min(available, key=cost)
+            else:
+                selected = self._pick_two(available, cost)
+        
+        if selected is None:
+            return None
+        
+        # Update statistics
+        with self._stat_lock(selected.instance_id):
+            self.distribution[selected.instance_id] += 1
+        return selected
+    
+    def _stat_lock(self, instance_id: str) -> threading.Lock:
+        return self.stat_locks[hash(instance_id) % self.LOCK_STRIPES]
+    
+    @staticmethod
+    def _ring_hash(key: bytes) -> int:
+        """Position of key on the hash ring"""
+        return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'big')
+
+    def _routing_key(self, request: Request) -> bytes:
+        """Key CONSISTENT_HASH routes request by
+
+        An explicit metadata routing key wins. Otherwise requests for the
+        same operation over the same values share a key, so they reach
+        the same instance and its result cache; only a prefix of long
+        inputs is hashed.
+        """
+        key = request.metadata.get(self.ROUTING_KEY) if request.metadata else None
+        if key is not None:
+            return str(key).encode('utf-8')
+        values = request.values
+        try:
+            raw = array('d', itertools.islice(values, self.CONTENT_KEY_VALUES)).tobytes()
+        except (TypeError, ValueError):
+            raw = repr(list(itertools.islice(values, self.CONTENT_KEY_VALUES))).encode('utf-8')
+        return b'%s\0%d\0%s' % (request.operation.encode('utf-8'), len(values), raw)
+
+    def _get_ring(self) -> Tuple[List[int], List[str]]:
+        """The sorted ring, rebuilt after instances were added or removed"""
+        ring = self.ring
+        if ring is None:
+            with self.lock:
+                if self.ring is None:
+                    points = sorted((point, iid) for iid, owned in self.ring_points.items()
+                                    for point in owned)
+                    self.ring = ([point for point, _ in points], [iid for _, iid in points])
+                ring = self.ring
+        return ring
+
+    def _hash_ring_select(self, request: Request, num_available: int,
+                          exclude: Tuple[str, ...] = ()) -> Optional[InstanceInfo]:
+        """Walk the ring clockwise from the request's key to an instance with room
+
+        Capacity follows consistent hashing with bounded loads: an instance
+        already holding ceil(factor x mean) active connections is passed
+        over for the next one on the ring. The walk starts with a bisect,
+        and each distinct instance is considered at most once.
+        """
+        hashes, owners = self._get_ring()
+        if not hashes:
             return None
+        capacity = math.ceil(self.hash_load_factor * (self.total_active + 1) / num_available)
+
+        start = bisect.bisect(hashes, self._ring_hash(self._routing_key(request)))
+        size = len(hashes)
+        seen = set()
+        fallback = None
+        for step in range(size):
+            iid = owners[(start + step) % size]
+            if iid in seen:
+                continue
+            seen.add(iid)
+            if iid in self.available_ids and iid not in exclude:
+                instance = self.instances.get(iid)
+                if instance is None:
+                    continue
+                if instance.active_connections < capacity:
+                    return instance
+                fallback = fallback or instance
+            if len(seen) == len(self.instances):
+                break
+        return fallback
+
+    def _smooth_weighted_select(self, candidates: Tuple[InstanceInfo, ...]) -> InstanceInfo:
+        """nginx's smooth weighted round-robin
+
+        Every candidate earns its weight in credit, the richest one is
+        picked and pays back the total. Over sum(weights) picks each
+        instance is chosen weight times, interleaved rather than in runs.
+        """
+        with self.swrr_lock:
+            total = 0
+            best = None
+            for instance in candidates:
+                instance.current_weight += instance.weight
+                total += instance.weight
+                if best is None or instance.current_weight > best.current_weight:
+                    best = instance
+            best.current_weight -= total
+            return best
+
+    @staticmethod
+    def _pick_two(candidates: Tuple[InstanceInfo, ...], cost) -> InstanceInfo:
+        """Sample two distinct candidates and keep the cheaper one
+
+        Comparing a random pair avoids the herding of always taking the
+        global minimum, while still steering clear of the worst choices.
+        """
+        if len(candidates) == 1:
+            return candidates[0]
+        first, second = random.sample(candidates, 2)
+        return first if cost(first) <= cost(second) else second
+
+    def _peak_ewma_cost(self, instance: InstanceInfo, now: float) -> float:
+        """Decayed latency estimate scaled by outstanding requests
+
+        The estimate keeps decaying while an instance gets no samples, so
+        a backend that was slow is eventually tried again.
+        """
+        elapsed = max(0.0, now - instance.ewma_updated)
+        latency = instance.ewma_latency * math.exp(-elapsed / self.ewma_decay)
+        return latency * (self._outstanding(instance, now) + 1)
+
+    def _observe_latency(self, instance: InstanceInfo, latency: float, success: bool):
+        """Fold a latency sample into the peak-sensitive EWMA
+
+        A sample above the current estimate replaces it outright, so a
+        backend that slows down is avoided at once; lower samples are
+        blended in with a weight that grows with the time since the last
+        one. Failures never lower the estimate: a backend that fails fast
+        must not look attractive.
+        """
+        now = time.time()
+        if latency > instance.ewma_latency:
+            instance.ewma_latency = latency
+        elif success:
+            weight = math.exp(-max(0.0, now - instance.ewma_updated) / self.ewma_decay)
+            instance.ewma_latency = instance.ewma_latency * weight + latency * (1 - weight)
+        instance.ewma_updated = now
     
     def update_instance_stats(self, instance_id: str, latency: float, 
-                            success: bool, connections_delta: int = 0):
-        """Update instance statistics after request"""
-        # TODO: STUDENT MUST IMPLEMENT
-        # Update the instance's statistics:
-        # - active_connections (add connections_delta)
-        # - total_requests (increment if this was a request)
-        # - error_count (increment if not success)
-        # - avg_latency (running average: (old_avg * old_count + new_latency) / new_count)
-        
-        with self.lock:
-            if instance_id in self.instances:
-                instance = self.instances[instance_id]
-                # Your code here...
-                pass
+                            success: bool, connections_delta: int = 0,
+                            load_report: Optional[List[float]] = None):
+        """Update instance statistics after request
+
+        A positive connections_delta marks the start of a request and only
+        adjusts active_connections; any other call records a completed
+        request with its latency (ms) and outcome, plus the load report
+        the server attached to its response, if any.
+        """
+        instance = self.instances.get(instance_id)
+        if instance is None:
+            return
+        if connections_delta:
+            with self.conn_lock:
+                old = instance.active_connections
+                new = max(0, old + connections_delta)
+                instance.active_connections = new
+                self.total_active += new - old
+                if instance_id in self.available_ids:
+                    self._lc_remove(instance_id, old)
+                    self._lc_insert(instance, new)
+        if self.connection_pool is not None:
+            instance.pool_idle, instance.pool_in_use = \
+                self.connection_pool.occupancy(instance.host, instance.port)
+        if connections_delta > 0:
+            return
+
+        with self._stat_lock(instance_id):
+            instance.total_requests += 1
+            if not success:
+                instance.error_count += 1
+            n = instance.total_requests
+            instance.avg_latency = (instance.avg_latency * (n - 1) + latency) / n
+            self._observe_latency(instance, latency, success)
+            if load_report is not None:
+                self._apply_load_report(instance, load_report)
     
     def get_stats(self) -> dict:
         """Get load balancer statistics"""
         with self.lock:
+            request_count = self.request_count
             stats = {
-                'total_requests': self.request_count,
+                'total_requests': request_count,
                 'strategy': self.strategy.value,
                 'instances': {}
             }
@@ -353,166 +2501,2282 @@ class LoadBalancer:
             for iid, info in self.instances.items():
                 stats['instances'][iid] = {
                     'requests': self.distribution[iid],
-                    'percentage': (self.distribution[iid] / self.request_count * 100) 
-                                if self.request_count > 0 else 0,
+                    'percentage': (self.distribution[iid] / request_count * 100) 
+                                if request_count > 0 else 0,
                     'healthy': info.healthy,
                     'avg_latency': info.avg_latency,
+                    'ewma_latency': info.ewma_latency,
+                    'weight': info.weight,
+                    'server_load': info.current_load,
+                    'server_queue_depth': info.queue_depth,
+                    'server_p50_ms': info.server_latency,
+                    'server_p99_ms': info.server_p99,
                     'active_connections': info.active_connections,
-                    'errors': info.error_count
+                    'errors': info.error_count,
+                    'pool_idle': info.pool_idle,
+                    'pool_in_use': info.pool_in_use
                 }
             
+            if self.connection_pool is not None:
+                stats['connection_pool'] = self.connection_pool.get_stats()
+            
             return stats
 
-# ===================== CIRCUIT BREAKER =====================
+class _ProbeState:
+    """Consecutive failures and ejection backoff for one probed instance"""
+    __slots__ = ('failures', 'ejections', 'ejected_until', 'connection')
+
+    def __init__(self):
+        self.failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.connection = None  # (reader, writer) kept open between rounds
+
+class HealthProber:
+    """Background health checks for every instance of a LoadBalancer
+
+    One thread runs an asyncio loop that probes all instances
+    concurrently, at most max_concurrency at a time, over one persistent
+    connection each. Rounds start every interval seconds, jittered by
+    +/- jitter so many clients do not probe in lockstep; the cost is one
+    HEALTH_CHECK per instance per round, whatever the request traffic.
+
+    Outlier ejection: after failure_threshold consecutive probes that
+    get no answer an instance is marked unhealthy and left alone for
+    base_ejection x (times ejected) seconds, capped at max_ejection. It
+    is probed again once that time has passed and readmitted on the
+    first success; each success also forgives one past ejection. An
+    instance that answers but reports itself unhealthy is marked so at
+    once, and readmitted once it reports healthy again.
+    """
+
+    def __init__(self, load_balancer: LoadBalancer, interval: float = 2.0,
+                 jitter: float = 0.2, timeout: float = 1.0, failure_threshold: int = 2,
+                 base_ejection: float = 5.0, max_ejection: float = 60.0,
+                 max_concurrency: int = 64):
+        self.load_balancer = load_balancer
+        self.interval = interval
+        self.jitter = jitter
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.base_ejection = base_ejection
+        self.max_ejection = max_ejection
+        self.max_concurrency = max_concurrency
+        self.states: Dict[str, _ProbeState] = {}
+        self.rounds = 0
+        self.probes_sent = 0
+        self.running = False
+        self.loop = None
+        self.thread = None
+        self.stopped = None
+
+    def start(self):
+        """Start probing in a daemon thread"""
+        self.running = True
+        self.thread = threading.Thread(target=lambda: asyncio.run(self._run()),
+                                       name="health-prober", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop probing and close probe connections"""
+        self.running = False
+        if self.loop is not None and self.stopped is not None:
+            self.loop.call_soon_threadsafe(self.stopped.set)
+        if self.thread is not None:
+            self.thread.join(timeout=self.timeout + 1)
+
+    async def _run(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        try:
+            while self.running:
+                await self.probe_all(semaphore)
+                delay = self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+                try:
+                    await asyncio.wait_for(self.stopped.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for state in self.states.values():
+                self._close(state)
+
+    async def probe_all(self, semaphore: Optional[asyncio.Semaphore] = None):
+        """Run one round: probe every instance that is not serving an ejection"""
+        semaphore = semaphore or asyncio.Semaphore(self.max_concurrency)
+        now = time.time()
+        instances = list(self.load_balancer.instances.values())
+        for iid in set(self.states) - {i.instance_id for i in instances}:
+            self._close(self.states.pop(iid))
+
+        async def bounded(instance: InstanceInfo, state: _ProbeState):
+            async with semaphore:
+                await self._probe(instance, state)
+
+        probes = []
+        for instance in instances:
+            state = self.states.setdefault(instance.instance_id, _ProbeState())
+            if state.ejected_until <= now:
+                probes.append(bounded(instance, state))
+        await asyncio.gather(*probes)
+        self.rounds += 1
+
+    async def _probe(self, instance: InstanceInfo, state: _ProbeState):
+        self.probes_sent += 1
+        start = time.time()
+        try:
+            health = await asyncio.wait_for(self._health_check(instance, state), self.timeout)
+        except Exception:
+            self._close(state)
+            state.failures += 1
+            if state.failures >= self.failure_threshold:
+                state.ejections += 1
+                state.ejected_until = time.time() + min(
+                    self.max_ejection, self.base_ejection * state.ejections)
+                self.load_balancer.record_health_check(instance.instance_id, None)
+            return
+
+        state.failures = 0
+        if health.get('healthy', True):
+            state.ejections = max(0, state.ejections - 1)
+            state.ejected_until = 0.0
+        self.load_balancer.record_health_check(instance.instance_id, health,
+                                               (time.time() - start) * 1000)
+
+    async def _health_check(self, instance: InstanceInfo, state: _ProbeState) -> dict:
+        if state.connection is None:
+            state.connection = await asyncio.open_connection(instance.host, instance.port)
+        reader, writer = state.connection
+        request_id = f"probe_{instance.instance_id}_{self.probes_sent}"
+        writer.write(Protocol.encode_message(MessageType.HEALTH_CHECK,
+                                             {'request_id': request_id}))
+        await writer.drain()
+        while True:
+            header = await reader.readexactly(Protocol.HEADER.size)
+            length, type_byte = Protocol.HEADER.unpack(header)
+            if length < 1 or length > Protocol.MAX_FRAME_SIZE:
+                raise ValueError(f"Invalid frame length: {length}")
+            payload = await reader.readexactly(length - 1)
+            msg_type, data, _ = Protocol.decode_payload(type_byte, payload)
+            # Skip a late reply to an earlier, timed-out probe
+            if msg_type == MessageType.HEALTH_RESPONSE and \
+                    data.get('request_id', request_id) == request_id:
+                return data
+
+    @staticmethod
+    def _close(state: _ProbeState):
+        if state.connection is not None:
+            state.connection[1].close()
+            state.connection = None
+
+    def get_stats(self) -> dict:
+        """Probe counters and the instances currently ejected"""
+        now = time.time()
+        return {
+            'rounds': self.rounds,
+            'probes_sent': self.probes_sent,
+            'ejected': {iid: round(state.ejected_until - now, 3)
+                        for iid, state in self.states.items() if state.ejected_until > now},
+        }
+
+# ===================== CIRCUIT BREAKER =====================
+
+class CircuitBreakerState(Enum):
+    """Circuit breaker states"""
+    CLOSED = "closed"      # Normal operation
+    OPEN = "open"          # Failing, reject requests  
+    HALF_OPEN = "half_open"  # Testing recovery
+
+class CircuitOpenError(Exception):
+    """Raised when a circuit breaker rejects a call"""
+    pass
+
+class CircuitBreaker:
+    """Circuit breaker for fault tolerance
+
+    Outcomes land in a sliding window of window_seconds split into
+    buckets, so the breaker trips on the recent failure rate (or the
+    rate of calls slower than slow_call_ms) once at least
+    minimum_requests calls are in the window, not on a run of
+    consecutive failures that one lucky success resets. After
+    recovery_timeout an OPEN breaker goes HALF_OPEN and lets through
+    success_threshold probes: all of them succeeding closes it, any
+    failing opens it again, and so does going recovery_timeout with
+    probes out and none of them answered, so probes that never settle
+    cannot hold the breaker half open.
+
+    The window is a set of preallocated counters behind one lock, held
+    only for a few increments, so consulting the breaker on every call
+    is cheap. Transitions are reported through on_state_change while
+    that lock is held, keeping listeners in the breaker's order.
+    """
+    
+    def __init__(self, instance_id: str,
+                 minimum_requests: int = 5,
+                 recovery_timeout: int = 60,
+                 success_threshold: int = 3,
+                 failure_rate_threshold: float = 0.5,
+                 slow_call_ms: float = 1000.0,
+                 slow_call_rate_threshold: float = 0.8,
+                 window_seconds: float = 10.0,
+                 buckets: int = 10):
+        self.instance_id = instance_id
+        self.state = CircuitBreakerState.CLOSED
+        
+        # Configuration
+        self.minimum_requests = minimum_requests
+        self.recovery_timeout = recovery_timeout
+        self.success_threshold = success_threshold
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_ms = slow_call_ms
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.bucket_seconds = window_seconds / buckets
+        
+        # Sliding window: bucket i holds the calls of one bucket_seconds
+        # period, stamped with that period's number
+        self.lock = threading.Lock()
+        self.bucket_period = [-1] * buckets
+        self.bucket_calls = [0] * buckets
+        self.bucket_failures = [0] * buckets
+        self.bucket_slow = [0] * buckets
+        
+        # HALF_OPEN probes let through and probes that came back fine
+        self.probes = 0
+        self.success_count = 0
+        self.last_probe_event = 0.0  # Last probe let through or answered
+        self.last_failure_time = 0
+        self.last_state_change = time.time()
+        
+        # Metrics
+        self.total_requests = 0
+        self.rejected_requests = 0
+
+        # Optional callback(instance_id, new_state) fired on every transition
+        self.on_state_change = None
+    
+    def call(self, func, *args, **kwargs):
+        """Execute function with circuit breaker protection"""
+        if not self.allow():
+            raise CircuitOpenError(f"Circuit open for {self.instance_id}")
+
+        start = time.time()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self.on_failure((time.time() - start) * 1000)
+            raise
+        self.on_success((time.time() - start) * 1000)
+        return result
+    
+    def allow(self) -> bool:
+        """Count a call and tell whether the breaker lets it through
+
+        For callers that report the outcome themselves through
+        on_success() and on_failure() instead of using call(). A call
+        let through must be reported, or given back with release().
+        """
+        with self.lock:
+            self.total_requests += 1
+            self._check_recovery(time.time())
+            if self.state == CircuitBreakerState.CLOSED:
+                return True
+            if self.state == CircuitBreakerState.HALF_OPEN and self.probes < self.success_threshold:
+                self.probes += 1
+                self.last_probe_event = time.time()
+                return True
+            self.rejected_requests += 1
+            return False
+
+    def release(self):
+        """Give back a call let through by allow() that ended with no outcome"""
+        with self.lock:
+            if self.state == CircuitBreakerState.HALF_OPEN and self.probes > 0:
+                self.probes -= 1
+
+    def on_success(self, latency_ms: float = 0.0):
+        """Handle successful call"""
+        slow = latency_ms >= self.slow_call_ms
+        with self.lock:
+            if self.state == CircuitBreakerState.CLOSED:
+                self._record(time.time(), False, slow)
+                if slow:
+                    self._check_window()
+            elif self.state == CircuitBreakerState.HALF_OPEN:
+                if slow:
+                    self._transition(CircuitBreakerState.OPEN)
+                    return
+                self.success_count += 1
+                self.last_probe_event = time.time()
+                if self.success_count >= self.success_threshold:
+                    self._transition(CircuitBreakerState.CLOSED)
+    
+    def on_failure(self, latency_ms: float = 0.0):
+        """Handle failed call"""
+        now = time.time()
+        with self.lock:
+            self.last_failure_time = now
+            if self.state == CircuitBreakerState.CLOSED:
+                self._record(now, True, latency_ms >= self.slow_call_ms)
+                self._check_window()
+            elif self.state == CircuitBreakerState.HALF_OPEN:
+                self._transition(CircuitBreakerState.OPEN)
+    
+    def get_state(self) -> str:
+        """Get current circuit breaker state
+
+        An OPEN breaker whose recovery_timeout has elapsed moves to
+        HALF_OPEN here, so callers polling the state see recovery.
+        """
+        with self.lock:
+            self._check_recovery(time.time())
+            return self.state.value
+
+    def get_stats(self) -> dict:
+        """State and the failure and slow-call rates over the window"""
+        with self.lock:
+            self._check_recovery(time.time())
+            calls, failures, slow = self._totals(time.time())
+            return {
+                'state': self.state.value,
+                'window_requests': calls,
+                'failure_rate': failures / calls if calls else 0.0,
+                'slow_call_rate': slow / calls if calls else 0.0,
+                'total_requests': self.total_requests,
+                'rejected_requests': self.rejected_requests,
+            }
+
+    def _record(self, now: float, failed: bool, slow: bool):
+        """Count one outcome in the bucket for now, recycling a stale bucket"""
+        period = int(now / self.bucket_seconds)
+        index = period % len(self.bucket_period)
+        if self.bucket_period[index] != period:
+            self.bucket_period[index] = period
+            self.bucket_calls[index] = 0
+            self.bucket_failures[index] = 0
+            self.bucket_slow[index] = 0
+        self.bucket_calls[index] += 1
+        if failed:
+            self.bucket_failures[index] += 1
+        if slow:
+            self.bucket_slow[index] += 1
+
+    def _totals(self, now: float) -> Tuple[int, int, int]:
+        """Calls, failures and slow calls in buckets still inside the window"""
+        oldest = int(now / self.bucket_seconds) - len(self.bucket_period)
+        calls = failures = slow = 0
+        for index, period in enumerate(self.bucket_period):
+            if period > oldest:
+                calls += self.bucket_calls[index]
+                failures += self.bucket_failures[index]
+                slow += self.bucket_slow[index]
+        return calls, failures, slow
+
+    def _check_window(self):
+        """Open if the window holds enough calls and too many went wrong"""
+        calls, failures, slow = self._totals(time.time())
+        if calls >= self.minimum_requests and (
+                failures >= calls * self.failure_rate_threshold or
+                slow >= calls * self.slow_call_rate_threshold):
+            self._transition(CircuitBreakerState.OPEN)
+
+    def _check_recovery(self, now: float):
+        """Go HALF_OPEN once an OPEN breaker has waited out recovery_timeout
+
+        A HALF_OPEN breaker whose outstanding probes have gone that long
+        without a probe let through or answered opens again instead.
+        """
+        if (self.state == CircuitBreakerState.OPEN and
+                now - self.last_state_change >= self.recovery_timeout):
+            self._transition(CircuitBreakerState.HALF_OPEN)
+        elif (self.state == CircuitBreakerState.HALF_OPEN and
+                self.probes > self.success_count and
+                now - self.last_probe_event >= self.recovery_timeout):
+            self._transition(CircuitBreakerState.OPEN)
+
+    def _transition(self, new_state: CircuitBreakerState):
+        """Move to new_state, resetting counters and notifying listeners
+
+        Called with self.lock held. The window starts empty on every
+        transition, so a closed breaker is judged only on calls made
+        since it closed.
+        """
+        self.state = new_state
+        self.last_state_change = time.time()
+        for index in range(len(self.bucket_period)):
+            self.bucket_period[index] = -1
+        self.probes = 0
+        self.success_count = 0
+        if self.on_state_change:
+            self.on_state_change(self.instance_id, new_state.value)
+
+# ===================== SMART CLIENT =====================
+
+class RetryStrategy(Enum):
+    """Retry strategies"""
+    EXPONENTIAL = "exponential"
+    LINEAR = "linear"
+    FIXED = "fixed"
+    FULL_JITTER = "full_jitter"
+    DECORRELATED_JITTER = "decorrelated_jitter"
+
+class RetryBudget:
+    """Token bucket capping a client's retries at a fraction of its traffic
+
+    Every request deposits ratio tokens and every retry withdraws one, so
+    however many requests fail at once, retries stay under that fraction
+    of recent requests instead of multiplying load on a struggling
+    instance. min_per_second tokens also trickle in so that a quiet
+    client can still retry; the bucket holds at most max_tokens.
+    """
+
+    def __init__(self, ratio: float = 0.1, min_per_second: float = 1.0,
+                 max_tokens: float = 10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+
+        self.lock = threading.Lock()
+        self.tokens = max_tokens
+        self.refilled = time.time()
+
+        # Metrics
+        self.requests = 0
+        self.retries = 0
+        self.denied = 0
+
+    def deposit(self):
+        """Count a request"""
+        with self.lock:
+            self.requests += 1
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        """Take a token for one retry if the budget has one"""
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.max_tokens,
+                              self.tokens + (now - self.refilled) * self.min_per_second)
+            self.refilled = now
+            if self.tokens < 1.0:
+                self.denied += 1
+                return False
+            self.tokens -= 1.0
+            self.retries += 1
+            return True
+
+    def get_stats(self) -> dict:
+        """Get retry statistics
+
+        amplification is attempts sent per request: 1.0 means no retries.
+        """
+        with self.lock:
+            return {
+                'ratio': self.ratio,
+                'requests': self.requests,
+                'retries': self.retries,
+                'denied': self.denied,
+                'amplification': ((self.requests + self.retries) / self.requests
+                                  if self.requests else 1.0),
+            }
+
+class RpcError(Exception):
+    """A request reached an instance but did not succeed"""
+
+    def __init__(self, response: Response):
+        super().__init__(f"{response.status.name}: {response.error_message}")
+        self.response = response
+
+class BatchRpcError(RpcError):
+    """No item of a batch succeeded; responses holds every item's answer"""
+
+    def __init__(self, responses: List[Response]):
+        super().__init__(responses[0])
+        self.responses = responses
+
+class _ChunkSource:
+    """Cuts an iterable of values into float64 chunks, one at a time
+
+    A chunk shorter than chunk_size means the iterable is exhausted, so it
+    is the final one; when the length divides evenly an empty final chunk
+    closes the stream.
+    """
+
+    def __init__(self, values: Iterable[float], chunk_size: int):
+        self.iterator = iter(values)
+        self.chunk_size = chunk_size
+        self.seq = 0
+        self.chunk = array('d')
+        self.final = False
+        self._fill()
+
+    def advance(self):
+        """Move on to the next chunk"""
+        self.seq += 1
+        self._fill()
+
+    def _fill(self):
+        self.chunk = array('d', itertools.islice(self.iterator, self.chunk_size))
+        self.final = len(self.chunk) < self.chunk_size
+
+class _PendingCall:
+    """Slot a caller waits on until the reader thread delivers its reply
+
+    Slots may share one event so that a caller can wait for whichever of
+    several calls answers first; done tells them apart. A slot whose
+    caller stopped waiting may carry a callback run once it is done.
+    """
+    __slots__ = ('call_id', 'event', 'done', 'msg_type', 'data', 'error', 'callback',
+                 'timer')
+
+    def __init__(self, call_id: str, event: Optional[threading.Event] = None):
+        self.call_id = call_id
+        self.event = event or threading.Event()
+        self.done = False
+        self.msg_type = None
+        self.data = None
+        self.error = None
+        self.callback = None
+        self.timer = None
+
+class RpcConnection:
+    """Long-lived connection multiplexing many requests over one socket
+
+    Any number of threads may call() concurrently, and both servers work
+    on requests pipelined on one socket at the same time. Each outgoing
+    frame carries a request_id; a background reader thread matches
+    incoming frames back to the waiting caller by that id, whatever the
+    order replies come in. Callers may also let go of a call and have its
+    late reply dropped (cancel) or settled later (detach), and wait on
+    calls over several connections through one shared event.
+    """
+
+    def __init__(self, host: str, port: int, connect_timeout: float = 5.0,
+                 codec: Codec = Codec.JSON):
+        self.host = host
+        self.port = port
+        self.codec = Codec.JSON
+        self.sock = socket.create_connection((host, port), timeout=connect_timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.settimeout(None)  # The reader blocks; callers time out instead
+
+        self.send_lock = threading.Lock()
+        self.pending: Dict[str, _PendingCall] = {}
+        self.pending_lock = threading.Lock()
+        self.closed = False
+        self.pool_generation = 0
+
+        self.reader = threading.Thread(target=self._read_loop, daemon=True)
+        self.reader.start()
+
+        if codec != Codec.JSON:
+            self._negotiate_codec(codec, connect_timeout)
+
+    def _negotiate_codec(self, codec: Codec, timeout: float):
+        """Switch to codec only if the server lists it in its health reply"""
+        try:
+            _, health = self.call(MessageType.HEALTH_CHECK,
+                                  {'request_id': f'negotiate-{id(self)}'}, timeout)
+        except Exception:
+            self.close()
+            raise
+        if codec.value in health.get('codecs', ()):
+            self.codec = codec
+
+    def call(self, msg_type: MessageType, data: dict,
+             timeout: float) -> Tuple[MessageType, dict]:
+        """Send one frame and wait for the reply with the same request_id"""
+        slot = self.submit(msg_type, data)
+        try:
+            if not slot.event.wait(timeout):
+                raise socket.timeout(f"No response for {slot.call_id} within {timeout}s")
+            return self.result(slot)
+        finally:
+            self.cancel(slot)
+
+    def submit(self, msg_type: MessageType, data: dict,
+               event: Optional[threading.Event] = None) -> _PendingCall:
+        """Send one frame without waiting; its reply is delivered to the slot
+
+        The slot's event (or the given shared event) is set once the slot
+        is done. Call result() to read it, or cancel() to stop waiting.
+        """
+        call_id = data['request_id']
+        slot = _PendingCall(call_id, event)
+        with self.pending_lock:
+            if self.closed:
+                raise ConnectionError(f"Connection to {self.host}:{self.port} is closed")
+            if call_id in self.pending:
+                raise ValueError(f"Duplicate in-flight request_id: {call_id}")
+            self.pending[call_id] = slot
+
+        try:
+            frame = Protocol.encode_message(msg_type, data, self.codec)
+            with self.send_lock:
+                self.sock.sendall(frame)
+        except Exception:
+            self.cancel(slot)
+            raise
+        return slot
+
+    @staticmethod
+    def result(slot: _PendingCall) -> Tuple[MessageType, dict]:
+        """Return a done slot's reply, raising the error it failed with"""
+        if slot.error is not None:
+            raise slot.error
+        return slot.msg_type, slot.data
+
+    def cancel(self, slot: _PendingCall):
+        """Stop waiting for a call; a reply arriving later is dropped"""
+        with self.pending_lock:
+            if self.pending.get(slot.call_id) is slot:
+                del self.pending[slot.call_id]
+
+    def detach(self, slot: _PendingCall, callback, timeout: Optional[float] = None):
+        """Stop waiting for a call but run callback() once it is done
+
+        The callback runs on the reader thread, or right away if the
+        reply is already in. With a timeout, a call still unanswered
+        after that many seconds fails with socket.timeout and the
+        callback runs then, so a hung peer cannot hold it forever.
+        """
+        with self.pending_lock:
+            if not slot.done:
+                slot.callback = callback
+                if timeout is not None:
+                    slot.timer = threading.Timer(timeout, self._expire, (slot,))
+                    slot.timer.daemon = True
+                    slot.timer.start()
+                return
+        callback()
+
+    def _expire(self, slot: _PendingCall):
+        """Fail a detached call whose timeout passed with no reply"""
+        with self.pending_lock:
+            if slot.done or self.pending.get(slot.call_id) is not slot:
+                return
+            del self.pending[slot.call_id]
+            slot.error = socket.timeout(f"No response for {slot.call_id}")
+            slot.done = True
+        slot.event.set()
+        slot.callback()
+
+    def _read_loop(self):
+        """Dispatch incoming frames to waiting callers until the socket closes"""
+        reader = FrameReader(self.sock)
+        try:
+            while True:
+                frame = reader.read_frame()
+                if frame is None:
+                    break
+                msg_type, data, _ = Protocol.decode_payload(*frame)
+                call_id = data.get('request_id')
+                with self.pending_lock:
+                    slot = self.pending.get(call_id)
+                    # Connection-level errors are not tied to one request
+                    targets = [slot] if slot else (
+                        list(self.pending.values()) if call_id == 'error' else [])
+                    for target in targets:
+                        target.msg_type, target.data = msg_type, data
+                        target.done = True
+                        if target.callback is not None:
+                            del self.pending[target.call_id]
+                for target in targets:
+                    target.event.set()
+                    if target.timer is not None:
+                        target.timer.cancel()
+                    if target.callback is not None:
+                        target.callback()
+        except OSError:
+            pass  # Socket closed underneath the reader
+        except Exception as e:
+            print(f"Protocol decode error: {e}")
+        finally:
+            self.close()
+
+    def close(self):
+        """Close the socket and fail every call still waiting on it"""
+        error = ConnectionError(f"Connection to {self.host}:{self.port} closed")
+        with self.pending_lock:
+            if self.closed:
+                return
+            self.closed = True
+            waiting = [slot for slot in self.pending.values() if not slot.done]
+            for slot in waiting:
+                slot.error = error
+                slot.done = True
+            self.pending.clear()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        for slot in waiting:
+            slot.event.set()
+            if slot.timer is not None:
+                slot.timer.cancel()
+            if slot.callback is not None:
+                slot.callback()
+
+class AsyncRpcConnection(asyncio.Protocol):
+    """asyncio counterpart of RpcConnection, used by AsyncSmartClient
+
+    Any number of coroutines may call() at once and replies are matched
+    back to each caller's future by request_id, in whatever order the
+    server sends them. Frames queued during one event loop iteration go
+    out together in a single send, and replies are cut straight out of
+    the bytes data_received delivers, so a pipelined request costs no
+    syscall, extra await or task of its own.
+    """
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.codec = Codec.JSON
+        self.transport = None
+        self.buffer = bytearray()
+        self.outgoing: List[bytes] = []  # Frames waiting for the next flush
+        self.pending: Dict[str, asyncio.Future] = {}
+        self.closed = False
+
+    @classmethod
+    async def open(cls, host: str, port: int, timeout: float,
+                   codec: Codec = Codec.JSON) -> 'AsyncRpcConnection':
+        """Connect to host:port, switching to codec if the server offers it"""
+        loop = asyncio.get_running_loop()
+        _, conn = await asyncio.wait_for(
+            loop.create_connection(lambda: cls(host, port), host, port), timeout)
+        if codec != Codec.JSON:
+            try:
+                _, health = await conn.call(MessageType.HEALTH_CHECK,
+                                            {'request_id': f'negotiate-{id(conn)}'}, timeout)
+            except Exception:
+                conn.close()
+                raise
+            if codec.value in health.get('codecs', ()):
+                conn.codec = codec
+        return conn
+
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+        sock = transport.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def data_received(self, data: bytes):
+        buffer = self.buffer
+        buffer += data
+        start, end = 0, len(buffer)
+        try:
+            while end - start >= Protocol.HEADER.size:
+                length, type_byte = Protocol.HEADER.unpack_from(buffer, start)
+                if length < 1 or length > Protocol.MAX_FRAME_SIZE:
+                    raise ValueError(f"Invalid frame length: {length}")
+                frame_end = start + 4 + length
+                if frame_end > end:
+                    break
+                msg_type, reply, _ = Protocol.decode_payload(
+                    type_byte, bytes(buffer[start + Protocol.HEADER.size:frame_end]))
+                start = frame_end
+                call_id = reply.get('request_id')
+                future = self.pending.pop(call_id, None)
+                if future is not None:
+                    if not future.done():
+                        future.set_result((msg_type, reply))
+                elif call_id == 'error':
+                    # Connection-level errors are not tied to one request
+                    for future in self.pending.values():
+                        if not future.done():
+                            future.set_result((msg_type, reply))
+                    self.pending.clear()
+        except Exception as e:
+            print(f"Protocol decode error: {e}")
+            self.close()
+            return
+        del buffer[:start]
+
+    def connection_lost(self, exc: Optional[Exception]):
+        self.closed = True
+        error = ConnectionError(f"Connection to {self.host}:{self.port} closed")
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self.pending.clear()
+
+    async def call(self, msg_type: MessageType, data: dict,
+                   timeout: float) -> Tuple[MessageType, dict]:
+        """Send one frame and wait for the reply with the same request_id"""
+        if self.closed:
+            raise ConnectionError(f"Connection to {self.host}:{self.port} is closed")
+        call_id = data['request_id']
+        if call_id in self.pending:
+            raise ValueError(f"Duplicate in-flight request_id: {call_id}")
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending[call_id] = future
+        if not self.outgoing:
+            loop.call_soon(self._flush)
+        self.outgoing.append(Protocol.encode_message(msg_type, data, self.codec))
+        # A plain timer is much cheaper than wrapping the wait in wait_for
+        timer = loop.call_later(timeout, self._expire, call_id, future, timeout)
+        try:
+            return await future
+        finally:
+            timer.cancel()
+            if self.pending.get(call_id) is future:
+                del self.pending[call_id]
+
+    def _flush(self):
+        frames, self.outgoing = self.outgoing, []
+        if not self.closed:
+            self.transport.write(b''.join(frames))
+
+    def _expire(self, call_id: str, future: asyncio.Future, timeout: float):
+        if not future.done():
+            future.set_exception(socket.timeout(f"No response for {call_id} within {timeout}s"))
+
+    def close(self):
+        """Close the connection; calls still waiting on it fail"""
+        if self.transport is not None and not self.closed:
+            self.closed = True
+            self.transport.close()
+
+class ConnectionPool:
+    """Bounded pool of ready RpcConnections per (host, port)
+
+    Callers check a connection out for the duration of one request and
+    return it afterwards. The pool does not use RpcConnection's
+    multiplexing: a call that times out or gets a malformed reply
+    discards its connection, which must not fail other calls with it.
+    max_per_host therefore caps the requests one client has in flight to
+    an instance: at most that many connections (idle plus checked out)
+    exist per instance, and when the cap is reached checkout() waits for
+    one to be returned. Idle connections older than idle_timeout are
+    closed instead of reused. To pipeline many requests over a few
+    sockets, use RpcConnection directly or AsyncSmartClient.
+    """
+
+    def __init__(self, max_per_host: int = 16, idle_timeout: float = 30.0,
+                 connect_timeout: float = 5.0, codec: Codec = Codec.JSON):
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.codec = codec
+
+        self.lock = threading.Lock()
+        self.available = threading.Condition(self.lock)
+        self.idle: Dict[Tuple[str, int], deque] = defaultdict(deque)  # (conn, last_used)
+        self.in_use: Dict[Tuple[str, int], int] = defaultdict(int)
+        self.generation: Dict[Tuple[str, int], int] = defaultdict(int)
+
+        # Metrics
+        self.checkouts = 0
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.evictions = 0
+        self.timeouts = 0
+
+    def checkout(self, host: str, port: int, timeout: float) -> RpcConnection:
+        """Take a ready connection to host:port, opening one if allowed"""
+        key = (host, port)
+        deadline = time.time() + timeout
+        waited_since = None
+
+        with self.lock:
+            while True:
+                conn = self._pop_idle(key)
+                if conn is not None:
+                    self.hits += 1
+                    break
+                if len(self.idle[key]) + self.in_use[key] < self.max_per_host:
+                    conn = None  # Reserve a slot and connect outside the lock
+                    self.misses += 1
+                    break
+
+                if waited_since is None:
+                    waited_since = time.time()
+                    self.waits += 1
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    self._record_wait(waited_since)
+                    raise TimeoutError(f"Connection pool for {host}:{port} exhausted")
+                self.available.wait(remaining)
+
+            self.checkouts += 1
+            self.in_use[key] += 1
+            generation = self.generation[key]
+            if waited_since is not None:
+                self._record_wait(waited_since)
+
+        if conn is None:
+            try:
+                conn = RpcConnection(host, port, self.connect_timeout, self.codec)
+            except Exception:
+                with self.lock:
+                    self.in_use[key] -= 1
+                    self.available.notify()
+                raise
+            conn.pool_generation = generation
+        return conn
+
+    def checkin(self, conn: RpcConnection, discard: bool = False):
+        """Return a checked-out connection; discard it if it is suspect"""
+        key = (conn.host, conn.port)
+        with self.lock:
+            self.in_use[key] -= 1
+            stale = conn.pool_generation != self.generation[key]
+            if discard or stale or conn.closed:
+                self.evictions += 1
+                conn.close()
+            else:
+                self.idle[key].append((conn, time.time()))
+            self.available.notify()
+
+    def evict(self, host: str, port: int):
+        """Close every pooled connection to host:port
+
+        Idle connections close immediately; checked-out ones are closed
+        when they are returned.
+        """
+        key = (host, port)
+        with self.lock:
+            self.generation[key] += 1
+            idle = self.idle.pop(key, deque())
+            self.evictions += len(idle)
+            self.available.notify_all()
+        for conn, _ in idle:
+            conn.close()
+
+    def occupancy(self, host: str, port: int) -> Tuple[int, int]:
+        """Return (idle, in_use) connection counts for host:port"""
+        key = (host, port)
+        with self.lock:
+            return len(self.idle.get(key, ())), self.in_use.get(key, 0)
+
+    def get_stats(self) -> dict:
+        """Get pool sizing statistics"""
+        with self.lock:
+            return {
+                'checkouts': self.checkouts,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / self.checkouts if self.checkouts else 0.0,
+                'waits': self.waits,
+                'avg_wait_ms': (self.wait_time_total / self.waits * 1000)
+                               if self.waits else 0.0,
+                'max_wait_ms': self.wait_time_max * 1000,
+                'timeouts': self.timeouts,
+                'evictions': self.evictions,
+                'idle': sum(len(q) for q in self.idle.values()),
+                'in_use': sum(self.in_use.values()),
+            }
+
+    def close(self):
+        """Close all idle connections"""
+        with self.lock:
+            idle = [conn for q in self.idle.values() for conn, _ in q]
+            self.idle.clear()
+            for key in self.generation:
+                self.generation[key] += 1
+        for conn in idle:
+            conn.close()
+
+    def _pop_idle(self, key: Tuple[str, int]) -> Optional[RpcConnection]:
+        """Pop the most recently used live connection; caller holds the lock"""
+        idle = self.idle[key]
+        now = time.time()
+        # Oldest entries sit on the left; expire them first
+        while idle and now - idle[0][1] > self.idle_timeout:
+            conn, _ = idle.popleft()
+            self.evictions += 1
+            conn.close()
+        while idle:
+            conn, _ = idle.pop()
+            if not conn.closed:
+                return conn
+        return None
+
+    def _record_wait(self, waited_since: float):
+        """Accumulate time a caller spent blocked on a full pool"""
+        waited = time.time() - waited_since
+        self.wait_time_total += waited
+        self.wait_time_max = max(self.wait_time_max, waited)
+
+class _LatencyWindow:
+    """Most recent latencies (ms) with a lazily refreshed percentile"""
+    __slots__ = ('samples', 'fresh', 'threshold')
+
+    def __init__(self, size: int):
+        self.samples = deque(maxlen=size)
+        self.fresh = 0  # Samples added since threshold was computed
+        self.threshold = None
+
+    def add(self, latency_ms: float):
+        self.samples.append(latency_ms)
+        self.fresh += 1
+
+    def percentile(self, fraction: float, min_samples: int) -> Optional[float]:
+        """The fraction-th latency, recomputed after every size/8 new samples"""
+        if len(self.samples) < min_samples:
+            return None
+        if self.threshold is None or self.fresh * 8 >= self.samples.maxlen:
+            ordered = sorted(self.samples)
+            self.threshold = ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+            self.fresh = 0
+        return self.threshold
+
+class HedgingPolicy:
+    """Decides when SmartClient may duplicate a slow request
+
+    A request still unanswered after the percentile-th latency recently
+    seen from its instance, or from all instances if that is lower (so
+    an instance that is always slow gets hedged too), is sent again to a
+    second instance. Every request adds budget tokens to a bucket and
+    every hedge spends one, capping hedges at that fraction of requests
+    with bursts of at most max_tokens.
+    """
+
+    def __init__(self, percentile: float = 95.0, budget: float = 0.05,
+                 window: int = 128, min_samples: int = 20, max_tokens: float = 10.0):
+        self.fraction = percentile / 100.0
+        self.budget = budget
+        self.window = window
+        self.min_samples = min_samples
+        self.max_tokens = max_tokens
+
+        self.lock = threading.Lock()
+        self.tokens = max_tokens
+        self.latencies: Dict[str, _LatencyWindow] = {}
+        self.overall = _LatencyWindow(window * 4)
+
+        # Metrics
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.budget_denied = 0
+
+    def record(self, instance_id: str, latency_ms: float):
+        """Take in the latency of a request that completed"""
+        with self.lock:
+            latencies = self.latencies.get(instance_id)
+            if latencies is None:
+                latencies = self.latencies[instance_id] = _LatencyWindow(self.window)
+            latencies.add(latency_ms)
+            self.overall.add(latency_ms)
+
+    def delay(self, instance_id: str) -> Optional[float]:
+        """Seconds to wait on instance before hedging, None if unknown yet
+
+        Also counts the request towards the budget.
+        """
+        with self.lock:
+            self.requests += 1
+            self.tokens = min(self.max_tokens, self.tokens + self.budget)
+            thresholds = [t for t in (
+                self.overall.percentile(self.fraction, self.min_samples),
+                self.latencies[instance_id].percentile(self.fraction, self.min_samples)
+                if instance_id in self.latencies else None) if t is not None]
+        return min(thresholds) / 1000.0 if thresholds else None
+
+    def try_hedge(self) -> bool:
+        """Spend a token on a hedge if the budget has one"""
+        with self.lock:
+            if self.tokens < 1.0:
+                self.budget_denied += 1
+                return False
+            self.tokens -= 1.0
+            self.hedges += 1
+            return True
+
+    def refund(self):
+        """Give back the token of a hedge that found nowhere to go"""
+        with self.lock:
+            self.tokens = min(self.max_tokens, self.tokens + 1.0)
+            self.hedges -= 1
+
+    def record_win(self):
+        """Note that a hedge answered before the request it duplicated"""
+        with self.lock:
+            self.hedge_wins += 1
+
+    def get_stats(self) -> dict:
+        """Get hedging statistics"""
+        with self.lock:
+            return {
+                'percentile': self.fraction * 100,
+                'budget': self.budget,
+                'requests': self.requests,
+                'hedges': self.hedges,
+                'hedge_rate': self.hedges / self.requests if self.requests else 0.0,
+                'hedge_wins': self.hedge_wins,
+                'win_rate': self.hedge_wins / self.hedges if self.hedges else 0.0,
+                'budget_denied': self.budget_denied,
+            }
+
+class _HedgeLeg:
+    """One copy of a hedged request in flight on a pooled connection"""
+    __slots__ = ('instance', 'conn', 'slot', 'start')
+
+    def __init__(self, instance: InstanceInfo, conn: RpcConnection,
+                 slot: _PendingCall, start: float):
+        self.instance = instance
+        self.conn = conn
+        self.slot = slot
+        self.start = start
+
+class TraceRecorder:
+    """Appends one JSON line per client request to a trace file
+
+    record() only queues the request with its outcome; a background
+    thread turns queued entries into JSON and writes them out in batches
+    every flush_interval, so tracing costs a request about a deque
+    append. If the writer falls max_pending entries behind, new entries
+    are dropped and counted rather than growing memory or blocking
+    callers. With include_values off only the length of values is kept,
+    which keeps traces of large requests small.
+
+    Entries are written as requests finish, so they are in completion
+    order, not in order of their ts (start) stamps; read_in_order()
+    restores start order. Opening a recorder truncates path: one trace
+    file holds one run.
+    """
+
+    def __init__(self, path: str, include_values: bool = True,
+                 flush_interval: float = 0.2, max_pending: int = 100000):
+        self.path = path
+        self.include_values = include_values
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.file = open(path, 'w', buffering=1 << 20)
+        self.pending = deque()  # (request, started, finished, response, error)
+        self.written = 0
+        self.dropped = 0
+        self.stopping = threading.Event()
+        self.writer = threading.Thread(target=self._writer_loop, daemon=True,
+                                       name="trace-writer")
+        self.writer.start()
+
+    def record(self, request: Request, started: float, response: Optional[Response] = None,
+               error: Optional[Exception] = None):
+        """Queue one finished request: its answer, or the error it failed with"""
+        if len(self.pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self.pending.append((request, started, time.time(), response, error))
+
+    def _writer_loop(self):
+        while not self.stopping.wait(self.flush_interval):
+            self._flush()
+        self._flush()
+
+    def _flush(self):
+        lines = []
+        while self.pending:
+            lines.append(json.dumps(self._entry(*self.pending.popleft()), default=str))
+        if lines:
+            self.file.write('\n'.join(lines) + '\n')
+            self.file.flush()
+            self.written += len(lines)
+
+    def _entry(self, request: Request, started: float, finished: float,
+               response: Optional[Response], error: Optional[Exception]) -> dict:
+        entry = {
+            'ts': started,
+            'request_id': request.request_id,
+            'method': request.method,
+            'operation': request.operation,
+            'size': len(request.values),
+            'deadline_ms': (request.deadline - started) * 1000,
+            'metadata': request.metadata,
+            'latency_ms': (finished - started) * 1000,
+        }
+        if self.include_values:
+            entry['values'] = (request.values if isinstance(request.values, list)
+                               else list(request.values))
+        if response is not None:
+            entry['status'] = response.status.name
+            entry['server_id'] = response.server_id
+        else:
+            entry['status'] = 'ERROR'
+            entry['error'] = str(error)
+        return entry
+
+    def get_stats(self) -> dict:
+        return {'path': self.path, 'written': self.written, 'dropped': self.dropped,
+                'pending': len(self.pending)}
+
+    def close(self):
+        """Write out everything queued and close the file"""
+        self.stopping.set()
+        self.writer.join()
+        self.file.close()
+
+    @staticmethod
+    def read(path: str) -> Iterable[dict]:
+        """Entries of a trace one at a time, so its size does not matter"""
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    @staticmethod
+    def read_in_order(path: str, window: float = 10.0,
+                      max_bytes: int = 64 << 20) -> Iterable[dict]:
+        """Entries of a trace in order of ts, still read lazily
+
+        An entry is written when its request finishes, at most its
+        latency after its ts, so once entries finishing window seconds
+        after it have been read no earlier one can follow. The default
+        covers requests of up to twice SmartClient's default timeout; a
+        slower one may come out of order.
+
+        Memory: entries wait as their raw lines, about window x request
+        rate x line size (values included), and are decoded again on the
+        way out. Past max_bytes the earliest are let go early, so the
+        buffer stays bounded whatever the trace holds.
+        """
+        pending = []
+        buffered = 0
+        with open(path) as f:
+            for n, line in enumerate(f):
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                heapq.heappush(pending, (entry['ts'], n, line))
+                buffered += len(line)
+                finished = entry['ts'] + entry.get('latency_ms', 0.0) / 1000.0
+                while pending and (pending[0][0] < finished - window or
+                                   buffered > max_bytes):
+                    line = heapq.heappop(pending)[2]
+                    buffered -= len(line)
+                    yield json.loads(line)
+        while pending:
+            yield json.loads(heapq.heappop(pending)[2])
+
+class SmartClient:
+    """Client with retry logic and circuit breakers - STUDENT MUST IMPLEMENT"""
+
+    # Server answers that mean the request was not carried out and may be
+    # sent again, to this or another instance
+    RETRYABLE_STATUSES = frozenset({StatusCode.UNAVAILABLE})
+    
+    def __init__(self, load_balancer: LoadBalancer, persistent_connections: bool = True,
+                 max_connections_per_host: int = 16, idle_timeout: float = 30.0,
+                 codec: Codec = Codec.JSON, cache_ttl: Optional[float] = None,
+                 cache_entries: int = 1024, hedge_percentile: Optional[float] = None,
+                 hedge_budget: float = 0.05, retry_ratio: float = 0.1,
+                 metrics_port: Optional[int] = None, trace_path: Optional[str] = None,
+                 trace_values: bool = True):
+        self.load_balancer = load_balancer
+        self.circuit_breakers: Dict[str, CircuitBreaker] = {}
+        
+        # Configuration
+        self.max_retries = 3
+        self.retry_strategy = RetryStrategy.FULL_JITTER
+        self.base_delay = 100  # milliseconds
+        self.max_delay = 5000  # milliseconds, caps the jittered strategies
+        self.timeout = 5.0  # seconds
+        self.persistent_connections = persistent_connections
+        # Pooled connections negotiate the codec; one-shot requests assume it
+        self.codec = codec
+
+        # Pooled persistent connections, visible to the load balancer's stats
+        self.pool = None
+        if persistent_connections:
+            self.pool = ConnectionPool(max_connections_per_host, idle_timeout,
+                                       self.timeout, codec)
+            self.load_balancer.attach_connection_pool(self.pool)
+        self.breakers_lock = threading.Lock()
+
+        # Successful responses for hot (operation, values) keys, when enabled
+        self.cache = ResultCache(cache_entries, ttl=cache_ttl) if cache_ttl else None
+
+        # Shared by every request, so failures cannot turn into a retry storm
+        self.retry_budget = RetryBudget(retry_ratio)
+
+        # Duplicates slow requests to a second instance, when enabled; this
+        # needs persistent connections
+        self.hedging = (HedgingPolicy(hedge_percentile, hedge_budget)
+                        if hedge_percentile and persistent_connections else None)
+
+        # Background health checks, started by start_health_prober()
+        self.health_prober = None
+
+        # Fans batch chunks out to instances concurrently, created on first use
+        self.executor = None
+        self.executor_workers = max_connections_per_host
+        self.executor_lock = threading.Lock()
+        
+        # Metrics
+        self.request_log = []
+        self.stats_lock = threading.Lock()
+        self.expired_requests = 0  # Requests that ended DEADLINE_EXCEEDED
+        self.metrics = MetricsRegistry()
+        self.metrics.add_collector(self._collect_metrics)
+        self.latency_histograms: Dict[str, Histogram] = {}
+        self.retry_histogram = self.metrics.histogram(
+            'rpc_client_request_retries', 'Retries each request needed', unit=1)
+        self.metrics_server = (MetricsServer(self.metrics, metrics_port).start()
+                               if metrics_port is not None else None)
+
+        # Every request and its outcome, appended to trace_path when given
+        self.recorder = TraceRecorder(trace_path, trace_values) if trace_path else None
+    
+    def send_request(self, request: Request) -> Response:
+        """Send request with retries and circuit breaking
+
+        With a client cache, a fresh answer for the same operation and
+        values is returned without touching the network. With hedging, an
+        attempt that is slow to answer is duplicated to a second instance
+        (see HedgingPolicy). With a trace_path, the request and its
+        outcome are recorded whichever way it ends.
+        """
+        started = time.time()
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(request.operation, request.values)
+            cached = self.cache.get(key) if key is not None else None
+            if cached is not None:
+                response = replace(cached, request_id=request.request_id)
+                self._trace(request, started, response)
+                return response
+
+        attempt = 0
+        last_error = None
+        delay_ms = 0.0
+        skipped = ()  # Instances whose breaker refused this attempt
+        self.retry_budget.deposit()
+        
+        while attempt < self.max_retries:
+            timeout = self._attempt_timeout(request.deadline)
+            if timeout <= 0:
+                last_error = self._deadline_error(request.request_id)
+                break
+            self._refresh_circuit_states()
+            instance = self.load_balancer.select_instance(request, exclude=skipped)
+
+            if instance is None:
+                last_error = Exception("No healthy instances available")
+            else:
+                try:
+                    delay = (self.hedging.delay(instance.instance_id)
+                             if self.hedging is not None else None)
+                    if delay is None:
+                        start = time.time()
+                        response = self._call_instance(instance, self._send_checked,
+                                                       instance, request, timeout)
+                        if self.hedging is not None:
+                            self.hedging.record(instance.instance_id,
+                                                (time.time() - start) * 1000)
+                    else:
+                        response = self._send_hedged(instance, request, delay)
+                    if key is not None:
+                        self.cache.put(key, response)
+                    self.retry_histogram.record(attempt)
+                    self._trace(request, started, response)
+                    return response
+                except CircuitOpenError:
+                    # A half-open breaker out of probes: pick again, no attempt spent
+                    skipped += (instance.instance_id,)
+                    continue
+                except Exception as e:
+                    last_error = e
+                    if not isinstance(e, RpcError) and time.time() >= request.deadline:
+                        # The attempt timed out because the deadline did
+                        last_error = self._deadline_error(request.request_id)
+
+            attempt += 1
+            skipped = ()
+            delay_ms, last_error = self._plan_retry(request, attempt, last_error, delay_ms)
+            if delay_ms is None:
+                break
+            time.sleep(delay_ms / 1000.0)
+
+        return self._give_up(request, started, attempt, last_error)
+
+    def _plan_retry(self, request: Request, attempt: int, error: Exception,
+                    previous_ms: float) -> Tuple[Optional[float], Exception]:
+        """Decide whether a request gets another attempt after error
+
+        Returns the backoff in ms, paid for from the retry budget, and the
+        error to report; the backoff is None when the request should stop.
+        """
+        if attempt >= self.max_retries or not self._retryable(error):
+            return None, error
+        delay_ms = self._calculate_retry_delay(attempt, previous_ms)
+        if isinstance(error, RpcError) and error.response.retry_after_ms:
+            # An overloaded server knows better when to come back
+            delay_ms = max(delay_ms, error.response.retry_after_ms)
+        if not self._fits_deadline(delay_ms, request.deadline):
+            return None, self._deadline_error(request.request_id)
+        if not self.retry_budget.withdraw():
+            return None, error
+        return delay_ms, error
+
+    def _give_up(self, request: Request, started: float, attempts: int,
+                 error: Exception) -> Response:
+        """Surface the last server answer if there was one, else raise the transport error"""
+        self.retry_histogram.record(max(0, attempts - 1))
+        if isinstance(error, RpcError):
+            if error.response.status == StatusCode.DEADLINE_EXCEEDED:
+                self._count_expired()
+            self._trace(request, started, error.response)
+            return error.response
+        self._trace(request, started, error=error)
+        raise Exception(f"Request {request.request_id} failed after "
+                        f"{attempts} attempts: {error}")
+
+    def _trace(self, request: Request, started: float, response: Optional[Response] = None,
+               error: Optional[Exception] = None):
+        """Record a finished request, if this client keeps a trace"""
+        if self.recorder is not None:
+            self.recorder.record(request, started, response, error)
+
+    def send_batch(self, requests: List[Request], batch_size: int = 64) -> List[Response]:
+        """Send many requests as batches spread across instances
+
+        The list is cut into chunks of batch_size, each routed to an
+        instance by the load balancer and sent concurrently. Responses
+        come back in input order, one per request; items that could not
+        be delivered at all surface as UNAVAILABLE responses.
+        """
+        chunks = [requests[i:i + batch_size] for i in range(0, len(requests), batch_size)]
+        if len(chunks) <= 1:
+            results = [self._send_batch_chunk(chunk) for chunk in chunks]
+        else:
+            results = list(self._get_executor().map(self._send_batch_chunk, chunks))
+        return [response for chunk in results for response in chunk]
+
+    def _send_batch_chunk(self, chunk: List[Request]) -> List[Response]:
+        """Send one chunk with retries, resending only items worth retrying"""
+        responses: List[Optional[Response]] = [None] * len(chunk)
+        pending = list(range(len(chunk)))
+        attempt = 0
+        last_error = None
+
+        # The chunk's deadline is its latest item's; the server drops the rest
+        deadline = max(request.deadline for request in chunk)
+        delay_ms = 0.0
+        skipped = ()  # Instances whose breaker refused this attempt
+        self.retry_budget.deposit()
+
+        while pending and attempt < self.max_retries:
+            timeout = self._attempt_timeout(deadline)
+            if timeout <= 0:
+                break
+            self._refresh_circuit_states()
+            instance = self.load_balancer.select_instance(chunk[pending[0]], exclude=skipped)
+            retry_after_ms = 0.0
+
+            if instance is None:
+                last_error = Exception("No healthy instances available")
+            else:
+                items = None
+                try:
+                    items = self._call_instance(instance, self._send_batch_checked, instance,
+                                                [chunk[i] for i in pending], timeout)
+                except CircuitOpenError:
+                    skipped += (instance.instance_id,)
+                    continue
+                except BatchRpcError as e:
+                    last_error = e
+                    items = e.responses
+                except Exception as e:
+                    last_error = e
+
+                if items is not None:
+                    retry = []
+                    for index, response in zip(pending, items):
+                        responses[index] = response
+                        if response.status == StatusCode.UNAVAILABLE:
+                            retry.append(index)
+                            retry_after_ms = max(retry_after_ms,
+                                                 response.retry_after_ms or 0.0)
+                    pending = retry
+
+            attempt += 1
+            skipped = ()
+            if pending and attempt < self.max_retries:
+                delay_ms = max(self._calculate_retry_delay(attempt, delay_ms), retry_after_ms)
+                if not (self._fits_deadline(delay_ms, deadline) and
+                        self._spend_retry(delay_ms)):
+                    break
+
+        now = time.time()
+        for index in pending:
+            if now >= chunk[index].deadline:
+                responses[index] = self._deadline_error(chunk[index].request_id).response
+            elif responses[index] is None:
+                responses[index] = Response(
+                    request_id=chunk[index].request_id, status=StatusCode.UNAVAILABLE,
+                    result=None, error_message=f"Batch delivery failed: {last_error}",
+                    latency_ms=0.0, server_id='')
+        expired = sum(response.status == StatusCode.DEADLINE_EXCEEDED
+                      for response in responses)
+        if expired:
+            self._count_expired(expired)
+        return responses
+
+    def send_stream(self, operation: str, values: Iterable[float], chunk_size: int = 65536,
+                    deadline: Optional[float] = None,
+                    on_partial: Optional[Callable[[Response], None]] = None,
+                    request_id: Optional[str] = None) -> Response:
+        """Aggregate an unbounded sequence of values as a stream of chunks
+
+        values may be any iterable, typically a generator. It is consumed
+        chunk_size values at a time and each chunk is sent as soon as it
+        fills, so memory on both ends stays proportional to chunk_size.
+        The server acknowledges every chunk with the running result;
+        on_partial, if given, receives those partial Responses. Without a
+        deadline the stream may run for as long as values last.
+
+        A refused chunk is resent on the same connection. Failing over to
+        another instance is only possible before the first chunk has been
+        accepted, since earlier values are gone by then.
+        """
+        request = Request(
+            request_id=request_id or f"stream_{time.time()}_{random.getrandbits(32):08x}",
+            method="Calculate",
+            operation=operation,
+            values=[],
+            deadline=deadline if deadline is not None else math.inf,
+            metadata={},
+        )
+        source = _ChunkSource(values, chunk_size)
+        attempt = 0
+        last_error = None
+        delay_ms = 0.0
+        skipped = ()  # Instances whose breaker refused this attempt
+
+        while attempt < self.max_retries:
+            if time.time() >= request.deadline:
+                last_error = self._deadline_error(request.request_id)
+                break
+            self._refresh_circuit_states()
+            instance = self.load_balancer.select_instance(request, exclude=skipped)
+
+            if instance is None:
+                last_error = Exception("No healthy instances available")
+            else:
+                try:
+                    return self._call_instance(instance, self._send_stream_checked,
+                                               instance, request, source, on_partial)
+                except CircuitOpenError:
+                    skipped += (instance.instance_id,)
+                    continue
+                except Exception as e:
+                    last_error = e
+
+            attempt += 1
+            skipped = ()
+            if not isinstance(last_error, RpcError) and time.time() >= request.deadline:
+                last_error = self._deadline_error(request.request_id)
+            if source.seq > 0 or attempt >= self.max_retries or \
+                    not self._retryable(last_error):
+                break
+            delay_ms = self._calculate_retry_delay(attempt, delay_ms)
+            if not self._fits_deadline(delay_ms, request.deadline):
+                last_error = self._deadline_error(request.request_id)
+                break
+            if not self._spend_retry(delay_ms):
+                break
+
+        if isinstance(last_error, RpcError):
+            if last_error.response.status == StatusCode.DEADLINE_EXCEEDED:
+                self._count_expired()
+            return last_error.response
+        raise Exception(f"Stream {request.request_id} failed after "
+                        f"{attempt} attempts: {last_error}")
+
+    def _send_stream_checked(self, instance: InstanceInfo, request: Request,
+                             source: '_ChunkSource', on_partial) -> Response:
+        """Stream every chunk to instance, raising RpcError unless the result is OK"""
+        timeout = self._attempt_timeout(request.deadline)
+        if self.persistent_connections:
+            conn = self.pool.checkout(instance.host, instance.port, timeout)
+        else:
+            conn = RpcConnection(instance.host, instance.port, timeout, self.codec)
+        try:
+            while True:
+                data = request.to_dict()
+                data['values'] = source.chunk if conn.codec == Codec.BINARY \
+                    else source.chunk.tolist()
+                data['metadata'] = {'seq': source.seq, 'final': source.final}
+                response = self._send_stream_chunk(conn, instance, data, request.deadline)
+                if response.status != StatusCode.OK or source.final:
+                    break
+                source.advance()
+                if on_partial is not None:
+                    on_partial(response)
+        except Exception:
+            self._release_stream_connection(conn, discard=True)
+            raise
+        # A failed stream may have left state behind on the server
+        self._release_stream_connection(conn, discard=response.status != StatusCode.OK)
+        if response.status != StatusCode.OK:
+            raise RpcError(response)
+        return response
+
+    def _send_stream_chunk(self, conn: 'RpcConnection', instance: InstanceInfo,
+                           data: dict, deadline: float) -> Response:
+        """Send one chunk, resending it while the server refuses it"""
+        attempt = 0
+        delay_ms = 0.0
+        self.retry_budget.deposit()
+        while True:
+            try:
+                msg_type, reply = conn.call(MessageType.STREAM_CHUNK, data,
+                                            max(0.0, self._attempt_timeout(deadline)))
+                response = Response.from_dict(reply)
+            except (KeyError, ValueError, TypeError) as e:
+                raise ConnectionError(f"Malformed response from "
+                                      f"{instance.instance_id}: {e}")
+            attempt += 1
+            if response.status != StatusCode.UNAVAILABLE or attempt >= self.max_retries:
+                return response
+            delay_ms = max(self._calculate_retry_delay(attempt, delay_ms),
+                           response.retry_after_ms or 0)
+            if not (self._fits_deadline(delay_ms, deadline) and self._spend_retry(delay_ms)):
+                return response
+
+    def _release_stream_connection(self, conn: 'RpcConnection', discard: bool):
+        """Return a streaming connection to the pool, or close a one-shot one"""
+        if self.persistent_connections:
+            self.pool.checkin(conn, discard=discard)
+        else:
+            conn.close()
+
+    def _call_instance(self, instance: InstanceInfo, func, *args):
+        """Run func through instance's circuit breaker, recording LB stats
+
+        A call the breaker refuses raises CircuitOpenError before anything
+        is recorded, since it never reached the instance.
+        """
+        breaker = self._get_circuit_breaker(instance.instance_id)
+        if not breaker.allow():
+            raise CircuitOpenError(f"Circuit open for {instance.instance_id}")
+        self.load_balancer.update_instance_stats(
+            instance.instance_id, 0, True, connections_delta=1)
+        start = time.time()
+        success = False
+        outcome = None
+        try:
+            outcome = func(*args)
+            success = True
+            return outcome
+        except RpcError as e:
+            outcome = e
+            raise
+        finally:
+            latency = (time.time() - start) * 1000
+            if success:
+                breaker.on_success(latency)
+            else:
+                breaker.on_failure(latency)
+            self._end_call(instance.instance_id, latency, success,
+                           self._load_report(outcome))
+
+    def _end_call(self, instance_id: str, latency_ms: float, success: bool,
+                  load_report: Optional[List[float]] = None):
+        """Record a finished call with the load balancer and in its latency histogram"""
+        histogram = self.latency_histograms.get(instance_id)
+        if histogram is None:
+            histogram = self.latency_histograms[instance_id] = self.metrics.histogram(
+                'rpc_client_latency_seconds', 'Round trip of each call to an instance',
+                instance=instance_id)
+        histogram.record(latency_ms / 1000.0)
+        self.load_balancer.update_instance_stats(
+            instance_id, latency_ms, success, connections_delta=-1, load_report=load_report)
 
-class CircuitBreakerState(Enum):
-    """Circuit breaker states"""
-    CLOSED = "closed"      # Normal operation
-    OPEN = "open"          # Failing, reject requests  
-    HALF_OPEN = "half_open"  # Testing recovery
+    @staticmethod
+    def _load_report(outcome) -> Optional[List[float]]:
+        """The server load report carried by a call's outcome, if any"""
+        if isinstance(outcome, RpcError):
+            outcome = outcome.response
+        elif isinstance(outcome, list):
+            outcome = outcome[-1] if outcome else None
+        return getattr(outcome, 'load', None)
 
-class CircuitBreaker:
-    """Circuit breaker for fault tolerance - STUDENT MUST IMPLEMENT"""
-    
-    def __init__(self, instance_id: str,
-                 failure_threshold: int = 5,
-                 recovery_timeout: int = 60,
-                 success_threshold: int = 3):
-        self.instance_id = instance_id
-        self.state = CircuitBreakerState.CLOSED
-        
-        # Configuration
-        self.failure_threshold = failure_threshold
-        self.recovery_timeout = recovery_timeout
-        self.success_threshold = success_threshold
-        
-        # State tracking
-        self.failure_count = 0
-        self.success_count = 0
-        self.last_failure_time = 0
-        self.last_state_change = time.time()
-        
-        # Metrics
-        self.total_requests = 0
-        self.rejected_requests = 0
-    
-    def call(self, func, *args, **kwargs):
-        """Execute function with circuit breaker protection"""
-        # TODO: STUDENT MUST IMPLEMENT
-        # 1. Check current state
-        # 2. If OPEN:
-        #    - Check if recovery_timeout has passed
-        #    - If yes, transition to HALF_OPEN
-        #    - If no, reject request (raise exception)
-        # 3. If HALF_OPEN or CLOSED:
-        #    - Try to execute function
-        #    - Call on_success() if successful
-        #    - Call on_failure() if failed
-        # 4. Return result or raise exception
-        
-        self.total_requests += 1
-        
-        # Your code here...
-        pass
-    
-    def on_success(self):
-        """Handle successful call"""
-        # TODO: STUDENT MUST IMPLEMENT
-        # Update state based on success:
-        # - If CLOSED: reset failure count
-        # - If HALF_OPEN: increment success count
-        #   - If success_count >= success_threshold: transition to CLOSED
-        
-        # Your code here...
-        pass
-    
-    def on_failure(self):
-        """Handle failed call"""
-        # TODO: STUDENT MUST IMPLEMENT
-        # Update state based on failure:
-        # - If CLOSED: increment failure count
-        #   - If failure_count >= failure_threshold: transition to OPEN
-        # - If HALF_OPEN: transition to OPEN immediately
-        # - Record last_failure_time = time.time()
-        
-        # Your code here...
-        pass
-    
-    def get_state(self) -> str:
-        """Get current circuit breaker state"""
-        return self.state.value
+    def _send_batch_checked(self, instance: InstanceInfo, requests: List[Request],
+                            timeout: Optional[float] = None) -> List[Response]:
+        """Send a batch, raising BatchRpcError if no item came back OK"""
+        responses = self._send_single_batch(instance, requests, timeout)
+        if not any(response.status == StatusCode.OK for response in responses):
+            raise BatchRpcError(responses)
+        return responses
 
-# ===================== SMART CLIENT =====================
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """Thread pool for concurrent batch chunks, created on first use"""
+        with self.executor_lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.executor_workers,
+                                                   thread_name_prefix="client-batch")
+            return self.executor
 
-class RetryStrategy(Enum):
-    """Retry strategies"""
-    EXPONENTIAL = "exponential"
-    LINEAR = "linear"
-    FIXED = "fixed"
+    def poll_health(self) -> Dict[str, Optional[dict]]:
+        """Health-check every instance once and feed the results to the LB
 
-class SmartClient:
-    """Client with retry logic and circuit breakers - STUDENT MUST IMPLEMENT"""
-    
-    def __init__(self, load_balancer: LoadBalancer):
-        self.load_balancer = load_balancer
-        self.circuit_breakers: Dict[str, CircuitBreaker] = {}
-        
-        # Configuration
-        self.max_retries = 3
-        self.retry_strategy = RetryStrategy.EXPONENTIAL
-        self.base_delay = 100  # milliseconds
-        self.timeout = 5.0  # seconds
-        
-        # Metrics
-        self.request_log = []
-    
-    def send_request(self, request: Request) -> Response:
-        """Send request with retries and circuit breaking"""
-        # TODO: STUDENT MUST IMPLEMENT
-        # 1. Try up to max_retries times:
-        #    a. Select instance using load_balancer
-        #    b. Get/create circuit breaker for instance
-        #    c. Use circuit breaker to call _send_single_request
-        #    d. Update load_balancer stats with connections_delta=+1 before, -1 after
-        #    e. If successful, return response
-        #    f. If failed, calculate retry delay and wait
-        # 2. If all retries exhausted, raise exception
-        
-        attempt = 0
-        last_error = None
-        
-        # Your code here...
-        pass
+        Returns each instance's HEALTH_RESPONSE payload, or None for
+        instances that did not answer; those are marked unhealthy. For
+        continuous checks use start_health_prober().
+        """
+        results = {}
+        for instance in list(self.load_balancer.instances.values()):
+            start = time.time()
+            try:
+                health = self._check_health(instance)
+            except Exception:
+                health = None
+            results[instance.instance_id] = health
+            self.load_balancer.record_health_check(instance.instance_id, health,
+                                                   (time.time() - start) * 1000)
+        return results
+
+    def start_health_prober(self, interval: float = 2.0, **options) -> 'HealthProber':
+        """Probe every instance in the background; see HealthProber"""
+        if self.health_prober is None:
+            self.health_prober = HealthProber(self.load_balancer, interval, **options)
+            self.health_prober.start()
+        return self.health_prober
+
+    def _check_health(self, instance: InstanceInfo) -> dict:
+        """Send one HEALTH_CHECK to instance and return its payload"""
+        return self._exchange(
+            instance, MessageType.HEALTH_CHECK,
+            {'request_id': f"health_{time.time()}_{random.getrandbits(32):08x}"},
+            MessageType.HEALTH_RESPONSE, dict)
+
+    def _send_checked(self, instance: InstanceInfo, request: Request,
+                      timeout: Optional[float] = None) -> Response:
+        """Send a request, raising RpcError for any non-OK status"""
+        response = self._send_single_request(instance, request, timeout)
+        if response.status != StatusCode.OK:
+            raise RpcError(response)
+        return response
+
+    def _get_circuit_breaker(self, instance_id: str) -> CircuitBreaker:
+        """Get or create the circuit breaker guarding an instance"""
+        with self.breakers_lock:
+            breaker = self.circuit_breakers.get(instance_id)
+            if breaker is None:
+                breaker = CircuitBreaker(instance_id)
+                breaker.on_state_change = self._on_circuit_state_change
+                self.circuit_breakers[instance_id] = breaker
+            return breaker
+
+    def _on_circuit_state_change(self, instance_id: str, state: str):
+        """Mirror breaker transitions into the load balancer's view"""
+        self.load_balancer.set_circuit_state(instance_id, state)
+        instance = self.load_balancer.instances.get(instance_id)
+        if instance is not None and self.pool is not None:
+            if state == CircuitBreakerState.OPEN.value:
+                # Connections to a failing instance are not worth keeping
+                self.pool.evict(instance.host, instance.port)
+
+    def _refresh_circuit_states(self):
+        """Let OPEN breakers whose recovery timeout elapsed go HALF_OPEN"""
+        for breaker in list(self.circuit_breakers.values()):
+            if breaker.state == CircuitBreakerState.OPEN:
+                breaker.get_state()
     
-    def _send_single_request(self, instance: InstanceInfo, request: Request) -> Response:
+    def _send_single_request(self, instance: InstanceInfo, request: Request,
+                             timeout: Optional[float] = None) -> Response:
         """Send single request to instance"""
-        # TODO: STUDENT MUST IMPLEMENT
-        # 1. Create socket and set timeout (self.timeout)
-        # 2. Connect to instance (host, port)
-        # 3. Send request using Protocol.encode_message
-        # 4. Receive response using Protocol.decode_message
-        # 5. Parse response and return Response object
-        # 6. Handle socket errors appropriately
-        
+        return self._exchange(instance, MessageType.REQUEST, request.to_dict(),
+                              MessageType.RESPONSE, Response.from_dict, timeout)
+
+    def _send_single_batch(self, instance: InstanceInfo, requests: List[Request],
+                           timeout: Optional[float] = None) -> List[Response]:
+        """Send a batch to instance and return one response per request"""
+        def parse(data: dict) -> List[Response]:
+            responses = [Response.from_dict(item) for item in data['responses']]
+            if len(responses) != len(requests):
+                raise ValueError(f"expected {len(requests)} batch responses, "
+                                 f"got {len(responses)}")
+            return responses
+
+        batch = {
+            'request_id': f"batch_{requests[0].request_id}_{len(requests)}",
+            'requests': [request.to_dict() for request in requests],
+        }
+        return self._exchange(instance, MessageType.BATCH_REQUEST, batch,
+                              MessageType.BATCH_RESPONSE, parse, timeout)
+
+    def _exchange(self, instance: InstanceInfo, msg_type: MessageType, data: dict,
+                  reply_type: MessageType, parse, timeout: Optional[float] = None):
+        """Send one frame to instance and parse the matching reply
+
+        timeout bounds the whole exchange and defaults to self.timeout.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        deadline = time.time() + timeout
+        if self.persistent_connections:
+            conn = self.pool.checkout(instance.host, instance.port, timeout)
+            try:
+                got_type, reply = conn.call(msg_type, data, max(0.0, deadline - time.time()))
+            except Exception:
+                self.pool.checkin(conn, discard=True)
+                raise
+            return self._parse_reply(instance, conn, got_type, reply, reply_type, parse)
+
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(self.timeout)
+        sock.settimeout(timeout)
         
         try:
-            # Your code here...
-            pass
+            sock.connect((instance.host, instance.port))
+            sock.sendall(Protocol.encode_message(msg_type, data, self.codec))
+            got_type, reply = Protocol.decode_message(sock)
+            if got_type != reply_type:
+                raise ConnectionError(f"No response from {instance.instance_id}")
+            return parse(reply)
         finally:
             sock.close()
+
+    def _parse_reply(self, instance: InstanceInfo, conn: RpcConnection,
+                     got_type: MessageType, reply: dict, reply_type: MessageType, parse):
+        """Parse a reply that came over a pooled conn and return conn to the pool"""
+        try:
+            if got_type != reply_type:
+                raise ValueError(f"unexpected {got_type.name} reply")
+            result = parse(reply)
+        except (KeyError, ValueError, TypeError) as e:
+            # Undecodable reply: this connection can no longer be trusted
+            self.pool.checkin(conn, discard=True)
+            raise ConnectionError(f"Malformed response from "
+                                  f"{instance.instance_id}: {e}")
+        self.pool.checkin(conn)
+        return result
+
+    def _send_hedged(self, primary: InstanceInfo, request: Request,
+                     delay: float) -> Response:
+        """Send request to primary and, if it is slow, also to a second instance
+
+        Once primary has not answered within delay seconds, the request is
+        duplicated to another instance if the hedging budget allows. The
+        first OK answer is returned and the other call cancelled: nobody
+        waits for it any more, but its late reply still settles its stats
+        and returns its connection to the pool, and one still unanswered
+        a client timeout after it was sent fails as if it had timed out.
+        Neither call waits past the request's deadline.
+        """
+        data = request.to_dict()
+        event = threading.Event()  # Shared by both calls' reply slots
+        start = time.time()
+        give_up = min(start + self.timeout, request.deadline)
+        hedge_at = start + delay
+        pending = [self._start_leg(primary, data, event, give_up - start)]
+        hedged = expired = False
+        last_error = None
+
+        try:
+            while pending:
+                # Clear before looking so that a reply landing meanwhile wakes the wait
+                event.clear()
+                for leg in [leg for leg in pending if leg.slot.done]:
+                    pending.remove(leg)
+                    try:
+                        response = self._finish_leg(leg)
+                    except Exception as e:
+                        last_error = e
+                        continue
+                    if leg.instance is not primary:
+                        self.hedging.record_win()
+                    return response
+
+                now = time.time()
+                if not pending:
+                    break
+                if now >= give_up:
+                    expired = True
+                    break
+                if not hedged and now >= hedge_at:
+                    hedged = True
+                    hedge = self._start_hedge(primary, request, data, event, give_up - now)
+                    if hedge is not None:
+                        pending.append(hedge)
+                        continue
+                event.wait((give_up if hedged else min(hedge_at, give_up)) - now)
+        finally:
+            # Only a call the client timeout gave up on counts against its instance
+            timed_out = expired and give_up < request.deadline
+            for leg in pending:
+                if timed_out:
+                    self._abandon_leg(leg)
+                else:
+                    leg.conn.detach(leg.slot, lambda leg=leg: self._settle_leg(leg),
+                                    max(0.0, leg.start + self.timeout - time.time()))
+
+        if not expired:
+            raise last_error
+        if not timed_out:
+            raise RpcError(Response(request.request_id, StatusCode.DEADLINE_EXCEEDED, None,
+                                    "Deadline passed before any instance answered",
+                                    (time.time() - start) * 1000, ''))
+        raise socket.timeout(f"No response for {request.request_id} within {self.timeout}s")
+
+    def _start_hedge(self, primary: InstanceInfo, request: Request, data: dict,
+                     event: threading.Event, timeout: float) -> Optional[_HedgeLeg]:
+        """Send the duplicate of a slow request, if the budget and LB allow
+
+        The budget is checked first: a hedge it denies must not count as
+        a selection in the load balancer.
+        """
+        if not self.hedging.try_hedge():
+            return None
+        instance = self.load_balancer.select_instance(request,
+                                                      exclude=(primary.instance_id,))
+        if instance is None:
+            self.hedging.refund()
+            return None
+        try:
+            return self._start_leg(instance, data, event, timeout)
+        except Exception:
+            return None  # Hedging is best effort; the first call still stands
+
+    def _start_leg(self, instance: InstanceInfo, data: dict, event: threading.Event,
+                   timeout: float) -> _HedgeLeg:
+        """Send one copy of a hedged request through instance's breaker"""
+        breaker = self._get_circuit_breaker(instance.instance_id)
+        if not breaker.allow():
+            raise CircuitOpenError(f"Circuit open for {instance.instance_id}")
+        self.load_balancer.update_instance_stats(
+            instance.instance_id, 0, True, connections_delta=1)
+        start = time.time()
+        conn = None
+        try:
+            conn = self.pool.checkout(instance.host, instance.port, timeout)
+            slot = conn.submit(MessageType.REQUEST, data, event)
+        except Exception:
+            if conn is not None:
+                self.pool.checkin(conn, discard=True)
+            breaker.on_failure()
+            self._end_call(instance.instance_id, (time.time() - start) * 1000, False)
+            raise
+        return _HedgeLeg(instance, conn, slot, start)
+
+    def _finish_leg(self, leg: _HedgeLeg) -> Response:
+        """Read a hedged call's reply, raising RpcError for any non-OK status"""
+        leg.conn.cancel(leg.slot)
+        response = error = None
+        try:
+            got_type, reply = leg.conn.result(leg.slot)
+        except Exception as e:
+            self.pool.checkin(leg.conn, discard=True)
+            error = e
+        else:
+            try:
+                response = self._parse_reply(leg.instance, leg.conn, got_type, reply,
+                                             MessageType.RESPONSE, Response.from_dict)
+            except Exception as e:
+                error = e
+
+        ok = response is not None and response.status == StatusCode.OK
+        latency = (time.time() - leg.start) * 1000
+        breaker = self._get_circuit_breaker(leg.instance.instance_id)
+        if ok:
+            breaker.on_success(latency)
+            self.hedging.record(leg.instance.instance_id, latency)
+        else:
+            breaker.on_failure(latency)
+        self._end_call(leg.instance.instance_id, latency, ok, self._load_report(response))
+        if error is not None:
+            raise error
+        if not ok:
+            raise RpcError(response)
+        return response
+
+    def _settle_leg(self, leg: _HedgeLeg):
+        """Account for a hedged call nobody waits on once its reply is in
+
+        Until then it still counts as active on its instance, which keeps
+        working on it, so the load balancer does not mistake a slow
+        instance for an idle one.
+        """
+        try:
+            self._finish_leg(leg)
+        except Exception:
+            pass  # Its outcome is recorded; there is no caller to tell
+
+    def _abandon_leg(self, leg: _HedgeLeg):
+        """Give up on a hedged call that timed out"""
+        leg.conn.cancel(leg.slot)
+        self.pool.checkin(leg.conn, discard=True)
+        latency = (time.time() - leg.start) * 1000
+        self._get_circuit_breaker(leg.instance.instance_id).on_failure(latency)
+        self._end_call(leg.instance.instance_id, latency, False)
+
+    def get_stats(self) -> dict:
+        """Get client statistics, including the load balancer's"""
+        stats = {'load_balancer': self.load_balancer.get_stats(),
+                 'expired_requests': self.expired_requests,
+                 'retries': self.retry_budget.get_stats(),
+                 'circuit_breakers': {instance_id: breaker.get_stats() for instance_id, breaker
+                                      in list(self.circuit_breakers.items())},
+                 'latency_ms': {instance_id: histogram.summary(1000.0) for instance_id, histogram
+                                in list(self.latency_histograms.items())}}
+        if self.hedging is not None:
+            stats['hedging'] = self.hedging.get_stats()
+        if self.recorder is not None:
+            stats['trace'] = self.recorder.get_stats()
+        return stats
+
+    def _collect_metrics(self) -> List[Tuple[str, str, str, dict, float]]:
+        """Retry, deadline and breaker figures for the metrics endpoint"""
+        retries = self.retry_budget.get_stats()
+        samples = [
+            ('rpc_client_requests_total', 'counter',
+             'Requests sent, not counting retries', {}, retries['requests']),
+            ('rpc_client_retries_total', 'counter',
+             'Retries sent', {}, retries['retries']),
+            ('rpc_client_retries_denied_total', 'counter',
+             'Retries refused by the retry budget', {}, retries['denied']),
+            ('rpc_client_expired_requests_total', 'counter',
+             'Requests that ended with their deadline exceeded', {}, self.expired_requests),
+        ]
+        states = {state.value: code for code, state in enumerate(CircuitBreakerState)}
+        for instance_id, breaker in list(self.circuit_breakers.items()):
+            samples.append(('rpc_client_circuit_state', 'gauge',
+                            'Circuit breaker state: 0 closed, 1 open, 2 half-open',
+                            {'instance': instance_id}, states[breaker.state.value]))
+        return samples
+
+    def close(self):
+        """Close pooled connections, the batch thread pool, the prober, metrics and trace"""
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+            self.metrics_server = None
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+        if self.health_prober is not None:
+            self.health_prober.stop()
+            self.health_prober = None
+        with self.executor_lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False)
+                self.executor = None
+        if self.pool is not None:
+            self.pool.close()
     
-    def _calculate_retry_delay(self, attempt: int) -> float:
-        """Calculate retry delay in milliseconds"""
-        # TODO: STUDENT MUST IMPLEMENT
-        # Based on self.retry_strategy:
-        # - EXPONENTIAL: base_delay * (2 ** attempt)
-        # - LINEAR: base_delay * attempt
-        # - FIXED: base_delay
-        
-        # Your code here...
-        pass
+    def _attempt_timeout(self, deadline: float) -> float:
+        """Seconds one attempt may take: self.timeout, clamped to the deadline"""
+        return min(self.timeout, deadline - time.time())
+
+    @staticmethod
+    def _fits_deadline(delay_ms: float, deadline: float) -> bool:
+        """Whether a retry after delay_ms could still start before deadline"""
+        return time.time() + delay_ms / 1000.0 < deadline
+
+    def _spend_retry(self, delay_ms: float) -> bool:
+        """Pay for a retry from the retry budget and sleep out its backoff
+
+        Returns False, without sleeping, if the budget is spent.
+        """
+        if not self.retry_budget.withdraw():
+            return False
+        time.sleep(delay_ms / 1000.0)
+        return True
+
+    def _retryable(self, error: Exception) -> bool:
+        """Whether a failed attempt is safe and worth repeating
+
+        Transport failures are; of server answers only RETRYABLE_STATUSES.
+        A breaker's refusal never gets here: callers pick another instance.
+        """
+        if isinstance(error, RpcError):
+            return error.response.status in self.RETRYABLE_STATUSES
+        return True
+
+    @staticmethod
+    def _deadline_error(request_id: str) -> RpcError:
+        """The error for a request whose deadline passed on the client side"""
+        return RpcError(Response(request_id, StatusCode.DEADLINE_EXCEEDED, None,
+                                 "Deadline exceeded", 0.0, ''))
+
+    def _count_expired(self, count: int = 1):
+        with self.stats_lock:
+            self.expired_requests += count
+
+    def _calculate_retry_delay(self, attempt: int, previous_ms: float = 0.0) -> float:
+        """Calculate retry delay in milliseconds
+
+        The jittered strategies spread clients that failed together over
+        the backoff window so they do not retry in lockstep; decorrelated
+        jitter grows from the previous delay (previous_ms) rather than the
+        attempt number.
+        """
+        if self.retry_strategy == RetryStrategy.FULL_JITTER:
+            return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        elif self.retry_strategy == RetryStrategy.DECORRELATED_JITTER:
+            return min(self.max_delay,
+                       random.uniform(self.base_delay, max(self.base_delay, previous_ms) * 3))
+        elif self.retry_strategy == RetryStrategy.EXPONENTIAL:
+            return self.base_delay * (2 ** attempt)
+        elif self.retry_strategy == RetryStrategy.LINEAR:
+            return self.base_delay * attempt
+        return self.base_delay
+
+class AsyncSmartClient(SmartClient):
+    """asyncio variant of SmartClient with request pipelining
+
+    send_request is a coroutine. Every instance is reached over at most
+    connections_per_host AsyncRpcConnections, each carrying any number of
+    requests at once, so one thread and one event loop can keep every
+    instance busy. A new connection is only opened while all existing
+    ones to the instance have requests in flight.
+
+    Load balancing, circuit breakers, deadlines, the retry budget and
+    backoff, and the client cache are shared with SmartClient. The
+    client belongs to the event loop it is first used on; send_batch
+    and send_stream remain SmartClient's blocking versions, over one-shot
+    connections since the client keeps no ConnectionPool.
+    """
+
+    def __init__(self, load_balancer: LoadBalancer, codec: Codec = Codec.JSON,
+                 connections_per_host: int = 8, cache_ttl: Optional[float] = None,
+                 cache_entries: int = 1024, retry_ratio: float = 0.1,
+                 metrics_port: Optional[int] = None, trace_path: Optional[str] = None,
+                 trace_values: bool = True):
+        # send_request keeps its own connections, so no ConnectionPool
+        super().__init__(load_balancer, persistent_connections=False, codec=codec,
+                         cache_ttl=cache_ttl, cache_entries=cache_entries,
+                         retry_ratio=retry_ratio, metrics_port=metrics_port,
+                         trace_path=trace_path, trace_values=trace_values)
+        self.connections_per_host = connections_per_host
+        self.connections: Dict[Tuple[str, int], List[AsyncRpcConnection]] = defaultdict(list)
+        self.opening: Dict[Tuple[str, int], asyncio.Future] = {}
+
+    async def send_request(self, request: Request) -> Response:
+        """Send request with retries and circuit breaking"""
+        started = time.time()
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(request.operation, request.values)
+            cached = self.cache.get(key) if key is not None else None
+            if cached is not None:
+                response = replace(cached, request_id=request.request_id)
+                self._trace(request, started, response)
+                return response
+
+        attempt = 0
+        last_error = None
+        delay_ms = 0.0
+        skipped = ()  # Instances whose breaker refused this attempt
+        self.retry_budget.deposit()
+
+        while attempt < self.max_retries:
+            timeout = self._attempt_timeout(request.deadline)
+            if timeout <= 0:
+                last_error = self._deadline_error(request.request_id)
+                break
+            self._refresh_circuit_states()
+            instance = self.load_balancer.select_instance(request, exclude=skipped)
+
+            if instance is None:
+                last_error = Exception("No healthy instances available")
+            else:
+                try:
+                    response = await self._call_instance_async(instance, request, timeout)
+                    if key is not None:
+                        self.cache.put(key, response)
+                    self.retry_histogram.record(attempt)
+                    self._trace(request, started, response)
+                    return response
+                except CircuitOpenError:
+                    skipped += (instance.instance_id,)
+                    continue
+                except Exception as e:
+                    last_error = e
+                    if not isinstance(e, RpcError) and time.time() >= request.deadline:
+                        # The attempt timed out because the deadline did
+                        last_error = self._deadline_error(request.request_id)
+
+            attempt += 1
+            skipped = ()
+            delay_ms, last_error = self._plan_retry(request, attempt, last_error, delay_ms)
+            if delay_ms is None:
+                break
+            await asyncio.sleep(delay_ms / 1000.0)
+
+        return self._give_up(request, started, attempt, last_error)
+
+    async def _call_instance_async(self, instance: InstanceInfo, request: Request,
+                                   timeout: float) -> Response:
+        """Send request to instance through its circuit breaker, recording LB stats"""
+        breaker = self._get_circuit_breaker(instance.instance_id)
+        if not breaker.allow():
+            raise CircuitOpenError(f"Circuit open for {instance.instance_id}")
+        self.load_balancer.update_instance_stats(
+            instance.instance_id, 0, True, connections_delta=1)
+        start = time.time()
+        response = None
+        cancelled = False
+        try:
+            conn = await self._connection(instance, timeout)
+            msg_type, reply = await conn.call(MessageType.REQUEST, request.to_dict(),
+                                              max(0.0, start + timeout - time.time()))
+            try:
+                if msg_type != MessageType.RESPONSE:
+                    raise ValueError(f"unexpected {msg_type.name} reply")
+                response = Response.from_dict(reply)
+            except (KeyError, ValueError, TypeError) as e:
+                # Undecodable reply: this connection can no longer be trusted
+                conn.close()
+                raise ConnectionError(f"Malformed response from "
+                                      f"{instance.instance_id}: {e}")
+        except asyncio.CancelledError:
+            cancelled = True  # The caller gave up; that says nothing about the instance
+            raise
+        finally:
+            ok = response is not None and response.status == StatusCode.OK
+            latency = (time.time() - start) * 1000
+            if ok:
+                breaker.on_success(latency)
+            elif cancelled:
+                breaker.release()
+            else:
+                breaker.on_failure(latency)
+            self._end_call(instance.instance_id, latency, ok, self._load_report(response))
+        if not ok:
+            raise RpcError(response)
+        return response
+
+    async def _connection(self, instance: InstanceInfo, timeout: float) -> AsyncRpcConnection:
+        """The least busy connection to instance, opening another if all are busy"""
+        key = (instance.host, instance.port)
+        conns = self.connections[key]
+        if any(conn.closed for conn in conns):
+            conns[:] = [conn for conn in conns if not conn.closed]
+        best = min(conns, key=lambda conn: len(conn.pending)) if conns else None
+        if best is not None and (not best.pending or len(conns) >= self.connections_per_host):
+            return best
+
+        opening = self.opening.get(key)
+        if opening is None:
+            opening = asyncio.ensure_future(
+                AsyncRpcConnection.open(instance.host, instance.port, self.timeout, self.codec))
+            self.opening[key] = opening
+            opening.add_done_callback(lambda future: self._opened(key, future))
+        elif best is not None:
+            return best  # Another request is already opening one; share for now
+        return await asyncio.wait_for(asyncio.shield(opening), timeout)
+
+    def _opened(self, key: Tuple[str, int], future: asyncio.Future):
+        del self.opening[key]
+        if not future.cancelled() and future.exception() is None:
+            self.connections[key].append(future.result())
+
+    def close(self):
+        """Close every connection, plus whatever SmartClient.close() does"""
+        for conns in self.connections.values():
+            for conn in conns:
+                conn.close()
+        self.connections.clear()
+        super().close()
 
 # ===================== TESTING FRAMEWORK =====================
 
@@ -684,25 +4948,682 @@ class Tester:
         if len(instances) > 0:
             instances[0].error_rate = 0.0
 
+# ===================== BENCHMARKS =====================
+
+class Benchmark:
+    """Micro-benchmarks for hot paths"""
+
+    @staticmethod
+    def _time_op(func, min_duration: float = 0.5) -> float:
+        """Return seconds per call, repeating func for at least min_duration"""
+        func()  # Warm up
+        calls = 0
+        start = time.perf_counter()
+        while True:
+            func()
+            calls += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_duration:
+                return elapsed / calls
+
+    def codec_throughput(self, sizes: Tuple[int, ...] = (10, 1000, 1000000)) -> List[dict]:
+        """Compare JSON and binary encode/decode of REQUEST frames"""
+        print("\n=== Codec Benchmark (REQUEST frames) ===")
+        print(f"{'values':>9} {'codec':>7} {'bytes':>11} "
+              f"{'encode/s':>11} {'decode/s':>11} {'enc MB/s':>9} {'dec MB/s':>9}")
+
+        results = []
+        for size in sizes:
+            request = Request(
+                request_id=f"bench_{size}",
+                method="Calculate",
+                operation="sum",
+                values=[random.uniform(-1e6, 1e6) for _ in range(size)],
+                deadline=time.time() + 60,
+                metadata={'client': 'bench'}
+            )
+            data = request.to_dict()
+
+            for codec in Codec:
+                frame = Protocol.encode_message(MessageType.REQUEST, data, codec)
+                payload = memoryview(frame)[Protocol.HEADER.size:]
+                type_byte = frame[4]
+
+                encode_s = self._time_op(
+                    lambda: Protocol.encode_message(MessageType.REQUEST, data, codec))
+                decode_s = self._time_op(
+                    lambda: Protocol.decode_payload(type_byte, payload))
+
+                row = {
+                    'values': size,
+                    'codec': codec.value,
+                    'bytes': len(frame),
+                    'encode_per_sec': 1 / encode_s,
+                    'decode_per_sec': 1 / decode_s,
+                    'encode_mb_per_sec': len(frame) / encode_s / 1e6,
+                    'decode_mb_per_sec': len(frame) / decode_s / 1e6,
+                }
+                results.append(row)
+                print(f"{size:>9} {codec.value:>7} {len(frame):>11} "
+                      f"{row['encode_per_sec']:>11.1f} {row['decode_per_sec']:>11.1f} "
+                      f"{row['encode_mb_per_sec']:>9.1f} {row['decode_mb_per_sec']:>9.1f}")
+        return results
+
+    def calculation(self, sizes: Tuple[int, ...] = (10, 100, 1000, 10000, 100000, 1000000)
+                    ) -> List[dict]:
+        """Time each operation on both engine paths for list and buffer input"""
+        print("\n=== Calculation Benchmark (microseconds per call) ===")
+        paths = [('python', CalculationEngine(use_numpy=False))]
+        if np is not None:
+            paths.append(('numpy', CalculationEngine(buffer_threshold=0, list_threshold=0)))
+        else:
+            print("NumPy not installed: timing the pure-Python path only")
+
+        columns = [f"{name}/{kind}" for name, _ in paths for kind in ('list', 'buffer')]
+        print(f"{'op':>9} {'values':>9} " + " ".join(f"{c:>14}" for c in columns))
+
+        results = []
+        for size in sizes:
+            as_list = [random.uniform(0.5, 1.5) for _ in range(size)]
+            as_buffer = memoryview(array('d', as_list))
+            for operation in CalculationEngine.OPERATIONS:
+                row = {'operation': operation, 'values': size}
+                for name, engine in paths:
+                    for kind, values in (('list', as_list), ('buffer', as_buffer)):
+                        seconds = self._time_op(
+                            lambda: engine.calculate(operation, values), 0.2)
+                        row[f"{name}/{kind}"] = seconds * 1e6
+                results.append(row)
+                print(f"{operation:>9} {size:>9} " +
+                      " ".join(f"{row[c]:>14.2f}" for c in columns))
+        return results
+
+    @staticmethod
+    def _percentile(ordered: List[float], fraction: float) -> float:
+        """Nearest-rank percentile of an already sorted list"""
+        if not ordered:
+            return 0.0
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def strategies(self, latencies_ms: Tuple[float, ...] = (40, 5, 0), requests: int = 1200,
+                   threads: int = 8, base_port: int = 9600,
+                   hedge_percentile: Optional[float] = None) -> List[dict]:
+        """Client latency per strategy against local instances of uneven speed"""
+        hedging = f", hedging at p{hedge_percentile:g}" if hedge_percentile else ""
+        print(f"\n=== Strategy Benchmark (inject_latency {list(latencies_ms)} ms, "
+              f"{threads} threads{hedging}) ===")
+        instances = []
+        for i, latency in enumerate(latencies_ms):
+            instance = ServiceInstance(f"bench_{i}", base_port + i)
+            instance.inject_latency = latency
+            threading.Thread(target=instance.start, daemon=True).start()
+            instances.append(instance)
+        time.sleep(0.5)
+
+        print(f"{'strategy':>18} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9}  share per instance")
+        results = []
+        try:
+            for strategy in LoadBalancingStrategy:
+                lb = LoadBalancer(strategy)
+                for i in range(len(latencies_ms)):
+                    lb.add_instance(InstanceInfo(f"bench_{i}", 'localhost', base_port + i))
+                client = SmartClient(lb, hedge_percentile=hedge_percentile)
+                samples = []
+
+                def run(count: int):
+                    for n in range(count):
+                        request = Request(f"bench_{threading.get_ident()}_{n}", "Calculate",
+                                          "sum", [1.0, 2.0, 3.0], time.time() + 30, {})
+                        start = time.perf_counter()
+                        client.send_request(request)
+                        samples.append((time.perf_counter() - start) * 1000)
+
+                workers = [threading.Thread(target=run, args=(requests // threads,))
+                           for _ in range(threads)]
+                start = time.perf_counter()
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+                elapsed = time.perf_counter() - start
+                client.close()
+
+                samples.sort()
+                shares = [lb.distribution[f"bench_{i}"] / max(1, lb.request_count)
+                          for i in range(len(latencies_ms))]
+                row = {
+                    'strategy': strategy.value,
+                    'requests_per_sec': len(samples) / elapsed,
+                    'p50_ms': self._percentile(samples, 0.50),
+                    'p99_ms': self._percentile(samples, 0.99),
+                    'shares': shares,
+                }
+                if client.hedging is not None:
+                    row['hedging'] = client.hedging.get_stats()
+                results.append(row)
+                print(f"{strategy.value:>18} {row['requests_per_sec']:>9.1f} "
+                      f"{row['p50_ms']:>9.2f} {row['p99_ms']:>9.2f}  " +
+                      " ".join(f"{share:.0%}" for share in shares) +
+                      (f"  hedged {row['hedging']['hedge_rate']:.1%}, "
+                       f"won {row['hedging']['win_rate']:.0%}" if 'hedging' in row else ""))
+        finally:
+            for instance in instances:
+                instance.shutdown()
+        return results
+
+    def clients(self, requests: int = 6000, threads: int = 50,
+                concurrency: Tuple[int, ...] = (50, 200), base_port: int = 9620) -> List[dict]:
+        """Requests/sec of SmartClient on threads vs AsyncSmartClient on one loop
+
+        Three asyncio instances run in their own processes so that the
+        client has its interpreter to itself; client CPU per request
+        shows what each client costs whatever the machine's core count.
+        """
+        print(f"\n=== Client Benchmark ({requests} requests, 3 asyncio instances) ===")
+        context = multiprocessing.get_context('fork')
+        servers = [context.Process(target=AsyncServiceInstance(f"bench_{i}", base_port + i).start,
+                                   daemon=True) for i in range(3)]
+        for server in servers:
+            server.start()
+        time.sleep(0.5)
+
+        def make_lb() -> LoadBalancer:
+            lb = LoadBalancer(LoadBalancingStrategy.ROUND_ROBIN)
+            for i in range(len(servers)):
+                lb.add_instance(InstanceInfo(f"bench_{i}", 'localhost', base_port + i))
+            return lb
+
+        def make_request(tag: str) -> Request:
+            return Request(f"bench_{tag}", "Calculate", "sum", [1.0, 2.0, 3.0],
+                           time.time() + 30, {})
+
+        print(f"{'client':>22} {'req/s':>9} {'cpu us/req':>11} {'p50 ms':>9} {'p99 ms':>9}")
+        results = []
+
+        def report(name: str, samples: List[float], elapsed: float, cpu: float):
+            samples.sort()
+            row = {'client': name, 'requests_per_sec': len(samples) / elapsed,
+                   'cpu_us_per_request': cpu / len(samples) * 1e6,
+                   'p50_ms': self._percentile(samples, 0.50),
+                   'p99_ms': self._percentile(samples, 0.99)}
+            results.append(row)
+            print(f"{name:>22} {row['requests_per_sec']:>9.0f} "
+                  f"{row['cpu_us_per_request']:>11.1f} {row['p50_ms']:>9.2f} {row['p99_ms']:>9.2f}")
+
+        try:
+            # One pooled connection per thread, so no thread waits on the pool
+            client = SmartClient(make_lb(), codec=Codec.BINARY,
+                                 max_connections_per_host=threads)
+            samples = []
+
+            def run(worker: int):
+                for n in range(requests // threads):
+                    start = time.perf_counter()
+                    client.send_request(make_request(f"{worker}_{n}"))
+                    samples.append((time.perf_counter() - start) * 1000)
+
+            workers = [threading.Thread(target=run, args=(i,)) for i in range(threads)]
+            cpu, start = time.process_time(), time.perf_counter()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            report(f"SmartClient x{threads}", samples, time.perf_counter() - start,
+                   time.process_time() - cpu)
+            client.close()
+
+            async def run_async(tasks: int):
+                client = AsyncSmartClient(make_lb(), codec=Codec.BINARY, connections_per_host=1)
+                samples = []
+
+                async def run(worker: int):
+                    for n in range(requests // tasks):
+                        start = time.perf_counter()
+                        await client.send_request(make_request(f"{worker}_{n}"))
+                        samples.append((time.perf_counter() - start) * 1000)
+
+                cpu, start = time.process_time(), time.perf_counter()
+                await asyncio.gather(*(run(i) for i in range(tasks)))
+                report(f"AsyncSmartClient x{tasks}", samples, time.perf_counter() - start,
+                       time.process_time() - cpu)
+                client.close()
+
+            for tasks in concurrency:
+                asyncio.run(run_async(tasks))
+        finally:
+            for server in servers:
+                server.terminate()
+        return results
+
+    @staticmethod
+    def _parse_mix(spec: str, parse=str) -> Tuple[list, List[float]]:
+        """Choices and cumulative weights from 'a=3,b=1' ('a' alone weighs 1)"""
+        choices, cum_weights, total = [], [], 0.0
+        for part in spec.split(','):
+            name, _, weight = part.partition('=')
+            total += float(weight) if weight else 1.0
+            choices.append(parse(name.strip()))
+            cum_weights.append(total)
+        return choices, cum_weights
+
+    def open_loop(self, rate: float = 500.0, duration: float = 10.0,
+                  mix: str = "sum=4,avg=2,min=1,max=1,multiply=1", sizes: str = "10=8,1000=2",
+                  strategy: LoadBalancingStrategy = LoadBalancingStrategy.LEAST_CONNECTIONS,
+                  inject_latency: Tuple[float, ...] = (0, 0, 0),
+                  error_rate: Tuple[float, ...] = (0, 0, 0), use_async: bool = False,
+                  codec: Codec = Codec.BINARY, deadline_ms: float = 5000.0,
+                  base_port: int = 9640, seed: Optional[int] = None,
+                  trace_path: Optional[str] = None,
+                  metrics_port: Optional[int] = None) -> dict:
+        """Open-loop load test: Poisson arrivals at rate req/s for duration seconds
+
+        Requests are sent when the arrival process says, whether or not
+        earlier ones have come back, so a slow server faces a growing
+        queue just as it would in production. Latency is measured from
+        each request's scheduled send time, which charges any delay in
+        sending it (a busy client or event loop) to the request instead
+        of silently dropping it: the coordinated-omission correction.
+        service_time_ms is the uncorrected figure, from the actual send.
+
+        One instance is started per inject_latency entry, each in its own
+        process with that latency (ms) and the matching error_rate. mix
+        and sizes weight operations and values lengths as 'name=weight'
+        lists. seed fixes the arrival times and the requests sent; the
+        connection warm-up draws from its own generator so it does not
+        shift them. Failed requests are timed from their scheduled send
+        too, into failed_latency_ms rather than latency_ms, so requests
+        that time out are not simply missing from the figures. With
+        trace_path the client records every request there, for replay();
+        with metrics_port it serves its latency histograms there for the
+        length of the run. Returns the report as a JSON-serialisable dict.
+        """
+        rng, warmup_rng = random.Random(seed), random.Random()
+        operations, operation_weights = self._parse_mix(mix)
+        lengths, length_weights = self._parse_mix(sizes, int)
+        # One values list per length, so generating load costs little
+        values = {n: [rng.uniform(0.9, 1.1) for _ in range(n)] for n in lengths}
+
+        servers, lb = self._start_instances(strategy, inject_latency, error_rate,
+                                            use_async, base_port)
+        corrected, service, failed = Histogram(), Histogram(), Histogram()
+        errors: Dict[str, int] = defaultdict(int)
+
+        def make_request(n: int, scheduled: float, draw: random.Random = rng) -> Request:
+            return Request(f"bench_{n}", "Calculate",
+                           draw.choices(operations, cum_weights=operation_weights)[0],
+                           values[draw.choices(lengths, cum_weights=length_weights)[0]],
+                           scheduled + deadline_ms / 1000.0, {})
+
+        async def send(client: AsyncSmartClient, request: Request, scheduled: float):
+            sent = time.time()
+            try:
+                response = await client.send_request(request)
+                error = response.status.name if response.status != StatusCode.OK else None
+            except Exception:
+                error = 'TRANSPORT'
+            done = time.time()
+            if error is not None:
+                errors[error] += 1
+                failed.record(done - scheduled)
+                return
+            corrected.record(done - scheduled)
+            service.record(done - sent)
+
+        async def drive() -> Tuple[float, int, dict]:
+            client = AsyncSmartClient(lb, codec=codec, connections_per_host=1,
+                                      trace_path=trace_path, metrics_port=metrics_port)
+            # Open connections before the clock starts
+            await asyncio.gather(*(client.send_request(make_request(-i, time.time(), warmup_rng))
+                                   for i in range(1, 2 * len(servers) + 1)),
+                                 return_exceptions=True)
+            retries_before = client.retry_budget.get_stats()
+
+            tasks = set()
+            sent = 0
+            start = time.time()
+            scheduled = start + rng.expovariate(rate)
+            while scheduled < start + duration:
+                delay = scheduled - time.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                # Drawn here, in arrival order, so seed fixes every request
+                task = asyncio.create_task(send(client, make_request(sent, scheduled), scheduled))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                sent += 1
+                scheduled += rng.expovariate(rate)
+            if tasks:
+                await asyncio.wait(tasks)
+            elapsed = time.time() - start
+
+            retries = client.retry_budget.get_stats()
+            stats = client.get_stats()
+            stats['retries'] = {name: retries[name] - retries_before[name]
+                                for name in ('retries', 'denied')}
+            client.close()
+            return elapsed, sent, stats
+
+        try:
+            elapsed, sent, stats = asyncio.run(drive())
+        finally:
+            for server in servers:
+                server.terminate()
+
+        return {
+            'config': {
+                'rate': rate, 'duration_s': duration, 'mix': mix, 'sizes': sizes,
+                'strategy': strategy.value, 'server': 'async' if use_async else 'threaded',
+                'codec': codec.name.lower(), 'inject_latency_ms': list(inject_latency),
+                'error_rate': list(error_rate), 'deadline_ms': deadline_ms, 'seed': seed,
+            },
+            'requests': sent,
+            'completed': corrected.count,
+            'elapsed_s': elapsed,
+            'offered_rps': sent / elapsed,
+            'throughput_rps': corrected.count / elapsed,
+            'latency_ms': self._latency_report(corrected),
+            'service_time_ms': self._latency_report(service),
+            'failed_latency_ms': self._latency_report(failed),
+            **self._outcome_report(errors, stats),
+        }
+
+    @staticmethod
+    def _start_instances(strategy: LoadBalancingStrategy, inject_latency: Tuple[float, ...],
+                         error_rate: Tuple[float, ...], use_async: bool,
+                         base_port: int) -> Tuple[list, LoadBalancer]:
+        """One quiet instance process per inject_latency entry, and a balancer over them"""
+        context = multiprocessing.get_context('fork')
+        servers = []
+        for i, latency in enumerate(inject_latency):
+            instance = (AsyncServiceInstance if use_async else ServiceInstance)(
+                f"bench_{i}", base_port + i)
+            instance.inject_latency = latency
+            instance.error_rate = error_rate[i] if i < len(error_rate) else 0.0
+
+            def serve(instance=instance):
+                sys.stdout = open(os.devnull, 'w')  # Keep the JSON report clean
+                instance.start()
+
+            servers.append(context.Process(target=serve, daemon=True))
+        for server in servers:
+            server.start()
+        time.sleep(0.5)
+
+        lb = LoadBalancer(strategy)
+        for i in range(len(servers)):
+            lb.add_instance(InstanceInfo(f"bench_{i}", 'localhost', base_port + i))
+        return servers, lb
+
+    @staticmethod
+    def _latency_report(histogram: Histogram) -> dict:
+        """Percentiles in ms for a JSON report"""
+        return {
+            'p50': histogram.percentile(50) * 1000,
+            'p90': histogram.percentile(90) * 1000,
+            'p99': histogram.percentile(99) * 1000,
+            'p999': histogram.percentile(99.9) * 1000,
+            'max': histogram.percentile(100) * 1000,
+            'mean': histogram.sum / histogram.count * 1000 if histogram.count else 0.0,
+        }
+
+    @staticmethod
+    def _outcome_report(errors: Dict[str, int], stats: dict) -> dict:
+        """Error, retry and per-instance figures for a JSON report"""
+        distribution = stats['load_balancer']['instances']
+        return {
+            'errors': sum(errors.values()),
+            'errors_by_kind': dict(errors),
+            'retries': stats['retries']['retries'],
+            'retries_denied': stats['retries']['denied'],
+            'expired_requests': stats['expired_requests'],
+            'instances': {
+                instance_id: {'requests': distribution[instance_id]['requests'],
+                              'p99_ms': stats['latency_ms'].get(instance_id, {}).get('p99', 0.0),
+                              'circuit': stats['circuit_breakers'].get(instance_id, {}).get(
+                                  'state', 'closed')}
+                for instance_id in sorted(distribution)
+            },
+        }
+
+    def replay(self, trace_path: str, speed: float = 1.0, concurrency: int = 64,
+               strategy: LoadBalancingStrategy = LoadBalancingStrategy.LEAST_CONNECTIONS,
+               inject_latency: Tuple[float, ...] = (0, 0, 0),
+               error_rate: Tuple[float, ...] = (0, 0, 0), use_async: bool = False,
+               codec: Codec = Codec.BINARY, base_port: int = 9660,
+               metrics_port: Optional[int] = None) -> dict:
+        """Send a recorded trace (see TraceRecorder) to local instances again
+
+        Entries keep their original spacing divided by speed; with speed 0
+        they go out as fast as concurrency requests in flight allow. The
+        trace is read lazily and put back in start order through a short
+        window (see TraceRecorder.read_in_order), so it may be far larger
+        than memory. Entries recorded without values
+        get that many ones instead. Instances are started and metrics_port
+        served as in open_loop; the report has the same shape, with
+        latency, failed requests' included, measured from each entry's
+        scheduled time.
+        """
+        servers, lb = self._start_instances(strategy, inject_latency, error_rate,
+                                            use_async, base_port)
+        corrected, service, failed = Histogram(), Histogram(), Histogram()
+        errors: Dict[str, int] = defaultdict(int)
+
+        async def send(client: AsyncSmartClient, entry: dict, scheduled: float,
+                       slots: Optional[asyncio.Semaphore]):
+            sent = time.time()
+            values = entry.get('values')
+            request = Request(entry['request_id'], entry.get('method', "Calculate"),
+                              entry['operation'],
+                              values if values is not None else [1.0] * entry['size'],
+                              sent + entry.get('deadline_ms', 5000.0) / 1000.0,
+                              entry.get('metadata') or {})
+            try:
+                response = await client.send_request(request)
+                error = response.status.name if response.status != StatusCode.OK else None
+            except Exception:
+                error = 'TRANSPORT'
+            finally:
+                if slots is not None:
+                    slots.release()
+            done = time.time()
+            if error is not None:
+                errors[error] += 1
+                failed.record(done - scheduled)
+                return
+            corrected.record(done - scheduled)
+            service.record(done - sent)
+
+        async def drive() -> Tuple[float, int, dict]:
+            client = AsyncSmartClient(lb, codec=codec, connections_per_host=1,
+                                      metrics_port=metrics_port)
+            # Timed replay is open loop; only max speed bounds what is in flight
+            slots = asyncio.Semaphore(concurrency) if speed <= 0 else None
+            tasks = set()
+            sent = 0
+            start = first = None
+            for entry in TraceRecorder.read_in_order(trace_path):
+                if start is None:
+                    start, first = time.time(), entry['ts']
+                if slots is None:
+                    scheduled = start + (entry['ts'] - first) / speed
+                    delay = scheduled - time.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                else:
+                    await slots.acquire()
+                    scheduled = time.time()
+                task = asyncio.create_task(send(client, entry, scheduled, slots))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                sent += 1
+            if tasks:
+                await asyncio.wait(tasks)
+            elapsed = time.time() - start if start is not None else 0.0
+
+            retries = client.retry_budget.get_stats()
+            stats = client.get_stats()
+            stats['retries'] = {'retries': retries['retries'], 'denied': retries['denied']}
+            client.close()
+            return elapsed, sent, stats
+
+        try:
+            elapsed, sent, stats = asyncio.run(drive())
+        finally:
+            for server in servers:
+                server.terminate()
+
+        return {
+            'config': {
+                'trace': trace_path, 'speed': speed if speed > 0 else 'max',
+                'strategy': strategy.value, 'server': 'async' if use_async else 'threaded',
+                'codec': codec.name.lower(), 'inject_latency_ms': list(inject_latency),
+                'error_rate': list(error_rate),
+            },
+            'requests': sent,
+            'completed': corrected.count,
+            'elapsed_s': elapsed,
+            'throughput_rps': corrected.count / elapsed if elapsed else 0.0,
+            'latency_ms': self._latency_report(corrected),
+            'service_time_ms': self._latency_report(service),
+            'failed_latency_ms': self._latency_report(failed),
+            **self._outcome_report(errors, stats),
+        }
+
+    def selection(self, sizes: Tuple[int, ...] = (3, 100, 10000), threads: int = 64,
+                  duration: float = 1.0) -> List[dict]:
+        """Selections per second for each strategy under concurrent selectors
+
+        Each selector thread picks an instance and brackets it with the
+        connection updates SmartClient makes around a request.
+        """
+        print(f"\n=== Selection Benchmark ({threads} threads, selections/sec) ===")
+        strategies = list(LoadBalancingStrategy)
+        print(f"{'instances':>9} " + " ".join(f"{s.value:>17}" for s in strategies))
+
+        results = []
+        for size in sizes:
+            row = {'instances': size}
+            for strategy in strategies:
+                lb = LoadBalancer(strategy)
+                for i in range(size):
+                    lb.add_instance(InstanceInfo(f"sel_{i}", 'localhost', 10000 + i))
+                requests = [Request(f"sel_{n}", "Calculate", "sum", [float(n)], 0.0, {})
+                            for n in range(64)]
+                lb.select_instance(requests[0])  # Builds the hash ring
+                ready = threading.Barrier(threads + 1)
+                stop = threading.Event()
+                counts = []
+
+                def select_loop():
+                    ready.wait()
+                    count = 0
+                    while not stop.is_set():
+                        instance = lb.select_instance(requests[count % 64])
+                        lb.update_instance_stats(instance.instance_id, 0, True,
+                                                 connections_delta=1)
+                        lb.update_instance_stats(instance.instance_id, 0.1, True,
+                                                 connections_delta=-1)
+                        count += 1
+                    counts.append(count)
+
+                workers = [threading.Thread(target=select_loop) for _ in range(threads)]
+                for worker in workers:
+                    worker.start()
+                ready.wait()
+                start = time.perf_counter()
+                time.sleep(duration)
+                stop.set()
+                for worker in workers:
+                    worker.join()
+                row[strategy.value] = sum(counts) / (time.perf_counter() - start)
+            results.append(row)
+            print(f"{size:>9} " + " ".join(f"{row[s.value]:>17.0f}" for s in strategies))
+        return results
+
 # ===================== MAIN EXECUTION =====================
 
+def parse_options(args: List[str],
+                  flags: Tuple[str, ...] = ()) -> Tuple[List[str], Dict[str, str]]:
+    """Split CLI args into positionals and --name value / --name=value options
+
+    Names listed in flags take no value and are recorded as 'true'.
+    """
+    positional, options = [], {}
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg.startswith('--'):
+            name, eq, value = arg[2:].partition('=')
+            if not eq:
+                if name in flags:
+                    value = 'true'
+                elif i + 1 < len(args):
+                    i += 1
+                    value = args[i]
+                else:
+                    raise SystemExit(f"Option --{name} needs a value")
+            options[name] = value
+        else:
+            positional.append(arg)
+        i += 1
+    return positional, options
+
 def main():
     """Main execution function"""
     import sys
     
     if len(sys.argv) < 2:
-        print("Usage: python3 rpc_assignment.py [server|demo|test]")
+        print("Usage: python3 rpc_assignment.py <mode> [options]")
+        print("  modes: server, demo, test, bench, replay, bench-codec, bench-calc,")
+        print("         bench-lb, bench-client")
         print("  server <port> - Start a service instance")
+        print("                  [--async] [--backlog N]")
+        print("                  [--threads N] [--queue N]  (threaded server only)")
+        print("                  [--workers N]  (N supervised processes sharing the port)")
+        print("                  [--cache N]    (cache up to N results)")
+        print("                  [--metrics-port N]  (Prometheus metrics over HTTP)")
         print("  demo          - Run basic demonstration")
         print("  test          - Run comprehensive test suite")
+        print("  bench         - Open-loop load test against local instances, JSON report")
+        print("                  [--rate R] [--duration S] [--strategy NAME] [--async]")
+        print("                  [--mix sum=4,avg=1] [--sizes 10=9,10000=1]")
+        print("                  [--latency 0,0,20] [--error-rate 0,0,0.1]  (per instance)")
+        print("                  [--codec json|binary] [--deadline-ms MS] [--seed N]")
+        print("                  [--output FILE] [--record TRACE]  (trace every request)")
+        print("                  [--metrics-port N]  (client metrics over HTTP during the run)")
+        print("  replay <trace> - Send a recorded trace to local instances, JSON report")
+        print("                  [--speed X | --max-speed [--concurrency N]]")
+        print("                  plus bench's --strategy, --async, --latency, --error-rate,")
+        print("                  --codec, --output and --metrics-port")
+        print("  bench-codec   - Compare JSON and binary wire codecs")
+        print("  bench-calc    - Time each operation on the Python and NumPy paths")
+        print("  bench-lb      - Compare strategies against instances of uneven speed,")
+        print("                  without and with hedging")
+        print("  bench-client  - Compare the threaded and asyncio clients")
         sys.exit(1)
     
     mode = sys.argv[1]
     
     if mode == "server":
         # Start a single service instance
-        port = int(sys.argv[2]) if len(sys.argv) > 2 else 9000
-        instance = ServiceInstance(f"instance_{port}", port)
+        args, options = parse_options(sys.argv[2:], flags=('async',))
+        port = int(args[0]) if args else 9000
+        server_options = {'backlog': int(options.get('backlog', 1024)),
+                          'cache_entries': int(options.get('cache', 0))}
+        if 'metrics-port' in options:
+            server_options['metrics_port'] = int(options['metrics-port'])
+        if 'async' not in options:
+            server_options.update(num_workers=int(options.get('threads', 8)),
+                                  queue_size=int(options.get('queue', 256)))
+        processes = int(options.get('workers', 1))
+        if processes > 1:
+            instance = ServiceSupervisor(f"instance_{port}", port, processes,
+                                         use_async='async' in options,
+                                         server_options=server_options)
+        elif 'async' in options:
+            instance = AsyncServiceInstance(f"instance_{port}", port, **server_options)
+        else:
+            instance = ServiceInstance(f"instance_{port}", port, **server_options)
         try:
             instance.start()
         except KeyboardInterrupt:
@@ -796,7 +5717,11 @@ def main():
         strategies = [
             LoadBalancingStrategy.ROUND_ROBIN,
             LoadBalancingStrategy.LEAST_CONNECTIONS,
-            LoadBalancingStrategy.RANDOM
+            LoadBalancingStrategy.RANDOM,
+            LoadBalancingStrategy.P2C,
+            LoadBalancingStrategy.PEAK_EWMA,
+            LoadBalancingStrategy.CONSISTENT_HASH,
+            LoadBalancingStrategy.WEIGHTED_ROUND_ROBIN
         ]
         
         tester = Tester()
@@ -836,6 +5761,64 @@ def main():
         print("\n" + "="*50)
         print("All tests completed!")
     
+    elif mode == "bench-codec":
+        Benchmark().codec_throughput()
+    
+    elif mode == "bench-calc":
+        Benchmark().calculation()
+    
+    elif mode == "bench":
+        args, options = parse_options(sys.argv[2:], flags=('async',))
+        latencies = tuple(float(v) for v in options.get('latency', '0,0,0').split(','))
+        report = Benchmark().open_loop(
+            rate=float(options.get('rate', 500)),
+            duration=float(options.get('duration', 10)),
+            mix=options.get('mix', "sum=4,avg=2,min=1,max=1,multiply=1"),
+            sizes=options.get('sizes', "10=8,1000=2"),
+            strategy=LoadBalancingStrategy(options.get('strategy', 'least_connections')),
+            inject_latency=latencies,
+            error_rate=tuple(float(v) for v in options.get('error-rate', '0').split(',')),
+            use_async='async' in options,
+            codec=Codec[options.get('codec', 'binary').upper()],
+            deadline_ms=float(options.get('deadline-ms', 5000)),
+            seed=int(options['seed']) if 'seed' in options else None,
+            trace_path=options.get('record'),
+            metrics_port=int(options['metrics-port']) if 'metrics-port' in options else None)
+        text = json.dumps(report, indent=2)
+        if 'output' in options:
+            with open(options['output'], 'w') as f:
+                f.write(text + '\n')
+        print(text)
+
+    elif mode == "replay":
+        args, options = parse_options(sys.argv[2:], flags=('async', 'max-speed'))
+        if not args:
+            print("Usage: python3 rpc_assignment.py replay <trace.jsonl> [options]")
+            sys.exit(1)
+        report = Benchmark().replay(
+            args[0],
+            speed=0.0 if 'max-speed' in options else float(options.get('speed', 1.0)),
+            concurrency=int(options.get('concurrency', 64)),
+            strategy=LoadBalancingStrategy(options.get('strategy', 'least_connections')),
+            inject_latency=tuple(float(v) for v in options.get('latency', '0,0,0').split(',')),
+            error_rate=tuple(float(v) for v in options.get('error-rate', '0').split(',')),
+            use_async='async' in options,
+            codec=Codec[options.get('codec', 'binary').upper()],
+            metrics_port=int(options['metrics-port']) if 'metrics-port' in options else None)
+        text = json.dumps(report, indent=2)
+        if 'output' in options:
+            with open(options['output'], 'w') as f:
+                f.write(text + '\n')
+        print(text)
+
+    elif mode == "bench-client":
+        Benchmark().clients()
+    
+    elif mode == "bench-lb":
+        Benchmark().strategies()
+        Benchmark().strategies(base_port=9610, hedge_percentile=95)
+        Benchmark().selection()
+    
     else:
         print(f"Unknown mode: {mode}")
         sys.exit(1)